@@ -0,0 +1,221 @@
+import logging
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+from mesures import mesurer
+from utils import run_query_pool, chemin_entite, TAILLE_LOT_REQUETE
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Somme de contrôle d'une ligne F0101, calculée par le serveur (comme etat.py)
+CHK_F0101 = "CRC32(CONCAT_WS('|', ABAN8, ABALPH, ABTAX))"
+# Requêtes du rafraîchissement (analysées aussi par conseiller.py)
+SQL_VERIFICATION = f"SELECT COUNT(*) AS NB, SUM({CHK_F0101}) AS CHK FROM F0101 WHERE ABAN8 <= %s"
+SQL_NOUVEAUX = f"SELECT ABAN8, ABALPH, ABTAX, {CHK_F0101} AS CHK FROM F0101 WHERE ABAN8 > %s"
+SQL_COMPLET = f"SELECT ABAN8, ABALPH, ABTAX, {CHK_F0101} AS CHK FROM F0101 WHERE ABAN8 IS NOT NULL"
+# Correspondance d'un nom client avec l'annuaire (colonne CORRESPONDANCE de enrichir)
+EXACTE = "exacte"
+AMBIGUE = "ambiguë"
+ABSENTE = "absente"
+
+
+# -----------------------
+# ANNUAIRE CLIENTS (F0101)
+# -----------------------
+class AnnuaireClients:
+    """
+    Carnet d'adresses F0101 en mémoire, indexé par ABAN8 et par nom normalisé.
+
+    F0101 est lu en entier une seule fois, puis rafraîchi de façon
+    incrémentale : à chaque rafraîchissement, le serveur renvoie le nombre
+    de lignes et la somme des CRC32 des numéros déjà connus ; s'ils n'ont pas
+    changé, seuls les numéros au-delà du plus grand connu sont lus. Sinon
+    (ligne modifiée ou supprimée), l'annuaire est relu en entier.
+
+    L'annuaire peut être conservé dans un fichier local ([annuaire] chemin)
+    pour que les exécutions suivantes ne relisent que les nouveaux clients.
+    """
+
+    def __init__(self, chemin=None):
+        """
+        Args:
+            chemin (str): copie locale de l'annuaire (None : en mémoire seulement)
+        """
+        self.chemin = chemin
+        self.clients = None      # ABAN8 (index), ABALPH, ABTAX, NOM_NORMALISE
+        self.nb_lignes = 0
+        self.somme_controle = 0
+        self._par_nom = None
+        self._verrou = threading.Lock()
+        if chemin and os.path.exists(chemin):
+            try:
+                with open(chemin, 'rb') as f:
+                    self.clients, self.nb_lignes, self.somme_controle = pickle.load(f)
+                self._indexer()
+            except Exception as e:
+                logger.warning(f"Copie locale de l'annuaire illisible ({chemin}), relecture complète : {e}")
+                self.clients = None
+
+    @classmethod
+    def depuis_config(cls, config, entite=None):
+        """
+        Annuaire dont la copie locale est [annuaire] chemin (output/annuaire_f0101.pkl par défaut),
+        dans le sous-répertoire de l'entité pour la base d'une entité (voir utils.chemin_entite).
+        """
+        section = config['annuaire'] if config.has_section('annuaire') else {}
+        return cls(chemin_entite(section.get('chemin', os.path.join("output", "annuaire_f0101.pkl")), entite) or None)
+
+    def __len__(self):
+        return 0 if self.clients is None else len(self.clients)
+
+    @property
+    def cle_max(self):
+        return None if not len(self) else int(self.clients.index.max())
+
+    def rafraichir(self, pool, delais=None):
+        """
+        Met l'annuaire à jour depuis F0101 (lecture complète ou incrémentale).
+
+        En cas d'erreur de lecture (ou de délai dépassé), l'annuaire précédent est conservé.
+
+        Args:
+            pool: pool de connexions
+            delais (Delais): délai des requêtes et nouvelles tentatives (voir delais.py)
+
+        Returns:
+            AnnuaireClients: self
+        """
+        with self._verrou:
+            if self.clients is not None and self.cle_max is not None:
+                verif = run_query_pool(pool, SQL_VERIFICATION, [self.cle_max], taille_lot=TAILLE_LOT_REQUETE,
+                                       delais=delais, nom='annuaire/verification')
+                if not verif.empty and (int(verif.iloc[0]['NB']), _entier(verif.iloc[0]['CHK'])) == (
+                        self.nb_lignes, self.somme_controle):
+                    nouveaux = self._lire(pool, SQL_NOUVEAUX, [self.cle_max], delais)
+                    if nouveaux is not None:
+                        self._ajouter(nouveaux, remplacer=False)
+                        logger.info(f"Annuaire F0101 rafraîchi : {len(nouveaux)} nouveau(x) client(s).")
+                    return self
+                logger.info("Annuaire F0101 modifié depuis la dernière lecture : relecture complète.")
+
+            complet = self._lire(pool, SQL_COMPLET, [], delais)
+            if complet is not None:
+                self._ajouter(complet, remplacer=True)
+                logger.info(f"Annuaire F0101 chargé : {len(self)} client(s).")
+            return self
+
+    def vider(self):
+        """Oublie l'annuaire et sa copie locale : le prochain rafraîchissement relit F0101 en entier."""
+        with self._verrou:
+            self.clients, self._par_nom = None, None
+            self.nb_lignes, self.somme_controle = 0, 0
+            if self.chemin and os.path.exists(self.chemin):
+                os.remove(self.chemin)
+
+    def _lire(self, pool, sql, params, delais=None):
+        df = run_query_pool(pool, sql, params, taille_lot=TAILLE_LOT_REQUETE, delais=delais, nom='annuaire')
+        return None if df.columns.empty else df
+
+    def _ajouter(self, df, remplacer):
+        lignes, somme = len(df), sum(_entier(v) for v in df['CHK'])
+        df = df.drop(columns='CHK').assign(NOM_NORMALISE=normaliser_noms(df['ABALPH']))
+        df = df.astype({'ABAN8': 'int64'}).set_index('ABAN8')
+        if remplacer or self.clients is None:
+            self.clients, self.nb_lignes, self.somme_controle = df, lignes, somme
+        else:
+            self.clients = pd.concat([self.clients, df])
+            self.nb_lignes += lignes
+            self.somme_controle += somme
+        self._indexer()
+        if self.chemin:
+            os.makedirs(os.path.dirname(self.chemin) or ".", exist_ok=True)
+            temporaire = f"{self.chemin}.tmp"
+            with open(temporaire, 'wb') as f:
+                pickle.dump((self.clients, self.nb_lignes, self.somme_controle), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporaire, self.chemin)
+
+    def _indexer(self):
+        # Une ligne par nom normalisé, avec le nombre de numéros ABAN8 qui le portent (homonymes)
+        clients = self.clients.reset_index().sort_values('ABAN8', kind='stable')
+        self._par_nom = (clients.drop_duplicates('NOM_NORMALISE').set_index('NOM_NORMALISE')
+                         [['ABAN8', 'ABALPH', 'ABTAX']].assign(NB=clients.groupby('NOM_NORMALISE').size()))
+
+    def par_numero(self, numeros):
+        """Clients F0101 de numéros ABAN8 donnés (numéros inconnus ignorés)."""
+        if self.clients is None:
+            return pd.DataFrame(columns=['ABAN8', 'ABALPH', 'ABTAX'])
+        connus = self.clients.index.intersection(pd.Index(numeros).dropna().astype('int64'))
+        return self.clients.loc[connus, ['ABALPH', 'ABTAX']].rename_axis('ABAN8').reset_index()
+
+    def _correspondances(self, noms):
+        """
+        Correspondance de chaque nom normalisé avec l'annuaire :
+        - EXACTE : le nom est celui d'un seul client F0101 ;
+        - AMBIGUE : le nom est porté par plusieurs clients (homonymes), ou n'est
+          que le début d'un ou plusieurs noms de l'annuaire ("PUMA ENERGY" ->
+          "PUMA ENERGY BENIN", "PUMA ENERGY TOGO") ;
+        - ABSENTE : aucun nom de l'annuaire ne correspond.
+        """
+        # Nom vide (NULL) : jamais rattaché, même à un client F0101 sans nom
+        nb = np.where(noms != '', self._par_nom['NB'].reindex(noms).to_numpy(dtype=float), 0)
+        correspondances = np.where(nb == 1, EXACTE, np.where(nb > 1, AMBIGUE, ABSENTE)).astype(object)
+        inconnus = np.isnan(nb)
+        if inconnus.any() and len(self._par_nom):
+            # Recherche dichotomique dans les noms triés : le premier nom >= "NOM " commence par "NOM " s'il existe
+            tries = np.sort(self._par_nom.index.to_numpy(dtype=str))
+            prefixes = np.char.add(noms[inconnus].astype(str), ' ')
+            positions = np.minimum(np.searchsorted(tries, prefixes), len(tries) - 1)
+            correspondances[inconnus] = np.where(np.char.startswith(tries[positions], prefixes), AMBIGUE, ABSENTE)
+        return correspondances
+
+    def enrichir(self, df, colonne_nom='NOMUSU'):
+        """
+        Ajoute ABAN8, ABALPH et ABTAX aux lignes de `df` par leur nom client normalisé (une seule jointure).
+
+        Le client n'est rattaché que si son nom est celui d'un seul client F0101 :
+        un nom porté par plusieurs clients, ou qui n'est que le début d'autres noms,
+        n'est pas rattaché (le numéro ou l'identifiant fiscal d'un autre client
+        pourrait être retenu). La colonne CORRESPONDANCE (voir _correspondances)
+        signale ces lignes à vérifier (vide si l'annuaire n'a pas pu être lu).
+        Toutes les lignes sont conservées.
+
+        Returns:
+            DataFrame: colonnes de `df`, puis ABAN8, ABALPH, ABTAX, CORRESPONDANCE
+        """
+        with mesurer('transformation', 'enrichir_clients') as mesure:
+            if self._par_nom is None or df.empty:
+                resultat = df.assign(ABAN8=pd.array([pd.NA] * len(df), dtype='Int64'), ABALPH=None, ABTAX=None,
+                                     CORRESPONDANCE=None)
+            else:
+                noms = normaliser_noms(df[colonne_nom]).to_numpy(dtype=object)
+                correspondances = self._correspondances(noms)
+                trouves = self._par_nom.reindex(np.where(correspondances == EXACTE, noms, None))
+                resultat = df.assign(ABAN8=trouves['ABAN8'].astype('Int64').array,
+                                     ABALPH=trouves['ABALPH'].to_numpy(), ABTAX=trouves['ABTAX'].to_numpy(),
+                                     CORRESPONDANCE=correspondances)
+                ambigues = int((correspondances == AMBIGUE).sum())
+                if ambigues:
+                    logger.warning(f"Annuaire F0101 : {ambigues} ligne(s) client au nom ambigu (homonymes ou nom "
+                                   f"incomplet), non rattachée(s) (CORRESPONDANCE '{AMBIGUE}').")
+            mesure.lignes = len(resultat)
+        return resultat
+
+
+def normaliser_noms(noms):
+    """Noms comparables (vectorisé) : majuscules, sans accents ni ponctuation, espaces simples."""
+    if isinstance(noms.dtype, pd.CategoricalDtype):
+        # Noms clients en catégories (schemas.py) : chaque nom distinct normalisé une fois, '' pour NULL
+        normes = np.append(normaliser_noms(pd.Series(noms.cat.categories)).to_numpy(dtype=object), '')
+        return pd.Series(normes[noms.cat.codes.to_numpy()], index=noms.index, dtype=object)
+    return (noms.fillna('').astype(str).str.normalize('NFKD')
+            .str.encode('ascii', errors='ignore').str.decode('ascii')
+            .str.upper().str.replace(r"[^A-Z0-9\s]", "", regex=True)
+            .str.replace(r"\s+", " ", regex=True).str.strip())
+
+
+def _entier(valeur):
+    return 0 if valeur is None or pd.isna(valeur) else int(valeur)
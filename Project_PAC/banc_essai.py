@@ -0,0 +1,223 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from main import executer_controles
+from controles import CONTROLES
+from donnees_synthetiques import chemin_attendus
+from moteurs import PoolEmbarque
+from periode import parser_periodes, libelle_periodes
+from rapport import RapportExcel
+from snapshot import charger_snapshots
+from utils import get_db_pool, load_parametres
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Historique des campagnes de mesure, comparées d'une exécution à l'autre
+CHEMIN_RESULTATS = os.path.join("output", "banc_essai.sqlite")
+
+
+# -----------------------
+# MESURES
+# -----------------------
+def chronometrer(fonction, repetitions):
+    """
+    Exécute `fonction` `repetitions` fois.
+
+    Returns:
+        tuple: (durées en secondes, dernier résultat)
+    """
+    durees, resultat = [], None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        durees.append(time.perf_counter() - debut)
+    return durees, resultat
+
+
+def mesurer_controles(pool, periodes, repetitions=3, pipeline=True):
+    """
+    Mesure le chargement des snapshots, chaque contrôle isolément, puis l'exécution complète.
+
+    Chaque contrôle est exécuté sur des snapshots déjà chargés, caches vidés :
+    sa durée ne comprend ni les requêtes ni le travail partagé d'un autre contrôle.
+    L'exécution complète (main.executer_controles) écrit les classeurs et
+    construit les emails sans les envoyer.
+
+    Returns:
+        dict: {etape: {'durees': [...], 'lignes': int}}
+    """
+    resultats = {}
+    durees, snapshots = chronometrer(lambda: charger_snapshots(pool, periodes), repetitions)
+    resultats['snapshot'] = {'durees': durees,
+                             'lignes': sum(len(s.factures) for s in snapshots.values())}
+
+    for nom, controle in ((nom, c.fonction()) for nom, c in CONTROLES.items()):
+        def executer(nom=nom, controle=controle):
+            lignes = 0
+            for snapshot in snapshots.values():
+                snapshot._cache.clear()
+                resultat = controle(snapshot, RapportExcel(os.devnull).section(nom))
+                lignes += len(resultat[0] if isinstance(resultat, tuple) else resultat)
+            return lignes
+        durees, lignes = chronometrer(executer, repetitions)
+        resultats[nom] = {'durees': durees, 'lignes': lignes}
+
+    if pipeline:
+        durees, ok = chronometrer(lambda: executer_controles(periodes, pool=pool, envoyer_emails=False),
+                                  repetitions)
+        resultats['pipeline'] = {'durees': durees, 'lignes': None}
+        if not ok:
+            logger.error("Banc d'essai : exécution complète en erreur (voir le journal).")
+    return resultats
+
+
+def verifier_attendus(resultats, periodes, chemin):
+    """
+    Compare les lignes trouvées par chaque contrôle aux anomalies générées (donnees_synthetiques.py).
+
+    Returns:
+        dict: {controle: nombre attendu} ({} sans fichier d'anomalies attendues)
+    """
+    if not chemin or not os.path.exists(chemin):
+        return {}
+    with open(chemin, encoding='utf-8') as f:
+        par_periode = json.load(f)['attendus']
+    attendus = {nom: sum(par_periode.get(p.code, {}).get(nom, 0) for p in periodes) for nom in CONTROLES}
+    for nom, attendu in attendus.items():
+        trouve = resultats[nom]['lignes']
+        if trouve != attendu:
+            logger.warning(f"Banc d'essai : {nom} trouve {trouve} ligne(s), {attendu} attendue(s).")
+    return attendus
+
+
+# -----------------------
+# HISTORIQUE DES CAMPAGNES
+# -----------------------
+def _connexion_resultats(chemin):
+    os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+    conn = sqlite3.connect(chemin, timeout=30)
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS campagnes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, libelle TEXT, base TEXT,
+        am TEXT, factures INTEGER, repetitions INTEGER, version TEXT);
+    CREATE TABLE IF NOT EXISTS resultats (
+        campagne INTEGER, etape TEXT, duree_min REAL, duree_mediane REAL, duree_max REAL,
+        lignes INTEGER, attendu INTEGER, PRIMARY KEY (campagne, etape));
+    """)
+    return conn
+
+
+def enregistrer(chemin, campagne, resultats, attendus):
+    """
+    Enregistre une campagne et retourne les médianes de la précédente campagne comparable
+    (même base, mêmes périodes, même volume).
+
+    Returns:
+        dict: {etape: durée médiane précédente}
+    """
+    with _connexion_resultats(chemin) as conn:
+        precedente = conn.execute(
+            "SELECT id FROM campagnes WHERE base = ? AND am = ? AND factures = ? ORDER BY id DESC LIMIT 1",
+            (campagne['base'], campagne['am'], campagne['factures'])).fetchone()
+        references = dict(conn.execute(
+            "SELECT etape, duree_mediane FROM resultats WHERE campagne = ?", precedente)) if precedente else {}
+
+        identifiant = conn.execute(
+            "INSERT INTO campagnes (date, libelle, base, am, factures, repetitions, version) "
+            "VALUES (:date, :libelle, :base, :am, :factures, :repetitions, :version)", campagne).lastrowid
+        conn.executemany(
+            "INSERT INTO resultats VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(identifiant, etape, min(r['durees']), statistics.median(r['durees']), max(r['durees']),
+              r['lignes'], attendus.get(etape)) for etape, r in resultats.items()])
+    logger.info(f"Campagne {identifiant} enregistrée dans {chemin}.")
+    return references
+
+
+def afficher(resultats, references, attendus):
+    """Tableau texte des médianes, comparées à la campagne précédente."""
+    lignes = [f"{'étape':<12} {'médiane (s)':>12} {'min (s)':>9} {'précédente':>11} {'rapport':>8} "
+              f"{'lignes':>9} {'attendues':>9}"]
+    for etape, r in resultats.items():
+        mediane = statistics.median(r['durees'])
+        precedente = references.get(etape)
+        rapport = f"x{mediane / precedente:.2f}" if precedente else "-"
+        precedente = f"{precedente:.3f}" if precedente is not None else "-"
+        lignes.append(f"{etape:<12} {mediane:>12.3f} {min(r['durees']):>9.3f} "
+                      f"{precedente:>11} {rapport:>8} "
+                      f"{'-' if r['lignes'] is None else r['lignes']:>9} {attendus.get(etape, '-'):>9}")
+    return "\n".join(lignes)
+
+
+def _version():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# -----------------------
+# MAIN
+# -----------------------
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Banc d'essai des contrôles PGOP → JDE")
+    parser.add_argument("-am", type=str, required=True,
+                        help="Périodes mesurées (AAAAMM, plage ou liste, comme pour main.py)")
+    parser.add_argument("--sqlite", type=str, default=None,
+                        help="Base SQLite de donnees_synthetiques.py (par défaut : base de config.ini)")
+    parser.add_argument("--duckdb", type=str, default=None,
+                        help="Base DuckDB de donnees_synthetiques.py (par défaut : base de config.ini)")
+    parser.add_argument("--repetitions", type=int, default=3, help="Exécutions de chaque étape")
+    parser.add_argument("--sans-pipeline", action="store_true",
+                        help="Ne pas mesurer l'exécution complète (classeurs et emails)")
+    parser.add_argument("--libelle", type=str, default="", help="Libellé de la campagne")
+    parser.add_argument("--resultats", type=str, default=CHEMIN_RESULTATS,
+                        help="Historique SQLite des campagnes")
+    args = parser.parse_args()
+
+    try:
+        periodes = parser_periodes(args.am)
+    except ValueError as e:
+        parser.error(str(e))
+
+    parametres = load_parametres()
+    if args.sqlite or args.duckdb:
+        moteur, chemin = ('sqlite', args.sqlite) if args.sqlite else ('duckdb', args.duckdb)
+        pool = PoolEmbarque(moteur, chemin, parametres.pool_size)
+    else:
+        moteur, chemin = parametres.moteur, parametres.chemin_base or None
+        pool = get_db_pool()
+    base = (f"{moteur}:{os.path.abspath(chemin)}" if chemin
+            else f"mysql:{parametres.db.get('host')}/{parametres.db.get('database')}")
+
+    connection = pool.get_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM LQ_FACTURA_B")
+        factures = cursor.fetchall()[0][0]
+        cursor.close()
+    finally:
+        connection.close()
+
+    logger.info(f"Banc d'essai {libelle_periodes(periodes)} sur {base} ({factures} factures), "
+                f"{args.repetitions} répétition(s).")
+    resultats = mesurer_controles(pool, periodes, args.repetitions, pipeline=not args.sans_pipeline)
+    attendus = verifier_attendus(resultats, periodes, chemin_attendus(chemin))
+
+    campagne = {'date': datetime.now().isoformat(timespec='seconds'), 'libelle': args.libelle, 'base': base,
+                'am': ",".join(p.code for p in periodes), 'factures': factures,
+                'repetitions': args.repetitions, 'version': _version()}
+    references = enregistrer(args.resultats, campagne, resultats, attendus)
+    print(afficher(resultats, references, attendus))
+
+
+if __name__ == "__main__":
+    main()
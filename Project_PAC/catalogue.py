@@ -0,0 +1,393 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime
+
+import pandas as pd
+
+from delais import Delais
+from moteurs import MYSQL, dialecte_de
+from ordonnanceur import anticiper
+from schemas import appliquer_schema, concat_lots
+from utils import load_config, lots_bruts, LOTS_ANTICIPES
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Instructions préparées conservées par connexion (les plus anciennes sont libérées au-delà)
+MAX_PREPAREES_PAR_CONNEXION = 32
+
+
+# -----------------------
+# CATALOGUE DES REQUÊTES
+# -----------------------
+class CatalogueRequetes:
+    """
+    Requêtes des contrôles, exécutées avec des paramètres liés.
+
+    Le texte SQL est fourni à chaque exécution, jamais retrouvé par son nom :
+    une même requête (ex: 'factures') a plusieurs formes selon l'entité, le
+    nombre de périodes ou les options de [database], exécutées en même temps
+    par des entités différentes. Chaque forme a sa propre instruction
+    préparée et son propre plan ; le nom ne sert qu'au journal et aux plans.
+
+    Chaque requête est exécutée sur un curseur préparé (prepared=True), gardé
+    sur la connexion : tant que le pool ne réinitialise pas les sessions
+    (voir utils.get_db_pool), une même requête n'est analysée et planifiée
+    qu'une fois par connexion, pour toutes les périodes et exécutions du
+    processus.
+
+    Le plan EXPLAIN de chaque requête est enregistré dans une base SQLite
+    (table `plans`) ; un plan différent du dernier connu est journalisé
+    comme régression potentielle.
+    """
+
+    def __init__(self, chemin_plans=None):
+        """
+        Args:
+            chemin_plans (str): fichier SQLite des plans EXPLAIN (None : pas d'enregistrement)
+        """
+        self.chemin_plans = chemin_plans
+        self._expliquees = set()
+        self._verrou = threading.Lock()
+        if chemin_plans:
+            os.makedirs(os.path.dirname(chemin_plans) or ".", exist_ok=True)
+            with sqlite3.connect(chemin_plans, timeout=30) as conn:
+                conn.execute("""
+                CREATE TABLE IF NOT EXISTS plans (
+                    nom TEXT, empreinte TEXT, sql TEXT, plan TEXT, date TEXT)""")
+
+    def executer(self, connection, nom, sql, params=None, taille_lot=None, schema=None):
+        """
+        Exécute une requête sur un curseur préparé de la connexion.
+
+        Args:
+            connection: connexion MySQL (empruntée au pool)
+            nom (str): nom de la requête (journal, plans EXPLAIN)
+            sql (str): texte de la requête
+            params (list): valeurs des marqueurs %s
+            taille_lot (int): lignes lues à la fois (None : tout le résultat)
+            schema (str): table de schemas.SCHEMAS, types compacts appliqués à chaque lot lu
+
+        Returns:
+            DataFrame: résultat, vide (sans colonnes) en cas d'erreur, comme utils.run_query
+        """
+        try:
+            return self._lire(connection, nom, sql, params, taille_lot, schema)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'exécution de la requête '{nom}': {e}")
+            return pd.DataFrame()
+
+    def executer_pool(self, pool, nom, sql, params=None, taille_lot=None, schema=None, delais=None):
+        """
+        Comme executer(), sur une connexion empruntée au pool.
+
+        Args:
+            delais (Delais): délai de la requête et nouvelles tentatives sur erreur transitoire
+                (voir delais.py ; par défaut : sans délai, une seule tentative)
+        """
+        delais = delais or Delais()
+        try:
+            return delais.executer(pool, lambda connection: self._lire(connection, nom, sql, params, taille_lot,
+                                                                       schema, delais), nom)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'exécution de la requête '{nom}': {e}")
+            return pd.DataFrame()
+
+    def _lire(self, connection, nom, sql, params=None, taille_lot=None, schema=None, delais=None):
+        # Plan EXPLAIN de la requête ; exécution bornée par MAX_EXECUTION_TIME (voir delais.py)
+        execute = delais.borner(sql) if delais is not None else sql
+        try:
+            if self.chemin_plans:
+                self._expliquer(connection, nom, sql, params)
+            cursor = _curseur_prepare(connection, execute)
+            cursor.execute(execute, tuple(params or ()))
+            colonnes = [d[0] for d in cursor.description]
+            # Par lots : lots suivants lus d'avance pendant la conversion (voir utils.run_query_par_lots)
+            if taille_lot:
+                with closing(anticiper(lots_bruts(cursor, taille_lot), LOTS_ANTICIPES,
+                                       nom=f"lecture-{nom}")) as lectures:
+                    lots = [appliquer_schema(pd.DataFrame.from_records(lignes, columns=colonnes), schema)
+                            for lignes in lectures if lignes]
+            else:
+                lignes = cursor.fetchall()
+                lots = [appliquer_schema(pd.DataFrame.from_records(lignes, columns=colonnes), schema)] if lignes else []
+            df = concat_lots(lots, schema) if lots else pd.DataFrame(columns=colonnes)
+            logger.info(f"Requête '{nom}' exécutée (préparée). {len(df)} lignes récupérées.")
+            return df
+        except Exception:
+            _oublier_curseur(connection, execute)
+            raise
+
+    def _expliquer(self, connection, nom, sql, params):
+        dialecte = dialecte_de(connection)
+        # Un plan par moteur : les empreintes MySQL restent celles des exécutions précédentes
+        texte = sql if dialecte is MYSQL else f"{dialecte.nom}:{sql}"
+        empreinte = hashlib.sha1(texte.encode('utf-8')).hexdigest()
+        with self._verrou:
+            if empreinte in self._expliquees:
+                return
+            self._expliquees.add(empreinte)
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(dialecte.expliquer(sql), tuple(params or ()))
+                lignes = cursor.fetchall()
+                plan = _plan_normalise(lignes)
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.warning(f"EXPLAIN impossible pour la requête '{nom}': {e}")
+            return
+
+        with self._verrou, sqlite3.connect(self.chemin_plans, timeout=30) as conn:
+            precedent = conn.execute(
+                "SELECT plan FROM plans WHERE empreinte = ? ORDER BY date DESC, rowid DESC LIMIT 1",
+                (empreinte,)).fetchone()
+            if precedent is not None and precedent[0] == plan:
+                return
+            conn.execute("INSERT INTO plans (nom, empreinte, sql, plan, date) VALUES (?, ?, ?, ?, ?)",
+                         (nom, empreinte, sql, plan, datetime.now().isoformat(timespec='seconds')))
+        if precedent is None:
+            logger.info(f"Plan EXPLAIN de la requête '{nom}' enregistré.")
+        else:
+            logger.warning(f"Plan EXPLAIN de la requête '{nom}' modifié depuis la dernière exécution "
+                           f"(voir {self.chemin_plans}).")
+        # Nouveau plan : signaler tout de suite une table parcourue en entier pour chaque ligne
+        for acces in analyser_plan(dialecte, lignes, sql) or []:
+            if acces.repete:
+                logger.warning(f"Requête '{nom}' : {acces.alerte} sur {acces.table} "
+                               f"(voir main.py --conseiller).")
+
+    def plans(self, nom=None):
+        """
+        Historique des plans enregistrés.
+
+        Args:
+            nom (str): requête (par défaut : toutes)
+
+        Returns:
+            DataFrame: nom, empreinte, date, plan
+        """
+        with sqlite3.connect(self.chemin_plans, timeout=30) as conn:
+            return pd.read_sql(
+                "SELECT nom, empreinte, date, plan FROM plans"
+                + (" WHERE nom = ?" if nom else "") + " ORDER BY date, rowid",
+                conn, params=(nom,) if nom else None)
+
+
+_catalogue = None
+_verrou_catalogue = threading.Lock()
+
+
+def obtenir_catalogue():
+    """
+    Catalogue partagé du processus, ou None si [database] instructions_preparees est faux.
+
+    Les plans EXPLAIN sont enregistrés dans [database] plans_explain
+    (output/plans_explain.sqlite par défaut, vide : pas d'enregistrement).
+    """
+    global _catalogue
+    database = load_config()['database']
+    if not database.getboolean('instructions_preparees', fallback=True):
+        return None
+    with _verrou_catalogue:
+        if _catalogue is None:
+            chemin = database.get('plans_explain', fallback=os.path.join("output", "plans_explain.sqlite"))
+            _catalogue = CatalogueRequetes(chemin or None)
+        return _catalogue
+
+
+# -----------------------
+# ANALYSE DES PLANS
+# -----------------------
+@dataclass
+class Acces:
+    """
+    Accès à une table dans un plan EXPLAIN.
+
+    Attributes:
+        table (str): table lue (alias résolu)
+        parcours (str): 'complet' (toute la table), 'index_complet' (tout un index),
+            'index_temporaire' (index construit par le moteur pour la requête) ou 'cle'
+        dependante (bool): dans une sous-requête dépendante, réévaluée pour chaque ligne externe
+        sondee (bool): table interne d'une boucle imbriquée, relue pour chaque ligne externe
+        detail (str): ligne du plan
+    """
+    table: str
+    parcours: str
+    dependante: bool = False
+    sondee: bool = False
+    detail: str = ""
+
+    @property
+    def complet(self):
+        return self.parcours in ('complet', 'index_temporaire')
+
+    @property
+    def repete(self):
+        """Parcours complet répété pour chaque ligne externe : le coût croît avec le produit des tables."""
+        return self.complet and (self.dependante or self.sondee)
+
+    @property
+    def alerte(self):
+        """Libellé du problème (None : accès par clé hors sous-requête dépendante)."""
+        if self.repete:
+            return "parcours complet dans une sous-requête dépendante" if self.dependante \
+                else "parcours complet répété (boucle imbriquée)"
+        if self.parcours == 'index_temporaire':
+            return "index temporaire construit à chaque exécution"
+        if self.complet:
+            return "parcours complet"
+        if self.dependante:
+            return "sous-requête dépendante"
+        return None
+
+
+def analyser_plan(dialecte, lignes, sql):
+    """
+    Accès aux tables d'un plan EXPLAIN (MySQL FORMAT=JSON ou SQLite EXPLAIN QUERY PLAN).
+
+    Args:
+        dialecte (Dialecte): moteur du plan
+        lignes (list): lignes renvoyées par dialecte.expliquer(sql)
+        sql (str): requête expliquée (résolution des alias)
+
+    Returns:
+        list: Acces dans l'ordre du plan, None si le moteur n'est pas pris en charge
+            (DuckDB : moteur en colonnes, sans index secondaire pour les jointures)
+    """
+    alias = _alias_tables(sql)
+    if dialecte.nom == 'mysql':
+        return _acces_mysql(lignes, alias)
+    if dialecte.nom == 'sqlite':
+        return _acces_sqlite(lignes, alias)
+    return None
+
+
+# Types d'accès MySQL / MariaDB (access_type) autres que par clé
+_PARCOURS_MYSQL = {'ALL': 'complet', 'index': 'index_complet'}
+_MOTS_SQL = {'WHERE', 'INNER', 'LEFT', 'RIGHT', 'JOIN', 'ON', 'AND', 'OR', 'GROUP', 'ORDER', 'LIMIT'}
+
+
+def _alias_tables(sql):
+    alias = {}
+    for table, nom in re.findall(r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        alias[table] = table
+        if nom and nom.upper() not in _MOTS_SQL:
+            alias[nom] = table
+    return alias
+
+
+def _acces_mysql(lignes, alias):
+    acces = []
+
+    def parcourir(noeud, dependante=False, sondee=False):
+        if isinstance(noeud, list):
+            for element in noeud:
+                parcourir(element, dependante, sondee)
+            return
+        if not isinstance(noeud, dict):
+            return
+        dependante = dependante or bool(noeud.get('dependent'))
+        if 'table_name' in noeud and 'access_type' in noeud:
+            # Jointure par hachage (MySQL 8) : la table interne n'est lue qu'une fois
+            hachage = 'hash' in str(noeud.get('using_join_buffer', '')).lower()
+            acces.append(Acces(alias.get(noeud['table_name'], noeud['table_name']),
+                               _PARCOURS_MYSQL.get(noeud['access_type'], 'cle'), dependante,
+                               sondee and not hachage,
+                               f"access_type={noeud['access_type']}, key={noeud.get('key')}"))
+        for cle, valeur in noeud.items():
+            if cle == 'nested_loop' and isinstance(valeur, list):
+                for position, element in enumerate(valeur):
+                    parcourir(element, dependante, sondee or position > 0)
+            elif isinstance(valeur, (dict, list)):
+                parcourir(valeur, dependante, sondee)
+
+    for ligne in lignes:
+        try:
+            parcourir(json.loads(ligne[0]))
+        except (TypeError, ValueError):
+            continue
+    return acces
+
+
+def _acces_sqlite(lignes, alias):
+    # Lignes (id, parent, inutilisé, détail) ; les boucles d'une jointure sont des nœuds frères
+    noeuds = {ligne[0]: (ligne[1], ligne[3]) for ligne in lignes}
+    acces, boucles = [], {}
+    for identifiant, (parent, detail) in noeuds.items():
+        trouve = re.match(r"(SCAN|SEARCH) (\w+)(?: AS (\w+))?(.*)", detail)
+        if not trouve:
+            continue
+        operation, nom, _, suite = trouve.groups()
+        ancetres, courant = [], parent
+        while courant in noeuds:
+            ancetres.append(noeuds[courant][1])
+            courant = noeuds[courant][0]
+        if 'AUTOMATIC' in suite:
+            parcours = 'index_temporaire'
+        elif operation == 'SEARCH':
+            parcours = 'cle'
+        else:
+            parcours = 'index_complet' if 'INDEX' in suite else 'complet'
+        position = boucles.get(parent, 0)
+        boucles[parent] = position + 1
+        acces.append(Acces(alias.get(nom, nom), parcours, any('CORRELATED' in a for a in ancetres),
+                           position > 0, detail))
+    return acces
+
+
+def _plan_normalise(lignes):
+    """Plan JSON sans les estimations de coût et de lignes, qui varient avec les statistiques."""
+    volatiles = {'cost_info', 'rows_examined_per_scan', 'rows_produced_per_join', 'filtered'}
+
+    def nettoyer(noeud):
+        if isinstance(noeud, dict):
+            return {k: nettoyer(v) for k, v in noeud.items() if k not in volatiles}
+        if isinstance(noeud, list):
+            return [nettoyer(v) for v in noeud]
+        return noeud
+
+    textes = [ligne[0] for ligne in lignes]
+    try:
+        return json.dumps([nettoyer(json.loads(t)) for t in textes], sort_keys=True)
+    except (TypeError, ValueError):
+        return json.dumps([str(ligne) for ligne in lignes])
+
+
+def _connexion_physique(connection):
+    # Une connexion de pool enveloppe la connexion MySQL réelle, qui porte les instructions préparées
+    return getattr(connection, '_cnx', connection)
+
+
+def _curseur_prepare(connection, sql):
+    physique = _connexion_physique(connection)
+    curseurs = getattr(physique, '_curseurs_prepares', None)
+    if curseurs is None:
+        curseurs = physique._curseurs_prepares = OrderedDict()
+    cursor = curseurs.get(sql)
+    if cursor is None:
+        cursor = connection.cursor(prepared=True)
+        curseurs[sql] = cursor
+        while len(curseurs) > MAX_PREPAREES_PAR_CONNEXION:
+            _, ancien = curseurs.popitem(last=False)
+            ancien.close()
+    else:
+        curseurs.move_to_end(sql)
+    return cursor
+
+
+def _oublier_curseur(connection, sql):
+    curseurs = getattr(_connexion_physique(connection), '_curseurs_prepares', None)
+    if curseurs and sql in curseurs:
+        try:
+            curseurs.pop(sql).close()
+        except Exception:
+            pass
@@ -0,0 +1,265 @@
+import logging
+import os
+import re
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from annuaire import SQL_VERIFICATION, SQL_NOUVEAUX
+from catalogue import analyser_plan
+from moteurs import MOTEURS_EMBARQUES, dialecte_de
+from snapshot import requetes_sources
+from utils import load_config, run_query_pool, TAILLE_LOT_REQUETE
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Tables dont le filtre de période devient un intervalle indexé avec migrations/001
+TABLES_PERIODE = ('LQ_FACTURA_B', 'F58PGOP1', 'F03B11')
+MIGRATION_PERIODE = "migrations/001_colonnes_periode.sql + [database] predicats_indexes = true"
+MIGRATION_INDEX = "migrations/002_index_rapprochement.sql"
+
+
+# -----------------------
+# INDEX CONSEILLÉS
+# -----------------------
+@dataclass(frozen=True)
+class IndexConseille:
+    """
+    Index d'une clé de rapprochement ou d'un filtre des contrôles.
+
+    Attributes:
+        table (str): table indexée
+        nom (str): nom de l'index (celui de migrations/002)
+        colonnes (tuple): colonnes de l'index ; la première est la clé recherchée
+        motif (str): requêtes servies
+    """
+    table: str
+    nom: str
+    colonnes: tuple
+    motif: str
+
+    def ddl(self, dialecte):
+        return dialecte.creer_index(self.table, self.nom, self.colonnes)
+
+
+# Mêmes index que migrations/002_index_rapprochement.sql
+INDEX_CONSEILLES = (
+    IndexConseille('F58PGOP1', 'IX_F58PGOP1_PGCCID', ('PGCCID', 'PGEV01'),
+                   "sous-requêtes RPDOC / IDINTERNO IN (SELECT PGCCID ...) des tables f03b11 et clients_code4"),
+    IndexConseille('F58PGOP1', 'IX_F58PGOP1_PGASID', ('PGASID',),
+                   "rapprochement FCABFAC.IDFACTURA / F58PGOP1.PGASID (contrôle 2)"),
+    IndexConseille('F58PGOP1', 'IX_F58PGOP1_PGEV01', ('PGEV01', 'PGCCID'),
+                   "lignes rejetées en code 4 (clients_code4)"),
+    IndexConseille('F0101', 'IX_F0101_ABAN8', ('ABAN8',),
+                   "rafraîchissement incrémental de l'annuaire (ABAN8 > plus grand connu)"),
+)
+
+
+@dataclass
+class Diagnostic:
+    """
+    Analyse d'une requête des contrôles.
+
+    Attributes:
+        nom (str): requête (table du snapshot ou de l'annuaire)
+        sql (str): requête
+        params (list): paramètres liés
+        acces (list): catalogue.Acces du plan (None : moteur non analysé)
+        index (list): IndexConseille absents de la base, utiles à la requête
+        conseils (list): autres conseils (migration des colonnes de période)
+        durees (list): durées mesurées avant application des index (s)
+        durees_apres (list): durées mesurées après application (s)
+        acces_apres (list): accès du plan après application
+    """
+    nom: str
+    sql: str
+    params: list
+    acces: list = None
+    index: list = field(default_factory=list)
+    conseils: list = field(default_factory=list)
+    durees: list = field(default_factory=list)
+    durees_apres: list = field(default_factory=list)
+    acces_apres: list = None
+
+    @property
+    def alertes(self):
+        return [f"{a.alerte} : {a.table}" for a in self.acces or [] if a.alerte]
+
+
+def requetes_conseillees(periodes, indexe=False, strategie='auto'):
+    """
+    Requêtes analysées : chargement des tables sources (voir snapshot.requetes_sources)
+    et rafraîchissement de l'annuaire F0101.
+
+    Returns:
+        dict: {nom: (sql, params)}
+    """
+    requetes = {nom: (r.sql, r.params or []) for nom, r in requetes_sources(periodes, indexe, strategie).items()}
+    requetes['annuaire_verification'] = (SQL_VERIFICATION, [0])
+    requetes['annuaire_nouveaux'] = (SQL_NOUVEAUX, [0])
+    return requetes
+
+
+# -----------------------
+# ANALYSE
+# -----------------------
+def conseiller(pool, periodes, appliquer=False, repetitions=3, fichier_ddl=None):
+    """
+    Analyse le plan EXPLAIN de chaque requête des contrôles, propose les index
+    manquants et, sur une base locale (SQLite), les crée puis mesure à nouveau.
+
+    Args:
+        pool: pool de connexions (utils.get_db_pool ou moteurs.PoolEmbarque)
+        periodes (list): périodes des requêtes analysées
+        appliquer (bool): créer les index proposés (base locale uniquement)
+        repetitions (int): exécutions chronométrées de chaque requête (0 : pas de mesure)
+        fichier_ddl (str): script SQL des index proposés (None : pas de script)
+
+    Returns:
+        list: Diagnostic par requête
+
+    Raises:
+        ValueError: application demandée sur la base MySQL de production
+    """
+    database = load_config()['database']
+    indexe = database.getboolean('predicats_indexes', fallback=False)
+    strategie = database.get('anti_jointure', fallback='auto')
+
+    connection = pool.get_connection()
+    try:
+        dialecte = dialecte_de(connection)
+        if appliquer and dialecte.nom not in MOTEURS_EMBARQUES:
+            raise ValueError(f"Index créés sur une base locale seulement : sur MySQL, appliquer {MIGRATION_INDEX}")
+        existants = {table: _index_existants(connection, table) for table in {i.table for i in INDEX_CONSEILLES}}
+        diagnostics = []
+        for nom, (sql, params) in requetes_conseillees(periodes, indexe, strategie).items():
+            diagnostic = Diagnostic(nom, sql, params, acces=_expliquer(connection, sql, params))
+            _proposer(diagnostic, existants, indexe)
+            diagnostics.append(diagnostic)
+    finally:
+        connection.close()
+
+    if all(d.acces is None for d in diagnostics):
+        logger.warning(f"Plans {dialecte.nom} non analysés : seuls MySQL et SQLite sont pris en charge.")
+    for diagnostic in diagnostics:
+        diagnostic.durees = _chronometrer(pool, diagnostic, repetitions)
+
+    a_creer = list(dict.fromkeys(i for d in diagnostics for i in d.index))
+    if fichier_ddl and a_creer:
+        ecrire_ddl(fichier_ddl, a_creer, dialecte)
+    if appliquer and a_creer:
+        connection = pool.get_connection()
+        try:
+            cursor = connection.cursor()
+            for index in a_creer:
+                logger.info(f"Création de l'index {index.nom} sur {index.table}")
+                cursor.execute(index.ddl(dialecte))
+            connection.commit()
+            cursor.close()
+            for diagnostic in diagnostics:
+                diagnostic.acces_apres = _expliquer(connection, diagnostic.sql, diagnostic.params)
+        finally:
+            connection.close()
+        for diagnostic in diagnostics:
+            diagnostic.durees_apres = _chronometrer(pool, diagnostic, repetitions)
+    return diagnostics
+
+
+def _expliquer(connection, sql, params):
+    dialecte = dialecte_de(connection)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(dialecte.expliquer(sql), tuple(params or ()))
+        return analyser_plan(dialecte, cursor.fetchall(), sql)
+    except Exception as e:
+        logger.warning(f"EXPLAIN impossible : {e}")
+        return None
+    finally:
+        cursor.close()
+
+
+def _index_existants(connection, table):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(dialecte_de(connection).liste_index, (table,))
+        return {ligne[0].upper() for ligne in cursor.fetchall()}
+    except Exception as e:
+        logger.warning(f"Index de {table} illisibles : {e}")
+        return set()
+    finally:
+        cursor.close()
+
+
+def _colonnes_jointure(sql):
+    # Clés comparées à une autre colonne, ou renvoyées par une sous-requête IN (SELECT col ...)
+    colonnes = set(re.findall(r"\bIN\s*\(\s*SELECT\s+(?:\w+\.)?(\w+)", sql, re.IGNORECASE))
+    for gauche, droite in re.findall(r"(?:\w+\.)?(\w+)\s*=\s*(?:\w+\.)(\w+)", sql):
+        colonnes.update((gauche, droite))
+    return colonnes
+
+
+def _colonnes_filtre(sql):
+    # Colonnes comparées à un paramètre ou à une constante
+    return set(re.findall(r"(?:\w+\.)?(\w+)\s*(?:=|>=|<=|>|<|LIKE)\s*(?:%s|\?|'|\d)", sql, re.IGNORECASE)
+               + re.findall(r"(?:\w+\.)?(\w+)\s+(?:IS|BETWEEN)\b", sql, re.IGNORECASE))
+
+
+def _proposer(diagnostic, existants, indexe):
+    """Index manquants des tables parcourues en entier : clé de jointure si la table est relue, filtre sinon."""
+    jointures, filtres = _colonnes_jointure(diagnostic.sql), _colonnes_filtre(diagnostic.sql)
+    for acces in diagnostic.acces or []:
+        if not acces.complet:
+            continue
+        colonnes = jointures if acces.repete else filtres
+        for index in INDEX_CONSEILLES:
+            if (index.table == acces.table and index.colonnes[0] in colonnes
+                    and index.nom.upper() not in existants.get(index.table, set())
+                    and index not in diagnostic.index):
+                diagnostic.index.append(index)
+        if acces.table in TABLES_PERIODE and not indexe and not acces.repete:
+            conseil = f"période {acces.table} : {MIGRATION_PERIODE}"
+            if conseil not in diagnostic.conseils:
+                diagnostic.conseils.append(conseil)
+
+
+def _chronometrer(pool, diagnostic, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        run_query_pool(pool, diagnostic.sql, diagnostic.params, taille_lot=TAILLE_LOT_REQUETE)
+        durees.append(time.perf_counter() - debut)
+    return durees
+
+
+# -----------------------
+# RAPPORT
+# -----------------------
+def ecrire_ddl(chemin, index, dialecte):
+    """Script SQL des index proposés, à relire avant application (voir migrations/002)."""
+    os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+    with open(chemin, 'w', encoding='utf-8') as f:
+        f.write(f"-- Index proposés par main.py --conseiller ({dialecte.nom}, "
+                f"{datetime.now().isoformat(timespec='seconds')})\n")
+        for i in index:
+            f.write(f"\n-- {i.motif}\n{dialecte.traduire(i.ddl(dialecte))};\n")
+    logger.info(f"Script des index proposés écrit : {chemin}")
+
+
+def afficher(diagnostics):
+    """Rapport texte : alertes, index proposés et durées médianes avant / après."""
+    def mediane(durees):
+        return f"{statistics.median(durees):.3f}" if durees else "-"
+
+    lignes = [f"{'requête':<24} {'avant (s)':>10} {'après (s)':>10}  alertes"]
+    for d in diagnostics:
+        alertes = "plan non analysé" if d.acces is None else "; ".join(d.alertes) or "aucune"
+        lignes.append(f"{d.nom:<24} {mediane(d.durees):>10} {mediane(d.durees_apres):>10}  {alertes}")
+        if d.acces_apres is not None:
+            restantes = [f"{a.alerte} : {a.table}" for a in d.acces_apres if a.alerte]
+            lignes.append(f"{'':<24} {'':>21}  après : {'; '.join(restantes) or 'aucune'}")
+        for index in d.index:
+            lignes.append(f"{'':<24} {'':>21}  index : {index.nom} ({', '.join(index.colonnes)})")
+        for conseil in d.conseils:
+            lignes.append(f"{'':<24} {'':>21}  {conseil}")
+    return "\n".join(lignes)
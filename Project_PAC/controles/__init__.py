@@ -1,5 +1,76 @@
-from .controle_1 import controle_1
-from .controle_2 import controle_2
-from .controle_3 import controle_3
-from .controle_4 import controle_4
-from .controle_5 import controle_5
+import importlib
+from dataclasses import dataclass
+
+
+# -----------------------
+# REGISTRE DES CONTRÔLES
+# -----------------------
+@dataclass(frozen=True)
+class Controle:
+    """
+    Contrôle disponible, importé à sa première utilisation seulement.
+
+    Attributes:
+        nom (str): nom du contrôle, de son module et de sa fonction (controle_1 ...)
+        description (str): objet du contrôle
+        tables (tuple): tables du snapshot lues par le contrôle (voir snapshot.TABLES_SNAPSHOT)
+        annuaire (bool): le contrôle utilise l'annuaire clients F0101
+    """
+    nom: str
+    description: str
+    tables: tuple
+    annuaire: bool = False
+
+    @property
+    def numero(self):
+        return self.nom.rsplit('_', 1)[-1]
+
+    def fonction(self):
+        """Fonction du contrôle (le module est importé au premier appel)."""
+        return getattr(importlib.import_module(f"{__name__}.{self.nom}"), self.nom)
+
+
+CONTROLES = {controle.nom: controle for controle in (
+    Controle('controle_1', "Factures LQ_FACTURA_B absentes de FCABFAC", ('factures', 'cabfac')),
+    Controle('controle_2', "Factures FCABFAC transmissibles absentes de F58PGOP1", ('factures', 'cabfac', 'pgop1')),
+    Controle('controle_3', "Lignes F58PGOP1 absentes de F03B11", ('pgop1', 'f03b11', 'hors_compta')),
+    Controle('controle_4', "Lignes F58PGOP1 en code 4, clients et identifiants fiscaux",
+             ('pgop1', 'f03b11', 'hors_compta', 'clients_code4'), annuaire=True),
+    Controle('controle_5', "Écarts de montants LQ_FACTURA_B / F03B11", ('factures', 'f03b11')),
+)}
+
+
+def selectionner_controles(selection=None):
+    """
+    Contrôles désignés par une sélection, dans l'ordre du registre.
+
+    Args:
+        selection (str): numéros ou noms séparés par des virgules, plages acceptées :
+            '1,3,5', '2-4', 'controle_2' ; vide ou None : tous les contrôles
+
+    Returns:
+        list: Controle sélectionnés
+
+    Raises:
+        ValueError: contrôle inconnu
+    """
+    if not selection or not selection.strip():
+        return list(CONTROLES.values())
+    numeros = {c.numero: c.nom for c in CONTROLES.values()}
+    noms = set()
+    for element in (e.strip() for e in selection.split(',') if e.strip()):
+        element = element.removeprefix('controle_')
+        if '-' in element:
+            debut, _, fin = element.partition('-')
+            if not (debut.isdigit() and fin.removeprefix('controle_').isdigit()):
+                raise ValueError(f"Plage de contrôles invalide : {element}")
+            bornes = range(int(debut), int(fin.removeprefix('controle_')) + 1)
+            inconnus = [str(n) for n in bornes if str(n) not in numeros]
+            if inconnus or not bornes:
+                raise ValueError(f"Contrôle(s) inconnu(s) : {', '.join(inconnus) or element}")
+            noms.update(numeros[str(n)] for n in bornes)
+        elif element in numeros:
+            noms.add(numeros[element])
+        else:
+            raise ValueError(f"Contrôle inconnu : {element} (disponibles : {', '.join(numeros)})")
+    return [c for nom, c in CONTROLES.items() if nom in noms]
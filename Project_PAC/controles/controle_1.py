@@ -1,47 +1,43 @@
 import logging
 import os
-from utils import run_query, save_to_excel
+from snapshot import ETATS_FACTURE
+from utils import anti_jointure
 
 logger = logging.getLogger("PGOP_JDE_Control")
 
-def controle_1(conn, year, month, output_file):
+def controle_1(snapshot, rapport):
     """
     Contrôle 1: Vérifie les factures non-transmises de LQ_FACTURA_B dans FCABFAC.
 
     Args:
-        conn: connexion à la base de données
-        year (str): année AAAA
-        month (str): mois MM
-        output_file (str): chemin fichier Excel pour sauvegarde
+        snapshot (Snapshot): données sources de la période
+        rapport (SectionRapport): section du rapport Excel recevant les feuilles
 
     Returns:
         tuple: (df_all, df_L, df_F, df_autres)
     """
     logger.info("Début du Contrôle 1")
 
-    query = f"""
-    SELECT IDINTERNO, NUMFACTURA, ESTADO, FECFACTURA
-    FROM LQ_FACTURA_B
-    WHERE ESTADO IN ('R','A','C','N','F','G','H','K','L','E','J','V')
-    AND FECFACTURA LIKE '%/{month}/{year}'
-    AND BFUSIC IS NULL
-    AND IDINTERNO NOT IN (SELECT IDFACTURA FROM FCABFAC)
-    ORDER BY IDINTERNO
-    """
-    df_all = run_query(conn, query)
+    df_factures = snapshot.factures
+    df_all = df_factures
+    if not df_factures.empty:
+        df_all = anti_jointure(
+            df_factures[df_factures['ESTADO'].isin(ETATS_FACTURE)], 'IDINTERNO',
+            snapshot.cabfac, 'IDFACTURA', strategie=snapshot.strategie
+        )[['IDINTERNO', 'NUMFACTURA', 'ESTADO', 'FECFACTURA']].sort_values('IDINTERNO', kind='stable')
 
     df_L = df_all[df_all['ESTADO'] == 'L']
     df_F = df_all[df_all['ESTADO'] == 'F']
     df_autres = df_all[(df_all['ESTADO'] != 'L') & (df_all['ESTADO'] != 'F')]
 
     if not df_all.empty:
-        save_to_excel(df_all, "Contrôle1_Toutes_Manquantes", output_file)
+        rapport.ajouter(df_all, "Contrôle1_Toutes_Manquantes")
     if not df_L.empty:
-        save_to_excel(df_L, "Contrôle1_ETAT_L", output_file)
+        rapport.ajouter(df_L, "Contrôle1_ETAT_L")
     if not df_F.empty:
-        save_to_excel(df_F, "Contrôle1_ETAT_F", output_file)
+        rapport.ajouter(df_F, "Contrôle1_ETAT_F")
     if not df_autres.empty:
-        save_to_excel(df_autres, "Contrôle1_Autres_Etats", output_file)
+        rapport.ajouter(df_autres, "Contrôle1_Autres_Etats")
 
     logger.info(f"Contrôle 1 terminé : {len(df_all)} factures manquantes.")
     return df_all, df_L, df_F, df_autres
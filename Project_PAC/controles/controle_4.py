@@ -1,59 +1,43 @@
 import logging
-from utils import run_query, save_to_excel
 
 logger = logging.getLogger("PGOP_JDE_Control")
 
-def controle_4(conn, year, month, output_file):
+def controle_4(snapshot, rapport):
     """
     Contrôle 4: Vérifie les factures non transmises avec CODE 4.
 
     Args:
-        conn: connexion à la base de données
-        year (str): année AAAA
-        month (str): mois MM
-        output_file (str): chemin fichier Excel pour sauvegarde
+        snapshot (Snapshot): données sources de la période
+        rapport (SectionRapport): section du rapport Excel recevant les feuilles
 
     Returns:
         DataFrame: factures avec code 4
     """
     logger.info("Début du Contrôle 4")
 
-    query = f"""
-    SELECT PGCCID, PGASID, PGLOT, PGBP01, PG74UAMT1, PGEV01
-    FROM F58PGOP1
-    WHERE PGLOT LIKE '%{month}/%/{year}%'
-    AND PGCCID NOT IN (SELECT RPDOC FROM F03B11)
-    AND PGEV01 = 4
-    ORDER BY PGCCID
-    """
-    df_code4 = run_query(conn, query)
+    df_hors_compta = snapshot.pgop1_hors_compta()
+    df_code4 = df_hors_compta[df_hors_compta['PGEV01'] == 4] if not df_hors_compta.empty else df_hors_compta
 
     if not df_code4.empty:
-        save_to_excel(df_code4, "Contrôle4_Code4", output_file)
-
-        # Récupération des IDs pour requête client
-        ids = df_code4['PGCCID'].tolist()
-        if ids:
-            query_client = f"""
-            SELECT IDINTERNO, NUMFACTURA, NOMUSU
-            FROM LQ_FACTURA_B
-            WHERE IDINTERNO IN ({','.join(['%s'] * len(ids))})
-            ORDER BY NOMUSU
-            """
-            df_clients = run_query(conn, query_client, params=ids)
+        rapport.ajouter(df_code4, "Contrôle4_Code4")
+
+        # Clients des factures en code 4, enrichis par l'annuaire F0101 (numéro client, identifiant fiscal)
+        df_clients = snapshot.clients_code4
+        if not df_clients.empty:
+            df_clients = df_clients[df_clients['IDINTERNO'].isin(df_code4['PGCCID'])]
+            df_clients = df_clients.sort_values('NOMUSU', kind='stable')
+            if snapshot.annuaire is not None:
+                df_clients = snapshot.annuaire.enrichir(df_clients)
             if not df_clients.empty:
-                save_to_excel(df_clients, "Contrôle4_Clients", output_file)
-
-        # Partie IFU
-        query_ifu = """
-        SELECT ABALPH, ABTAX
-        FROM F0101
-        WHERE ABALPH LIKE '%PUMA%'
-        LIMIT 10
-        """
-        df_ifu = run_query(conn, query_ifu)
-        if not df_ifu.empty:
-            save_to_excel(df_ifu, "Contrôle4_IFU", output_file)
-
-    logger.info(f"Contrôle 4 terminé : {len(df_code4) if df_code4 is not None else 0} factures avec code 4.")
-    return df_code4 if df_code4 is not None else None
+                rapport.ajouter(df_clients, "Contrôle4_Clients")
+
+                # Partie IFU : identifiants fiscaux des clients concernés
+                if 'ABTAX' in df_clients.columns:
+                    df_ifu = (df_clients.dropna(subset=['ABAN8'])
+                              .groupby(['ABAN8', 'ABALPH', 'ABTAX'], dropna=False, sort=False)
+                              .size().reset_index(name='NB_FACTURES'))
+                    if not df_ifu.empty:
+                        rapport.ajouter(df_ifu, "Contrôle4_IFU")
+
+    logger.info(f"Contrôle 4 terminé : {len(df_code4)} factures avec code 4.")
+    return df_code4
@@ -1,61 +1,60 @@
 import logging
-from utils import run_query, save_to_excel
+from snapshot import ETATS_FACTURE
+from montants import rapprocher_montants
+from utils import load_config
 import pandas as pd
 
 logger = logging.getLogger("PGOP_JDE_Control")
 
-def controle_5(conn, year, month, output_file):
+# Montants LQ_FACTURA_B comparés à F03B11 : HT, TVA, TTC
+CHAMPS_COMPARES = [('IMPNET', 'RPATXA'), ('IMPIVA', 'RPSTAM'), ('IMPTOT', 'RPAG')]
+
+
+def tolerances_centimes():
+    """
+    Écarts tolérés en centimes, depuis la section [controle_5] de config.ini :
+    `tolerance_centimes` pour tous les champs, `tolerance_<champ>` pour un champ.
+    """
+    config = load_config()
+    section = config['controle_5'] if config.has_section('controle_5') else {}
+    defaut = int(section.get('tolerance_centimes', 0))
+    return {champ: int(section.get(f"tolerance_{champ.lower()}", defaut)) for champ, _ in CHAMPS_COMPARES}
+
+def controle_5(snapshot, rapport):
     """
     Contrôle 5: Réconciliation des montants entre LQ_FACTURA_B et F03B11.
 
+    Comparaison exacte en centimes entiers (montants.rapprocher_montants), avec
+    tolérances configurables ; chaque écart indique les champs divergents et
+    leur différence.
+
     Args:
-        conn: connexion à la base de données
-        year (str): année AAAA
-        month (str): mois MM
-        output_file (str): chemin fichier Excel pour sauvegarde
+        snapshot (Snapshot): données sources de la période
+        rapport (SectionRapport): section du rapport Excel recevant les feuilles
 
     Returns:
         DataFrame: écarts de montants
     """
     logger.info("Début du Contrôle 5")
 
-    query_pgop = f"""
-    SELECT IDINTERNO, NUMFACTURA, IMPNET, IMPIVA, IMPTOT
-    FROM LQ_FACTURA_B
-    WHERE FECFACTURA LIKE '%/{month}/{year[-2:]}'
-    AND BFUSIC IS NULL
-    AND ESTADO IN ('R','A','C','N','F','G','H','K','L','E','J','V')
-    ORDER BY NUMFACTURA
-    """
-    df_pgop = run_query(conn, query_pgop)
+    df_pgop = snapshot.factures
+    if not df_pgop.empty:
+        df_pgop = df_pgop[df_pgop['ESTADO'].isin(ETATS_FACTURE)]
+        df_pgop = df_pgop[['IDINTERNO', 'NUMFACTURA', 'IMPNET', 'IMPIVA', 'IMPTOT']].sort_values('NUMFACTURA', kind='stable')
 
-    query_jde = f"""
-    SELECT RPDOC, RPATXA, RPSTAM, RPAG
-    FROM F03B11
-    WHERE RPVR01 LIKE '%|PAC|{year}%'
-    ORDER BY RPDOC
-    """
-    df_jde = run_query(conn, query_jde)
+    df_jde = snapshot.f03b11
+    if not df_jde.empty:
+        df_jde = df_jde[df_jde['RPVR01'].str.contains(f"|PAC|{snapshot.periode.year}", regex=False, na=False)]
+        df_jde = df_jde[['RPDOC', 'RPATXA', 'RPSTAM', 'RPAG']]
 
     df_ecarts = pd.DataFrame()
 
     if not df_pgop.empty and not df_jde.empty:
-        df_compare = pd.merge(
-            df_pgop,
-            df_jde,
-            left_on='IDINTERNO',
-            right_on='RPDOC',
-            how='inner'
-        )
-
-        df_ecarts = df_compare[
-            (df_compare['IMPNET'] != df_compare['RPATXA']) |
-            (df_compare['IMPIVA'] != df_compare['RPSTAM']) |
-            (df_compare['IMPTOT'] != df_compare['RPAG'])
-        ]
+        df_ecarts = rapprocher_montants(df_pgop, 'IDINTERNO', df_jde, 'RPDOC', CHAMPS_COMPARES,
+                                        tolerances=tolerances_centimes())
 
         if not df_ecarts.empty:
-            save_to_excel(df_ecarts, "Contrôle5_Ecarts", output_file)
+            rapport.ajouter(df_ecarts, "Contrôle5_Ecarts")
             logger.warning(f"Contrôle 5 ALERTE: {len(df_ecarts)} écarts de montant.")
         else:
             logger.info("Contrôle 5 OK: Aucun écart de montant.")
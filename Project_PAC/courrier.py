@@ -0,0 +1,164 @@
+import logging
+import queue
+import threading
+
+from mesures import mesurer
+from utils import load_config, construire_message
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+
+# -----------------------
+# BOÎTE D'ENVOI SMTP
+# -----------------------
+class BoiteEnvoi:
+    """
+    File d'envoi des emails d'une exécution, servie en arrière-plan.
+
+    Les messages sont construits à l'appel de `envoyer()` puis confiés à un ou
+    plusieurs fils d'envoi. Chaque fil ouvre une seule session SMTP
+    (STARTTLS et authentification une fois) et la réutilise pour tous les
+    messages qu'il traite ; une session coupée par le serveur est rouverte
+    une fois. Les emails d'un contrôle terminé partent ainsi pendant que les
+    contrôles suivants tournent encore.
+
+    Les paramètres viennent de la section [email] de config.ini :
+    smtp_server, smtp_port, sender_email, sender_password, et en option
+    starttls (true par défaut, false pour un serveur SMTP local de test) et
+    connexions_smtp (sessions simultanées, 1 par défaut).
+
+    Utilisation :
+        with BoiteEnvoi() as boite:
+            boite.envoyer(sujet, corps_html, recipients=destinataires)
+    """
+
+    def __init__(self, config=None, connexions=None, simulation=False):
+        """
+        Args:
+            config (ConfigParser): configuration (par défaut : load_config())
+            connexions (int): nombre de sessions SMTP simultanées
+            simulation (bool): construire les messages sans les envoyer (banc d'essai)
+        """
+        email = (config or load_config())['email']
+        self.smtp_server = email['smtp_server']
+        self.smtp_port = int(email['smtp_port'])
+        self.sender_email = email['sender_email']
+        self.sender_password = email['sender_password']
+        self.starttls = email.getboolean('starttls', fallback=True)
+        self.connexions = connexions or email.getint('connexions_smtp', fallback=1)
+        self.simulation = simulation
+
+        self.envoyes = 0
+        self.echecs = 0
+        self._file = queue.Queue()
+        self._fils = []
+        self._verrou = threading.Lock()
+
+    def __enter__(self):
+        self.demarrer()
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+        return False
+
+    def demarrer(self):
+        """Lance les fils d'envoi (sans effet s'ils tournent déjà)."""
+        with self._verrou:
+            if self._fils:
+                return
+            for numero in range(self.connexions):
+                fil = threading.Thread(target=self._servir, name=f"smtp-{numero}", daemon=True)
+                fil.start()
+                self._fils.append(fil)
+
+    def envoyer(self, subject, body_html, attachment_path=None, recipients=None):
+        """
+        Construit un email et le place dans la file d'envoi (retour immédiat).
+
+        Les pièces jointes sont lues à l'appel : le fichier doit exister à ce moment.
+
+        Args:
+            subject (str): objet
+            body_html (str): corps HTML
+            attachment_path (str | list): fichier(s) à joindre
+            recipients (list): destinataires
+        """
+        if recipients is None:
+            logger.error("Aucun destinataire fourni.")
+            return
+        msg = construire_message(self.sender_email, subject, body_html, attachment_path, recipients)
+        if self.simulation:
+            with self._verrou:
+                self.envoyes += 1
+            logger.info(f"Email non envoyé (simulation) à {recipients} : {subject}")
+            return
+        self.demarrer()
+        self._file.put((subject, recipients, msg.as_string()))
+
+    def fermer(self):
+        """
+        Attend l'envoi de tous les messages en file puis ferme les sessions SMTP.
+
+        Returns:
+            int: nombre d'emails en échec
+        """
+        with self._verrou:
+            fils, self._fils = self._fils, []
+        for _ in fils:
+            self._file.put(None)
+        for fil in fils:
+            fil.join()
+        logger.info(f"Boîte d'envoi fermée : {self.envoyes} email(s) envoyé(s), {self.echecs} en échec.")
+        return self.echecs
+
+    def _ouvrir(self):
+        import smtplib
+        session = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        if self.starttls:
+            session.starttls()
+        if self.sender_password:
+            session.login(self.sender_email, self.sender_password)
+        return session
+
+    def _servir(self):
+        # smtplib importé par le premier fil d'envoi seulement (aucun en simulation)
+        import smtplib
+        session = None
+        try:
+            while True:
+                element = self._file.get()
+                if element is None:
+                    break
+                subject, recipients, contenu = element
+                for tentative in (1, 2):
+                    try:
+                        with mesurer('email', subject, controle='emails') as mesure:
+                            if session is None:
+                                session = self._ouvrir()
+                            session.sendmail(self.sender_email, recipients, contenu)
+                            mesure.octets = len(contenu)
+                        with self._verrou:
+                            self.envoyes += 1
+                        logger.info(f"Email envoyé à {recipients} avec succès : {subject}")
+                        break
+                    except Exception as e:
+                        reconnecter = isinstance(e, smtplib.SMTPServerDisconnected) and tentative == 1
+                        if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                            session = _fermer_session(session)
+                        if not reconnecter:
+                            with self._verrou:
+                                self.echecs += 1
+                            logger.error(f"Erreur lors de l'envoi de l'email '{subject}' : {e}")
+                            break
+        finally:
+            _fermer_session(session)
+
+
+def _fermer_session(session):
+    if session is not None:
+        try:
+            session.quit()
+        except Exception:
+            session.close()
+    return None
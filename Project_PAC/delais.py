@@ -0,0 +1,202 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import duckdb
+except ImportError:  # moteur optionnel
+    duckdb = None
+
+from mesures import signaler
+from ordonnanceur import DELAI_DEPASSE
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Marge laissée au serveur (MAX_EXECUTION_TIME) avant l'interruption par le client (KILL QUERY)
+MARGE_INTERRUPTION = 5
+# Erreurs MySQL transitoires, retentées : trop de connexions, connexion perdue ou refusée, verrou, interblocage
+ERREURS_TRANSITOIRES = {1040, 1205, 1213, 2003, 2006, 2013, 2055}
+# Erreurs MySQL d'une requête interrompue : MAX_EXECUTION_TIME atteint, KILL QUERY
+ERREURS_DELAI = {3024, 1317}
+
+_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+class DelaiDepasse(Exception):
+    """Requête interrompue à l'échéance de son délai (côté serveur ou par le client)."""
+
+
+# -----------------------
+# DÉLAIS ET NOUVELLES TENTATIVES
+# -----------------------
+class Delais:
+    """
+    Délais des requêtes et des contrôles d'une exécution ([delais] de config.ini).
+
+    Une requête est bornée deux fois :
+    - côté serveur, par l'indication MAX_EXECUTION_TIME (MySQL 5.7.8+), qui
+      arrête la requête sans intervention du client ;
+    - côté client, par une échéance qui, `MARGE_INTERRUPTION` secondes plus
+      tard, envoie KILL QUERY sur une connexion annexe (MySQL) ou interrompt
+      la connexion (SQLite, DuckDB) : une requête que le serveur n'arrête pas
+      (lecture des lots en cours, moteur sans MAX_EXECUTION_TIME) est coupée aussi.
+
+    Une requête en erreur transitoire (connexion perdue, verrou, interblocage)
+    est relancée, jusqu'à `tentatives` fois, après une attente doublée à chaque
+    fois. Une requête arrêtée à son délai n'est pas relancée.
+
+    Le délai des contrôles est appliqué par l'ordonnanceur (Tache.delai).
+
+    Attributes:
+        depassees (list): (requête, durée en secondes) des requêtes arrêtées à leur délai
+    """
+
+    def __init__(self, requete=0, controle=0, tentatives=1, attente=1.0, entite=None):
+        """
+        Args:
+            requete (float): délai d'une requête en secondes (0 : sans limite)
+            controle (float): délai d'un contrôle en secondes (0 : sans limite)
+            tentatives (int): exécutions au plus d'une requête en erreur transitoire
+            attente (float): secondes avant la première nouvelle tentative (doublées ensuite)
+            entite (str): entité de la base, pour la connexion annexe du KILL QUERY
+        """
+        self.requete = requete
+        self.controle = controle
+        self.tentatives = max(1, tentatives)
+        self.attente = attente
+        self.entite = entite
+        self.depassees = []
+        self._verrou = threading.Lock()
+
+    @classmethod
+    def depuis_config(cls, config, entite=None):
+        """Délais de la section [delais] de config.ini (sans section : aucun délai, une seule tentative)."""
+        delais = config['delais'] if config.has_section('delais') else {}
+        return cls(requete=float(delais.get('requete', 0)),
+                   controle=float(delais.get('controle', 0)),
+                   tentatives=int(delais.get('tentatives', 1)),
+                   attente=float(delais.get('attente', 1.0)),
+                   entite=entite)
+
+    def borner(self, sql):
+        """Requête SELECT avec l'indication MAX_EXECUTION_TIME (un commentaire pour SQLite et DuckDB)."""
+        if not self.requete or not _SELECT.match(sql):
+            return sql
+        return _SELECT.sub(f"SELECT /*+ MAX_EXECUTION_TIME({int(self.requete * 1000)}) */", sql, count=1)
+
+    def executer(self, pool, lire, nom="requête"):
+        """
+        Exécute `lire(connection)` sur une connexion du pool, dans le délai, avec nouvelles tentatives.
+
+        Args:
+            pool: pool de connexions (utils.get_db_pool)
+            lire (callable): lecture sur une connexion empruntée (rendue au pool ensuite)
+            nom (str): requête, pour le journal
+
+        Returns:
+            résultat de `lire`
+
+        Raises:
+            DelaiDepasse: requête arrêtée à son délai
+            Exception: erreur non transitoire, ou transitoire à la dernière tentative
+        """
+        for tentative in range(1, self.tentatives + 1):
+            connection = None
+            try:
+                connection = pool.get_connection()
+                with self.echeance(connection, nom):
+                    return lire(connection)
+            except DelaiDepasse:
+                raise
+            except Exception as e:
+                if tentative == self.tentatives or not transitoire(e):
+                    raise
+                attente = self.attente * 2 ** (tentative - 1)
+                logger.warning(f"Requête '{nom}' : erreur transitoire ({e}), tentative {tentative + 1}/"
+                               f"{self.tentatives} dans {attente:g}s")
+                time.sleep(attente)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    @contextmanager
+    def echeance(self, connection, nom="requête"):
+        """
+        Interrompt la requête en cours sur `connection` si le bloc dépasse le délai.
+
+        L'interruption n'atteint jamais une requête postérieure au bloc : à sa
+        sortie, avant que la connexion ne soit rendue au pool, le bloc attend
+        une interruption déjà commencée et empêche toute autre.
+
+        Raises:
+            DelaiDepasse: bloc interrompu à l'échéance (ou requête arrêtée par le serveur)
+        """
+        if not self.requete:
+            yield
+            return
+        interrompue, terminee = threading.Event(), threading.Event()
+        verrou = threading.Lock()
+
+        def interrompre():
+            # Sous le verrou : le bloc ne peut pas se terminer (ni la connexion repartir) pendant le KILL
+            with verrou:
+                if terminee.is_set():
+                    return
+                interrompue.set()
+                logger.warning(f"Requête '{nom}' : délai de {self.requete:g}s dépassé, interruption.")
+                try:
+                    self._interrompre(connection)
+                except Exception as e:
+                    logger.error(f"Interruption de la requête '{nom}' impossible : {e}")
+
+        minuterie = threading.Timer(self.requete + MARGE_INTERRUPTION, interrompre)
+        minuterie.daemon = True
+        debut = time.perf_counter()
+        minuterie.start()
+        try:
+            yield
+        except Exception as e:
+            if interrompue.is_set() or getattr(e, 'errno', None) in ERREURS_DELAI or _interruption(e):
+                signaler(DELAI_DEPASSE)
+                with self._verrou:
+                    self.depassees.append((nom, time.perf_counter() - debut))
+                raise DelaiDepasse(f"Requête '{nom}' : délai de {self.requete:g}s dépassé ({e})") from e
+            raise
+        finally:
+            with verrou:
+                terminee.set()
+            minuterie.cancel()
+            minuterie.join()
+
+    def _interrompre(self, connection):
+        if hasattr(connection, 'interrompre'):
+            # SQLite, DuckDB : interruption de la connexion depuis un autre fil
+            connection.interrompre()
+            return
+        # MySQL : la connexion est occupée par la requête, KILL QUERY passe par une connexion annexe
+        from utils import get_db_connection
+        annexe = get_db_connection(self.entite)
+        try:
+            cursor = annexe.cursor()
+            cursor.execute(f"KILL QUERY {int(connection.connection_id)}")
+            cursor.close()
+        finally:
+            annexe.close()
+
+
+def transitoire(erreur):
+    """True si l'erreur justifie une nouvelle tentative (connexion perdue, verrou, interblocage)."""
+    if getattr(erreur, 'errno', None) in ERREURS_TRANSITOIRES:
+        return True
+    # SQLite : base verrouillée par un autre processus
+    return isinstance(erreur, sqlite3.OperationalError) and 'locked' in str(erreur)
+
+
+def _interruption(erreur):
+    # Requête interrompue par le moteur embarqué (SQLite : "interrupted", DuckDB : InterruptException)
+    if isinstance(erreur, sqlite3.OperationalError) and 'interrupted' in str(erreur):
+        return True
+    return duckdb is not None and isinstance(erreur, duckdb.InterruptException)
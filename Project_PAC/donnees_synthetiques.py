@@ -0,0 +1,382 @@
+import argparse
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+
+import numpy as np
+import pandas as pd
+
+from moteurs import MOTEURS_EMBARQUES, dialecte_de, ouvrir_connexion
+from periode import parser_periodes
+from snapshot import ETATS_FACTURE
+from utils import get_db_connection, load_parametres
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Factures générées et insérées à la fois (mémoire bornée quel que soit le volume)
+TAILLE_BLOC = 200_000
+# Premier IDINTERNO généré (au-delà des factures de test de Base_fictive.txt)
+PREMIER_ID = 1_000_000
+# États hors contrôles 1 et 5 (factures annulées), en plus de ETATS_FACTURE
+ETATS_HORS_CONTROLE = ['X']
+
+# Schéma de Base_fictive.txt, écrit pour MySQL/MariaDB (traduit par moteurs.Dialecte)
+SCHEMA = {
+    'LQ_FACTURA_B': """
+        CREATE TABLE IF NOT EXISTS `LQ_FACTURA_B` (
+          `IDINTERNO` INT PRIMARY KEY,
+          `NUMFACTURA` VARCHAR(50),
+          `ESTADO` CHAR(1),
+          `FECFACTURA` VARCHAR(20),
+          `BFUSIC` VARCHAR(100) NULL,
+          `IMPNET` DECIMAL(10,2),
+          `IMPIVA` DECIMAL(10,2),
+          `IMPTOT` DECIMAL(10,2),
+          `NOMUSU` VARCHAR(255))""",
+    'FCABFAC': """
+        CREATE TABLE IF NOT EXISTS `FCABFAC` (
+          `IDFACTURA` INT PRIMARY KEY,
+          `NUMFACTURA` VARCHAR(50),
+          `CABDSP` CHAR(1),
+          `FECFACTURA` VARCHAR(20),
+          `TIPOSERIE` VARCHAR(10),
+          `IMPNET` DECIMAL(10,2))""",
+    'F58PGOP1': """
+        CREATE TABLE IF NOT EXISTS `F58PGOP1` (
+          `PGCCID` INT,
+          `PGASID` INT,
+          `PGLOT` VARCHAR(50),
+          `PGBP01` VARCHAR(100),
+          `PG74UAMT1` INT,
+          `PGEV01` INT NULL)""",
+    'F03B11': """
+        CREATE TABLE IF NOT EXISTS `F03B11` (
+          `RPDOC` INT PRIMARY KEY,
+          `RPVR01` VARCHAR(255),
+          `RPATXA` DECIMAL(10,2),
+          `RPSTAM` DECIMAL(10,2),
+          `RPAG` DECIMAL(10,2),
+          `RPPST` CHAR(1))""",
+    'F0101': """
+        CREATE TABLE IF NOT EXISTS `F0101` (
+          `ABAN8` INT,
+          `ABALPH` VARCHAR(255),
+          `ABTAX` VARCHAR(50))""",
+}
+
+# Colonnes de période de migrations/001_colonnes_periode.sql pour les moteurs embarqués :
+# table -> (colonne, {moteur: (type, expression)}, colonnes de l'index)
+COLONNES_PERIODE = {
+    'LQ_FACTURA_B': ('FECFACTURA_D', {
+        'sqlite': ('TEXT', "CASE WHEN length(FECFACTURA) = 8 "
+                           "THEN '20' || substr(FECFACTURA, 7, 2) ELSE substr(FECFACTURA, 7, 4) END "
+                           "|| '-' || substr(FECFACTURA, 4, 2) || '-' || substr(FECFACTURA, 1, 2)"),
+        'duckdb': ('DATE', "CAST(CASE WHEN length(FECFACTURA) = 8 THEN strptime(FECFACTURA, '%d/%m/%y') "
+                           "ELSE strptime(FECFACTURA, '%d/%m/%Y') END AS DATE)"),
+    }, "FECFACTURA_D, BFUSIC, ESTADO"),
+    'F58PGOP1': ('PGLOT_D', {
+        'sqlite': ('TEXT', "substr(PGLOT, 7, 4) || '-' || substr(PGLOT, 1, 2) || '-' || substr(PGLOT, 4, 2)"),
+        'duckdb': ('DATE', "CAST(strptime(left(PGLOT, 10), '%m/%d/%Y') AS DATE)"),
+    }, "PGLOT_D, PGCCID"),
+    'F03B11': ('RPVR01_AN', {
+        'sqlite': ('TEXT', "CASE WHEN instr(RPVR01, '|PAC|') > 0 "
+                           "THEN substr(RPVR01, instr(RPVR01, '|PAC|') + 5, 4) END"),
+        'duckdb': ('VARCHAR', "CASE WHEN instr(RPVR01, '|PAC|') > 0 "
+                              "THEN substr(RPVR01, instr(RPVR01, '|PAC|') + 5, 4) END"),
+    }, "RPVR01_AN, RPDOC"),
+}
+
+
+# -----------------------
+# TAUX D'ANOMALIES
+# -----------------------
+@dataclass
+class TauxAnomalies:
+    """
+    Part des factures touchées par chaque anomalie, étape par étape.
+
+    Attributes:
+        absentes_fcabfac (float): factures absentes de FCABFAC (contrôle 1)
+        non_transferees (float): factures FCABFAC (CABDSP = 'Y') absentes de F58PGOP1 (contrôle 2)
+        code4 (float): lignes F58PGOP1 rejetées en PGEV01 = 4, sans écriture F03B11 (contrôles 3 et 4)
+        non_comptabilisees (float): autres lignes F58PGOP1 sans écriture F03B11 (contrôle 3)
+        ecarts_montant (float): écritures F03B11 dont le TTC diffère de la facture (contrôle 5)
+        hors_controle (float): factures dans un état non contrôlé (ETATS_HORS_CONTROLE)
+        non_dispatchees (float): factures FCABFAC avec CABDSP = 'N'
+        clients_puma (float): clients dont le nom contient PUMA (partie IFU du contrôle 4)
+    """
+    absentes_fcabfac: float = 0.02
+    non_transferees: float = 0.01
+    code4: float = 0.005
+    non_comptabilisees: float = 0.005
+    ecarts_montant: float = 0.002
+    hors_controle: float = 0.03
+    non_dispatchees: float = 0.01
+    clients_puma: float = 0.01
+
+
+# -----------------------
+# GÉNÉRATION
+# -----------------------
+def generer_clients(nombre, taux, rng):
+    """
+    Clients F0101.
+
+    Returns:
+        DataFrame: ABAN8, ABALPH, ABTAX
+    """
+    ids = np.arange(1, nombre + 1)
+    puma = rng.random(nombre) < taux.clients_puma
+    noms = np.where(puma, "PUMA ENERGY ", "Client ").astype(object) + pd.Series(ids).map("{:06d}".format).to_numpy()
+    return pd.DataFrame({
+        'ABAN8': ids,
+        'ABALPH': noms,
+        'ABTAX': pd.Series(ids).map("IFU{:09d}".format).to_numpy(),
+    })
+
+
+def generer_bloc(premier_id, nombre, periodes, clients, taux, rng):
+    """
+    Génère `nombre` factures et leurs lignes dans les tables aval, avec anomalies.
+
+    Les factures sont réparties uniformément sur les périodes ; chaque étape
+    (FCABFAC, F58PGOP1, F03B11) reprend les factures de l'étape précédente,
+    moins la part d'anomalies configurée.
+
+    Returns:
+        tuple: ({table: DataFrame} pour LQ_FACTURA_B, FCABFAC, F58PGOP1, F03B11,
+            DataFrame des anomalies attendues par période et par contrôle)
+    """
+    ids = np.arange(premier_id, premier_id + nombre)
+    numeros = pd.Series(ids).map("FACT-{}".format).to_numpy()
+
+    # Dates : période tirée au hasard, jour 1 à 28
+    codes = np.array([p.code for p in periodes])[rng.integers(0, len(periodes), nombre)]
+    annees = pd.Series(codes).str[:4].to_numpy(dtype=object)
+    mois = pd.Series(codes).str[4:].to_numpy(dtype=object)
+    jours = pd.Series(rng.integers(1, 29, nombre)).map("{:02d}".format).to_numpy(dtype=object)
+    fecfactura = jours + "/" + mois + "/" + annees
+    pglot = mois + "/" + jours + "/" + annees
+
+    etats = np.array(ETATS_FACTURE, dtype=object)[rng.integers(0, len(ETATS_FACTURE), nombre)]
+    etats = np.where(rng.random(nombre) < taux.hors_controle,
+                     np.array(ETATS_HORS_CONTROLE, dtype=object)[rng.integers(0, len(ETATS_HORS_CONTROLE), nombre)],
+                     etats)
+
+    # Montants en centimes entiers : TVA 18 %
+    net = rng.integers(1_000, 5_000_000, nombre)
+    iva = (net * 18 + 50) // 100
+    tot = net + iva
+
+    factures = pd.DataFrame({
+        'IDINTERNO': ids, 'NUMFACTURA': numeros, 'ESTADO': etats, 'FECFACTURA': fecfactura,
+        'BFUSIC': None, 'IMPNET': _decimal(net), 'IMPIVA': _decimal(iva), 'IMPTOT': _decimal(tot),
+        'NOMUSU': clients['ABALPH'].to_numpy()[rng.integers(0, len(clients), nombre)],
+    })
+
+    # FCABFAC : factures transmises
+    dans_cabfac = rng.random(nombre) >= taux.absentes_fcabfac
+    dispatchee = rng.random(nombre) >= taux.non_dispatchees
+    cabfac = pd.DataFrame({
+        'IDFACTURA': ids, 'NUMFACTURA': numeros, 'CABDSP': np.where(dispatchee, 'Y', 'N'),
+        'FECFACTURA': fecfactura, 'TIPOSERIE': 'FAC', 'IMPNET': factures['IMPNET'],
+    })[dans_cabfac]
+
+    # F58PGOP1 : factures dispatchées transférées vers JDE
+    dans_pgop1 = dans_cabfac & dispatchee & (rng.random(nombre) >= taux.non_transferees)
+    code4 = dans_pgop1 & (rng.random(nombre) < taux.code4)
+    pgop1 = pd.DataFrame({
+        'PGCCID': ids, 'PGASID': ids, 'PGLOT': pglot, 'PGBP01': numeros, 'PG74UAMT1': tot,
+        'PGEV01': pd.Series(np.where(code4, 4, 0), dtype='Int64').where(code4),
+    })[dans_pgop1]
+
+    # F03B11 : écritures comptables des lignes F58PGOP1 acceptées
+    dans_f03b11 = dans_pgop1 & ~code4 & (rng.random(nombre) >= taux.non_comptabilisees)
+    ecart = dans_f03b11 & (rng.random(nombre) < taux.ecarts_montant)
+    decalage = rng.integers(1, 10_000, nombre) * np.where(rng.random(nombre) < 0.5, -1, 1)
+    f03b11 = pd.DataFrame({
+        'RPDOC': ids, 'RPVR01': "REF|PAC|" + annees + "|" + numeros,
+        'RPATXA': factures['IMPNET'], 'RPSTAM': factures['IMPIVA'],
+        'RPAG': _decimal(np.where(ecart, tot + decalage, tot)), 'RPPST': 'P',
+    })[dans_f03b11]
+
+    controle = np.isin(etats, ETATS_FACTURE)
+    attendus = pd.DataFrame({
+        'periode': codes,
+        'controle_1': controle & ~dans_cabfac,
+        'controle_2': dans_cabfac & dispatchee & ~dans_pgop1,
+        'controle_3': dans_pgop1 & ~dans_f03b11,
+        'controle_4': code4,
+        'controle_5': controle & ecart,
+    }).groupby('periode').sum()
+
+    return {'LQ_FACTURA_B': factures, 'FCABFAC': cabfac, 'F58PGOP1': pgop1, 'F03B11': f03b11}, attendus
+
+
+def _decimal(centimes):
+    """Centimes entiers -> texte DECIMAL(10,2) ('1234.56'), sans passer par un flottant."""
+    centimes = np.asarray(centimes, dtype=np.int64)
+    signe = np.where(centimes < 0, "-", "").astype(object)
+    absolu = np.abs(centimes)
+    return (signe + pd.Series(absolu // 100).astype(str).to_numpy(dtype=object) + "."
+            + pd.Series(absolu % 100).map("{:02d}".format).to_numpy(dtype=object))
+
+
+# -----------------------
+# CHARGEMENT DANS LA BASE
+# -----------------------
+def creer_schema(connection):
+    """
+    Crée les tables de Base_fictive.txt.
+
+    Sur un moteur embarqué, les colonnes de période de migrations/001 sont
+    créées avec leur index (DuckDB n'accepte les colonnes générées qu'à la
+    création de la table). Sur MySQL/MariaDB, appliquer la migration ensuite.
+    """
+    moteur = dialecte_de(connection).nom
+    cursor = connection.cursor()
+    for table, ddl in SCHEMA.items():
+        if moteur in MOTEURS_EMBARQUES and table in COLONNES_PERIODE:
+            colonne, expressions, _ = COLONNES_PERIODE[table]
+            type_sql, expression = expressions[moteur]
+            ddl = (f"{ddl[:ddl.rindex(')')]},\n          "
+                   f"`{colonne}` {type_sql} GENERATED ALWAYS AS ({expression}) VIRTUAL)")
+        cursor.execute(ddl)
+    if moteur in MOTEURS_EMBARQUES:
+        for table, (colonne, _, index) in COLONNES_PERIODE.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS IX_{table}_{colonne} ON {table} ({index})")
+    connection.commit()
+    cursor.close()
+
+
+def inserer(connection, table, df):
+    """Insère un DataFrame (NULL pour les valeurs manquantes), en masse sur les moteurs embarqués."""
+    if df.empty:
+        return
+    if hasattr(connection, 'charger_dataframe'):
+        connection.charger_dataframe(table, df)
+        return
+    sql = (f"INSERT INTO {table} ({', '.join(df.columns)}) "
+           f"VALUES ({', '.join(['%s'] * len(df.columns))})")
+    lignes = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    cursor = connection.cursor()
+    cursor.executemany(sql, list(lignes))
+    cursor.close()
+
+
+def generer_base(connection, factures, periodes, taux=None, nb_clients=None, graine=42,
+                 taille_bloc=TAILLE_BLOC):
+    """
+    Remplit la base de données synthétiques, bloc par bloc.
+
+    Args:
+        connection: connexion MySQL/MariaDB ou SQLite/DuckDB (utils.get_db_connection,
+            moteurs.ouvrir_connexion)
+        factures (int): nombre de factures LQ_FACTURA_B (10^4 à 10^7)
+        periodes (list): périodes couvertes
+        taux (TauxAnomalies): taux d'anomalies (par défaut : TauxAnomalies())
+        nb_clients (int): clients F0101 (par défaut : une facture sur 100, au moins 100)
+        graine (int): graine du générateur, pour des bases reproductibles
+        taille_bloc (int): factures générées et insérées à la fois
+
+    Returns:
+        dict: anomalies attendues par période, {AAAAMM: {controle_n: nombre}}
+    """
+    taux = taux or TauxAnomalies()
+    rng = np.random.default_rng(graine)
+    creer_schema(connection)
+
+    clients = generer_clients(nb_clients or max(100, factures // 100), taux, rng)
+    inserer(connection, 'F0101', clients)
+
+    attendus = []
+    for debut in range(0, factures, taille_bloc):
+        nombre = min(taille_bloc, factures - debut)
+        tables, anomalies = generer_bloc(PREMIER_ID + debut, nombre, periodes, clients, taux, rng)
+        for table, df in tables.items():
+            inserer(connection, table, df)
+        connection.commit()
+        attendus.append(anomalies)
+        logger.info(f"Données synthétiques : {debut + nombre}/{factures} factures insérées.")
+
+    total = pd.concat(attendus).groupby(level=0).sum()
+    return {periode: {controle: int(n) for controle, n in ligne.items()} for periode, ligne in total.iterrows()}
+
+
+def ecrire_attendus(chemin, attendus, factures, taux, graine):
+    """Enregistre les anomalies attendues (JSON), relues par banc_essai.py pour valider les contrôles."""
+    os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+    with open(chemin, 'w', encoding='utf-8') as f:
+        json.dump({'factures': factures, 'graine': graine, 'taux': asdict(taux), 'attendus': attendus},
+                  f, ensure_ascii=False, indent=2)
+    logger.info(f"Anomalies attendues écrites : {chemin}")
+
+
+def chemin_attendus(chemin_base=None):
+    """Fichier des anomalies attendues d'une base synthétique (à côté du fichier d'une base embarquée)."""
+    if chemin_base:
+        return f"{os.path.splitext(chemin_base)[0]}.attendus.json"
+    return os.path.join("output", "donnees_synthetiques.attendus.json")
+
+
+# -----------------------
+# MAIN
+# -----------------------
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Génère une base synthétique pour les contrôles PGOP → JDE")
+    parser.add_argument("--factures", type=int, default=10_000,
+                        help="Nombre de factures LQ_FACTURA_B (10^4 à 10^7)")
+    parser.add_argument("-am", type=str, default="202407",
+                        help="Périodes couvertes (AAAAMM, plage ou liste, comme pour main.py)")
+    parser.add_argument("--sqlite", type=str, default=None,
+                        help="Fichier SQLite cible (par défaut : base de config.ini)")
+    parser.add_argument("--duckdb", type=str, default=None,
+                        help="Fichier DuckDB cible (par défaut : base de config.ini)")
+    parser.add_argument("--remplacer", action="store_true",
+                        help="Vider la base cible avant génération")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--clients", type=int, default=None, help="Nombre de clients F0101")
+    defauts = TauxAnomalies()
+    for nom in asdict(defauts):
+        parser.add_argument(f"--taux-{nom.replace('_', '-')}", type=float, default=getattr(defauts, nom),
+                            dest=f"taux_{nom}", help=f"Part des factures (défaut : {getattr(defauts, nom)})")
+    args = parser.parse_args()
+
+    try:
+        periodes = parser_periodes(args.am)
+    except ValueError as e:
+        parser.error(str(e))
+    taux = TauxAnomalies(**{nom: getattr(args, f"taux_{nom}") for nom in asdict(defauts)})
+
+    if args.sqlite or args.duckdb:
+        moteur, chemin = ('sqlite', args.sqlite) if args.sqlite else ('duckdb', args.duckdb)
+    else:
+        parametres = load_parametres()
+        moteur, chemin = parametres.moteur, parametres.chemin_base
+
+    if moteur in MOTEURS_EMBARQUES:
+        if args.remplacer and os.path.exists(chemin):
+            os.remove(chemin)
+        os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+        connection = ouvrir_connexion(moteur, chemin)
+    else:
+        chemin = None
+        connection = get_db_connection()
+        if args.remplacer:
+            cursor = connection.cursor()
+            for table in SCHEMA:
+                cursor.execute(f"DROP TABLE IF EXISTS `{table}`")
+            cursor.close()
+            logger.warning("Tables supprimées : appliquer migrations/001_colonnes_periode.sql "
+                           "après génération pour predicats_indexes = true.")
+    try:
+        attendus = generer_base(connection, args.factures, periodes, taux, nb_clients=args.clients,
+                                graine=args.graine)
+    finally:
+        connection.close()
+    ecrire_attendus(chemin_attendus(chemin), attendus, args.factures, taux, args.graine)
+
+if __name__ == "__main__":
+    main()
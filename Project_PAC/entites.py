@@ -0,0 +1,185 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from rapport import RapportExcel
+from tableau_html import tableau_html, BudgetEmail
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Libellé du statut d'une entité dans la synthèse du groupe
+STATUTS = {True: "terminée", False: "en échec"}
+
+
+# -----------------------
+# EXÉCUTION D'UNE ENTITÉ
+# -----------------------
+@dataclass
+class ExecutionEntite:
+    """
+    Résultat des contrôles d'une entité dans une exécution groupée (main.py --entites).
+
+    Attributes:
+        entite (str): entité ([database.<entité>] de config.ini)
+        succes (bool): exécution allée à son terme
+        duree (float): durée en secondes
+        anomalies (dict): {contrôle: lignes d'anomalies, toutes périodes confondues}
+        rapports (dict): {code période AAAAMM: RapportExcel}
+        pieces_jointes (list): classeurs Excel écrits pour l'entité
+    """
+    entite: str
+    succes: bool = False
+    duree: float = 0.0
+    anomalies: dict = field(default_factory=dict)
+    rapports: dict = field(default_factory=dict)
+    pieces_jointes: list = field(default_factory=list)
+
+
+def synthese_entites(executions, controles):
+    """
+    Tableau de synthèse du groupe : une ligne par entité, anomalies par contrôle.
+
+    Args:
+        executions (iterable): ExecutionEntite, dans l'ordre des entités
+        controles (list): noms des contrôles exécutés
+
+    Returns:
+        DataFrame: ENTITE, STATUT, DUREE_S, puis une colonne par contrôle (CONTROLE_1...)
+    """
+    lignes = [{'ENTITE': e.entite, 'STATUT': STATUTS[e.succes], 'DUREE_S': round(e.duree, 1),
+               **{nom.upper(): e.anomalies.get(nom) if e.succes else None for nom in controles}}
+              for e in executions]
+    synthese = pd.DataFrame(lignes, columns=['ENTITE', 'STATUT', 'DUREE_S', *(nom.upper() for nom in controles)])
+    return synthese.astype({nom.upper(): 'Int64' for nom in controles})
+
+
+def rapport_groupe(file_path, executions, synthese):
+    """
+    Classeur consolidé du groupe : feuille de synthèse, puis chaque feuille des
+    contrôles avec les lignes de toutes les entités, précédées d'une colonne ENTITE
+    (et PERIODE si plusieurs périodes).
+
+    Args:
+        file_path (str): chemin du classeur
+        executions (iterable): ExecutionEntite
+        synthese (DataFrame): synthèse du groupe (synthese_entites)
+
+    Returns:
+        RapportExcel: rapport du groupe (non encore écrit)
+    """
+    par_entite = {}
+    for execution in executions:
+        if not execution.succes or not execution.rapports:
+            continue
+        rapports = execution.rapports
+        par_entite[execution.entite] = (next(iter(rapports.values())) if len(rapports) == 1
+                                        else RapportExcel.consolider(None, rapports))
+    rapport = RapportExcel.consolider(file_path, par_entite, colonne='ENTITE')
+    rapport.section('synthese', en_tete=True).ajouter(synthese, "Synthèse")
+    return rapport
+
+
+# -----------------------
+# EMAILS REGROUPÉS
+# -----------------------
+class EmailsGroupe:
+    """
+    Emails des entités d'un groupe, regroupés par destinataires.
+
+    Chaque entité reçoit sa boîte (`pour(entite)`), qui expose `envoyer()`
+    comme courrier.BoiteEnvoi mais conserve les messages au lieu de les
+    envoyer. Une fois toutes les entités terminées, `envoyer()` adresse à
+    chaque rôle destinataire un seul email : une partie par email d'origine
+    (contrôle), chacune reprenant le message de chaque entité, dans l'ordre
+    des entités quel que soit leur ordre de fin.
+    """
+
+    def __init__(self):
+        self._messages = []
+        self._verrou = threading.Lock()
+
+    def pour(self, entite):
+        """Boîte d'envoi d'une entité (voir BoiteEntite)."""
+        return BoiteEntite(self, entite)
+
+    def ajouter(self, entite, sujet, corps, pieces_jointes, destinataires):
+        with self._verrou:
+            self._messages.append((tuple(destinataires), entite, sujet, corps, pieces_jointes))
+
+    def envoyer(self, boite, libelle, entites, en_echec=(), synthese=None, pieces_groupe=()):
+        """
+        Envoie un email par rôle destinataire pour tout le groupe.
+
+        Le rôle qui reçoit les classeurs des entités (bilan) reçoit aussi la
+        synthèse du groupe et ses pièces jointes.
+
+        Args:
+            boite (BoiteEnvoi): boîte d'envoi réelle
+            libelle (str): périodes contrôlées (retirées des objets d'origine)
+            entites (list): entités du groupe, dans l'ordre d'affichage
+            en_echec (list): entités dont l'exécution n'est pas allée à son terme (signalées)
+            synthese (DataFrame): synthèse du groupe (synthese_entites)
+            pieces_groupe (list): fichiers du groupe joints au bilan (classeur consolidé)
+
+        Returns:
+            int: nombre d'emails regroupés confiés à la boîte
+        """
+        ordre = {entite: rang for rang, entite in enumerate(entites)}
+        with self._verrou:
+            messages = sorted(enumerate(self._messages), key=lambda m: (ordre.get(m[1][1], len(ordre)), m[0]))
+        roles = {}
+        for _, (destinataires, entite, sujet, corps, pieces) in messages:
+            roles.setdefault(destinataires, []).append((entite, _titre(sujet, libelle), corps, pieces))
+
+        for destinataires, contenus in roles.items():
+            titres = list(dict.fromkeys(titre for _, titre, _, _ in contenus))
+            pieces = [p for _, _, _, liste in contenus for p in _liste(liste)]
+            corps = ""
+            if en_echec:
+                corps += (f"<p><b>Entité(s) non contrôlée(s) : {', '.join(en_echec)}</b> "
+                          f"(voir le journal d'exécution).</p>")
+            if pieces and synthese is not None:
+                corps += "<h2>Synthèse du groupe</h2>" + tableau_html(synthese, BudgetEmail())
+                pieces = [*pieces_groupe, *pieces]
+            for titre in titres:
+                corps += f"<h2>{titre}</h2>"
+                for entite, titre_message, corps_message, _ in contenus:
+                    if titre_message == titre:
+                        corps += f"<h3>Entité {entite}</h3>{corps_message}"
+            boite.envoyer(f"[PGOP-JDE] Groupe {libelle} - {', '.join(titres)}", corps,
+                          attachment_path=pieces or None, recipients=list(destinataires))
+        return len(roles)
+
+
+class BoiteEntite:
+    """Boîte d'envoi d'une entité : mêmes appels que courrier.BoiteEnvoi, messages conservés par EmailsGroupe."""
+
+    def __init__(self, groupe, entite):
+        self.groupe = groupe
+        self.entite = entite
+
+    def envoyer(self, subject, body_html, attachment_path=None, recipients=None):
+        if recipients is None:
+            logger.error("Aucun destinataire fourni.")
+            return
+        self.groupe.ajouter(self.entite, subject, body_html, attachment_path, recipients)
+
+    def fermer(self):
+        return 0
+
+
+def _titre(sujet, libelle):
+    # "[PGOP] Contrôle 1 - Autres états 2024/07" -> "Contrôle 1 - Autres états"
+    sujet = re.sub(r"^\[[^\]]*\]\s*", "", sujet)
+    if libelle and sujet.endswith(libelle):
+        sujet = sujet[:-len(libelle)]
+    return sujet.strip()
+
+
+def _liste(pieces):
+    if not pieces:
+        return []
+    return list(pieces) if isinstance(pieces, (list, tuple)) else [pieces]
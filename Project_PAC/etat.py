@@ -0,0 +1,180 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Nombre maximal de clés par liste IN lors de la relecture des lignes modifiées
+TAILLE_IN = 1000
+# Marqueur des valeurs NULL dans les sommes de contrôle
+MARQUEUR_NULL = '#NULL#'
+
+
+# -----------------------
+# ÉTAT INCRÉMENTAL LOCAL
+# -----------------------
+class EtatIncremental:
+    """
+    Mémoire locale (SQLite) des tables sources déjà chargées.
+
+    Pour chaque ensemble de périodes et chaque table source, l'état conserve :
+    - le filigrane (clé maximale vue, nombre de lignes, date de mise à jour) ;
+    - une somme de contrôle par clé (CRC32 des colonnes comparées) ;
+    - les lignes elles-mêmes.
+
+    Aux exécutions suivantes, seules les clés et leurs sommes de contrôle sont
+    relues ; les lignes nouvelles (au-delà du filigrane) ou modifiées sont
+    ensuite rechargées, puis fusionnées avec les lignes mémorisées.
+    """
+
+    def __init__(self, cle_etat, chemin=os.path.join("output", "etat_incremental.sqlite")):
+        """
+        Args:
+            cle_etat (str): identifiant de l'ensemble de périodes, ex: '202407'
+            chemin (str): fichier SQLite de l'état
+        """
+        self.cle_etat = cle_etat
+        self.chemin = chemin
+        self._verrou = threading.Lock()
+        os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+        with self._connexion() as conn:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS filigranes (
+                cle_etat TEXT, source TEXT, cle_max, nb_lignes INTEGER, maj TEXT,
+                PRIMARY KEY (cle_etat, source));
+            CREATE TABLE IF NOT EXISTS sommes (
+                cle_etat TEXT, source TEXT, cle TEXT, nb INTEGER, chk INTEGER,
+                PRIMARY KEY (cle_etat, source, cle));
+            CREATE TABLE IF NOT EXISTS lignes (
+                cle_etat TEXT, source TEXT, donnees BLOB,
+                PRIMARY KEY (cle_etat, source));
+            """)
+
+    def _connexion(self):
+        return sqlite3.connect(self.chemin, timeout=30)
+
+    def charger(self, source, requete, executer):
+        """
+        Charge une table source en ne relisant que le delta depuis la dernière exécution.
+
+        Args:
+            source (str): nom de la table dans le snapshot (factures, pgop1, ...)
+            requete (RequeteSource): requête complète de la table, avec sa clé
+            executer (callable): executer(sql, params) -> DataFrame
+
+        Returns:
+            DataFrame: lignes courantes de la table
+        """
+        colonne_cle = requete.cle.split('.')[-1]
+        params = list(requete.params or [])
+
+        sommes_sql = ", ".join(f"IFNULL({c.strip()}, '{MARQUEUR_NULL}')" for c in requete.colonnes.split(','))
+        df_sommes = executer(
+            f"SELECT {requete.cle} AS CLE, COUNT(*) AS NB, SUM(CRC32(CONCAT_WS('|', {sommes_sql}))) AS CHK"
+            f"{requete.corps} GROUP BY {requete.cle}", params)
+        if df_sommes.columns.empty:
+            # Requête en erreur (déjà journalisée) : repli sur un chargement complet sans mise à jour de l'état
+            return executer(requete.sql, params)
+
+        courantes = {
+            _cle_texte(cle): (cle, int(nb), int(chk) if chk is not None else 0)
+            for cle, nb, chk in df_sommes[['CLE', 'NB', 'CHK']].itertuples(index=False, name=None)
+        }
+        df_stocke, sommes_stockees, cle_max = self._lire(source)
+
+        if df_stocke is None:
+            df = executer(requete.sql, params)
+            if not df.columns.empty:
+                self._ecrire(source, df, courantes)
+            logger.info(f"Incrémental {source}: état initial, {len(df)} lignes chargées.")
+            return df
+
+        nouvelles = [c for c in courantes if c not in sommes_stockees]
+        modifiees = [c for c in courantes if c in sommes_stockees and courantes[c][1:] != sommes_stockees[c]]
+        supprimees = [c for c in sommes_stockees if c not in courantes]
+        logger.info(f"Incrémental {source}: {len(nouvelles)} clés nouvelles, "
+                    f"{len(modifiees)} modifiées, {len(supprimees)} supprimées.")
+        if not (nouvelles or modifiees or supprimees):
+            return df_stocke
+
+        # Delta : nouvelles clés au-delà du filigrane par intervalle, les autres par listes IN
+        a_relire = nouvelles + modifiees
+        morceaux = []
+        if cle_max is not None:
+            au_dela = [c for c in nouvelles if _est_au_dela(courantes[c][0], cle_max)]
+            if au_dela:
+                morceaux.append(executer(f"{requete.sql} AND {requete.cle} > %s", params + [cle_max]))
+                a_relire = [c for c in a_relire if c not in set(au_dela)]
+        if MARQUEUR_NULL in a_relire:
+            morceaux.append(executer(f"{requete.sql} AND {requete.cle} IS NULL", params))
+        valeurs = [courantes[c][0] for c in a_relire if c != MARQUEUR_NULL]
+        for debut in range(0, len(valeurs), TAILLE_IN):
+            lot = valeurs[debut:debut + TAILLE_IN]
+            morceaux.append(executer(
+                f"{requete.sql} AND {requete.cle} IN ({', '.join(['%s'] * len(lot))})", params + lot))
+
+        if any(m.columns.empty for m in morceaux):
+            # Relecture partielle en erreur : on ne fusionne pas un état incomplet
+            return executer(requete.sql, params)
+
+        remplacees = set(modifiees) | set(supprimees)
+        conservees = df_stocke[~df_stocke[colonne_cle].map(_cle_texte).isin(remplacees)]
+        df = pd.concat([conservees, *morceaux], ignore_index=True)
+        df = df.sort_values(colonne_cle, kind='stable', ignore_index=True)
+        self._ecrire(source, df, courantes)
+        return df
+
+    def _lire(self, source):
+        with self._connexion() as conn:
+            ligne = conn.execute(
+                "SELECT donnees FROM lignes WHERE cle_etat = ? AND source = ?",
+                (self.cle_etat, source)).fetchone()
+            if ligne is None:
+                return None, {}, None
+            sommes = {cle: (nb, chk) for cle, nb, chk in conn.execute(
+                "SELECT cle, nb, chk FROM sommes WHERE cle_etat = ? AND source = ?",
+                (self.cle_etat, source))}
+            filigrane = conn.execute(
+                "SELECT cle_max FROM filigranes WHERE cle_etat = ? AND source = ?",
+                (self.cle_etat, source)).fetchone()
+        return pickle.loads(ligne[0]), sommes, filigrane[0] if filigrane else None
+
+    def _ecrire(self, source, df, courantes):
+        valeurs = [v for v, _, _ in courantes.values() if _cle_texte(v) != MARQUEUR_NULL]
+        cle_max = max(valeurs) if valeurs else None
+        if hasattr(cle_max, 'item'):
+            cle_max = cle_max.item()
+        if isinstance(cle_max, float) and cle_max.is_integer():
+            cle_max = int(cle_max)
+        with self._verrou, self._connexion() as conn:
+            conn.execute("DELETE FROM sommes WHERE cle_etat = ? AND source = ?", (self.cle_etat, source))
+            conn.executemany(
+                "INSERT INTO sommes (cle_etat, source, cle, nb, chk) VALUES (?, ?, ?, ?, ?)",
+                [(self.cle_etat, source, cle, nb, chk) for cle, (_, nb, chk) in courantes.items()])
+            conn.execute(
+                "INSERT OR REPLACE INTO lignes (cle_etat, source, donnees) VALUES (?, ?, ?)",
+                (self.cle_etat, source, pickle.dumps(df)))
+            conn.execute(
+                "INSERT OR REPLACE INTO filigranes (cle_etat, source, cle_max, nb_lignes, maj) VALUES (?, ?, ?, ?, ?)",
+                (self.cle_etat, source, cle_max, len(df), datetime.now().isoformat(timespec='seconds')))
+
+
+def _cle_texte(valeur):
+    """Représentation texte stable d'une clé (1004, 1004.0 et '1004' donnent '1004')."""
+    if valeur is None or (not isinstance(valeur, str) and pd.isna(valeur)):
+        return MARQUEUR_NULL
+    if isinstance(valeur, float) and valeur.is_integer():
+        return str(int(valeur))
+    return str(valeur)
+
+
+def _est_au_dela(valeur, cle_max):
+    try:
+        return valeur > cle_max
+    except TypeError:
+        return False
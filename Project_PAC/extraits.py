@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import shutil
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # cache d'extraits optionnel
+    pa = pq = None
+
+from mesures import mesurer, taille_dataframe
+from schemas import appliquer_schema
+from utils import chemin_entite
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Tables dont le nombre de lignes et la clé maximale sont comparés à la base avant réutilisation
+TABLES_VERIFIEES = ('factures', 'cabfac', 'pgop1', 'f03b11')
+# Politiques de vérification ([extraits] verification)
+VERIFICATIONS = ('toujours', 'ouvertes', 'jamais')
+MANIFESTE = "manifeste.json"
+
+
+# -----------------------
+# CACHE D'EXTRAITS PARQUET
+# -----------------------
+class CacheExtraits:
+    """
+    Extraits Parquet des tables sources, partitionnés par période.
+
+    Chaque période chargée depuis la base est écrite sous
+    `<repertoire>/periode=AAAAMM/<table>.parquet`, avec un manifeste (nombre de
+    lignes et clé maximale de chaque table, base et stratégie d'origine),
+    écrit en dernier : un extrait sans manifeste est incomplet et ignoré.
+
+    À la réexécution d'une période, l'extrait est relu (fichiers mappés en
+    mémoire) au lieu d'interroger la base, s'il est à jour :
+    - verification = toujours : COUNT(*) / MAX(clé) par table comparés au manifeste ;
+    - verification = ouvertes : idem pour les mois non clos ; un mois clos
+      (terminé depuis plus de jours_cloture jours) est relu sans aucune requête ;
+    - verification = jamais : l'extrait est toujours relu (mode hors ligne).
+    """
+
+    def __init__(self, repertoire=os.path.join("output", "extraits"), base="", verification='ouvertes',
+                 jours_cloture=10):
+        """
+        Args:
+            repertoire (str): racine des extraits
+            base (str): identité de la base d'origine (un extrait d'une autre base n'est pas réutilisé)
+            verification (str): 'toujours', 'ouvertes' ou 'jamais'
+            jours_cloture (int): jours après la fin du mois au-delà desquels le mois est clos
+        """
+        if pq is None:
+            raise ImportError("Le cache d'extraits nécessite le paquet pyarrow (pip install pyarrow)")
+        if verification not in VERIFICATIONS:
+            raise ValueError(f"[extraits] verification inconnue '{verification}' ({', '.join(VERIFICATIONS)})")
+        self.repertoire = repertoire
+        self.base = base
+        self.verification = verification
+        self.jours_cloture = jours_cloture
+
+    @classmethod
+    def depuis_config(cls, config, parametres, hors_ligne=False, entite=None):
+        """
+        Cache configuré par la section [extraits] de config.ini, ou None s'il n'est pas actif.
+
+        Args:
+            hors_ligne (bool): relire les extraits sans jamais interroger la base (actif d'office)
+            entite (str): entité contrôlée : extraits dans son sous-répertoire (voir utils.chemin_entite)
+        """
+        extraits = config['extraits'] if config.has_section('extraits') else {}
+        if not hors_ligne and str(extraits.get('actif', 'false')).lower() not in ('true', '1', 'yes', 'on'):
+            return None
+        return cls(chemin_entite(extraits.get('repertoire', os.path.join("output", "extraits")), entite),
+                   base=identite_base(parametres),
+                   verification='jamais' if hors_ligne else extraits.get('verification', 'ouvertes'),
+                   jours_cloture=int(extraits.get('jours_cloture', 10)))
+
+    def _dossier(self, periode):
+        return os.path.join(self.repertoire, f"periode={periode.code}")
+
+    def manifeste(self, periode):
+        """Manifeste de l'extrait de la période, ou None s'il n'existe pas (ou est incomplet)."""
+        try:
+            with open(os.path.join(self._dossier(periode), MANIFESTE), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def est_clos(self, periode, aujourd_hui=None):
+        """True si le mois est terminé depuis plus de jours_cloture jours."""
+        return (aujourd_hui or date.today()) >= periode.fin + timedelta(days=self.jours_cloture)
+
+    def reutilisable(self, periode, strategie, empreintes=None):
+        """
+        Indique si l'extrait de la période peut remplacer la lecture de la base.
+
+        Args:
+            periode (Periode): période
+            strategie (str): stratégie d'anti-jointure de l'exécution (doit être celle de l'extrait)
+            empreintes (callable): fonction sans argument retournant {table: (lignes, clé max)}
+                lus dans la base ; appelée seulement si une vérification est nécessaire
+
+        Returns:
+            bool
+        """
+        manifeste = self.manifeste(periode)
+        if manifeste is None:
+            return False
+        if manifeste.get('base') != self.base or manifeste.get('strategie') != strategie:
+            logger.info(f"Extrait {periode.code} ignoré : base ou stratégie différente.")
+            return False
+        if self.verification == 'jamais' or (self.verification == 'ouvertes' and self.est_clos(periode)):
+            return True
+
+        actuelles = empreintes()
+        for nom in TABLES_VERIFIEES:
+            attendue = manifeste['tables'].get(nom)
+            actuelle = actuelles.get(nom)
+            if attendue is None or actuelle is None or [attendue['lignes'], attendue['cle_max']] != list(actuelle):
+                logger.info(f"Extrait {periode.code} périmé : {nom} a changé dans la base "
+                            f"({attendue} -> {actuelle}).")
+                return False
+        return True
+
+    def lire(self, periode):
+        """
+        Relit les tables d'une période (fichiers mappés en mémoire).
+
+        Returns:
+            dict: {table: DataFrame}
+        """
+        manifeste = self.manifeste(periode)
+        tables = {}
+        for nom in manifeste['tables']:
+            with mesurer('requete', f"extrait/{nom}", controle='snapshot') as mesure:
+                chemin = os.path.join(self._dossier(periode), f"{nom}.parquet")
+                # Extrait écrit avant les types compacts : conversion à la relecture
+                tables[nom] = appliquer_schema(pq.read_table(chemin, memory_map=True).to_pandas(), nom)
+                mesure.lignes, mesure.octets = len(tables[nom]), os.path.getsize(chemin)
+        logger.info(f"Extrait {periode.code} relu ({sum(len(df) for df in tables.values())} lignes).")
+        return tables
+
+    def ecrire(self, periode, tables, strategie):
+        """
+        Écrit l'extrait d'une période, en remplaçant l'extrait précédent.
+
+        Les fichiers sont écrits dans un dossier temporaire, renommé une fois le
+        manifeste écrit. Une table en erreur (DataFrame sans colonnes) rend
+        l'extrait inutilisable : rien n'est écrit.
+
+        Args:
+            periode (Periode): période
+            tables (dict): {table: DataFrame} du snapshot de la période
+            strategie (str): stratégie d'anti-jointure de l'exécution
+        """
+        if any(df.columns.empty for df in tables.values()):
+            logger.warning(f"Extrait {periode.code} non écrit : une table source est en erreur.")
+            return
+        dossier = self._dossier(periode)
+        temporaire = f"{dossier}.tmp"
+        shutil.rmtree(temporaire, ignore_errors=True)
+        os.makedirs(temporaire)
+        try:
+            contenu = {}
+            for nom, df in tables.items():
+                with mesurer('transformation', f"extrait/{nom}", controle='snapshot') as mesure:
+                    pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                                   os.path.join(temporaire, f"{nom}.parquet"))
+                    mesure.lignes, mesure.octets = len(df), taille_dataframe(df)
+                contenu[nom] = {'lignes': len(df), 'cle_max': cle_max(df, nom)}
+            with open(os.path.join(temporaire, MANIFESTE), 'w', encoding='utf-8') as f:
+                json.dump({'periode': periode.code, 'base': self.base, 'strategie': strategie,
+                           'date': datetime.now().isoformat(timespec='seconds'), 'tables': contenu},
+                          f, ensure_ascii=False, indent=2)
+            shutil.rmtree(dossier, ignore_errors=True)
+            os.replace(temporaire, dossier)
+            logger.info(f"Extrait {periode.code} écrit : {dossier}")
+        except Exception as e:
+            shutil.rmtree(temporaire, ignore_errors=True)
+            logger.error(f"Erreur lors de l'écriture de l'extrait {periode.code}: {e}")
+
+
+# Clé comparée de chaque table vérifiée (colonne du DataFrame chargé)
+CLES_TABLES = {'factures': 'IDINTERNO', 'cabfac': 'IDFACTURA', 'pgop1': 'PGCCID', 'f03b11': 'RPDOC'}
+
+
+def cle_max(df, nom):
+    """Clé maximale d'une table vérifiée, en texte (None si vide ou table non vérifiée)."""
+    colonne = CLES_TABLES.get(nom)
+    if colonne is None or df.empty or colonne not in df.columns:
+        return None
+    valeur = df[colonne].max()
+    return None if pd.isna(valeur) else str(int(valeur))
+
+
+def identite_base(parametres):
+    """Identité de la base d'origine des extraits : moteur et fichier, ou serveur et base MySQL."""
+    if parametres.moteur != 'mysql':
+        return f"{parametres.moteur}:{os.path.abspath(parametres.chemin_base)}"
+    return f"mysql:{parametres.db.get('host')}/{parametres.db.get('database')}"
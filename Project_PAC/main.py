@@ -1,26 +1,46 @@
 import os
+import time
 import logging
 import argparse
 from datetime import datetime
-from utils import load_config, get_db_connection, send_email, save_to_excel
-from controles.controle_1 import controle_1
-from controles.controle_2 import controle_2
-from controles.controle_3 import controle_3
-from controles.controle_4 import controle_4
-from controles.controle_5 import controle_5
+from utils import (load_config, load_parametres, get_db_pool, concat_periodes, entites_configurees,
+                   chemin_entite)
+from controles import CONTROLES, selectionner_controles
+from snapshot import charger_snapshots
+from ordonnanceur import Tache, executer_taches, TERMINEE, EN_ECHEC, DELAI_DEPASSE
+from delais import Delais
+from rapport import RapportExcel
+from etat import EtatIncremental
+from extraits import CacheExtraits
+from courrier import BoiteEnvoi
+from registre import RegistreAnomalies, Suivi, CLES_CONTROLES
+from tableau_html import tableau_html, BudgetEmail
+from mesures import MesuresExecution, mesurer, dans_controle
+from periode import parser_periodes, libelle_periodes
 import pandas as pd
 
 # -----------------------
 # CONFIGURATION LOGGING
 # -----------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"execution_{datetime.now().strftime('%Y%m%d_%H%M')}.log"),
-        logging.StreamHandler()
-    ]
-)
+FICHIER_LOG = f"execution_{datetime.now().strftime('%Y%m%d_%H%M')}.log"
+
+
+def configurer_journal(fichier=FICHIER_LOG):
+    """
+    Journal d'exécution : fichier `fichier` et console.
+
+    Appelé au lancement de main.py ou de service.py, jamais à l'import : un
+    module qui importe executer_controles (banc_essai.py) ne crée pas de journal.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(fichier),
+            logging.StreamHandler()
+        ]
+    )
+
 
 logger = logging.getLogger("PGOP_JDE_Control")
 
@@ -29,103 +49,547 @@ logger = logging.getLogger("PGOP_JDE_Control")
 # -----------------------
 def main():
     parser = argparse.ArgumentParser(description="Script de contrôle factures PGOP → JDE")
-    parser.add_argument("-am", type=str, required=True, help="Format AAAAMM, ex: 202407")
+    parser.add_argument("-am", type=str, required=True,
+                        help="Format AAAAMM, ex: 202407 ; plage 202401-202412 ou liste 202401,202403")
+    parser.add_argument("--classeur", choices=["par_periode", "consolide"], default="par_periode",
+                        help="Plusieurs périodes : un classeur par période ou un classeur consolidé")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Ne relire que les lignes nouvelles ou modifiées depuis la dernière exécution")
+    parser.add_argument("--hors-ligne", action="store_true",
+                        help="Relire les extraits Parquet de output/extraits sans interroger la base")
+    parser.add_argument("--controles", "--controls", type=str, default=None,
+                        help="Contrôles exécutés, ex: 1,3,5 ou 2-4 (par défaut : tous)")
+    parser.add_argument("--sans-emails", action="store_true",
+                        help="Ne construire aucun email (classeur Excel seulement, vérification ponctuelle)")
+    parser.add_argument("--conseiller", "--advise", action="store_true",
+                        help="Analyser les plans EXPLAIN des requêtes et proposer les index manquants")
+    parser.add_argument("--appliquer", "--apply", action="store_true",
+                        help="Avec --conseiller : créer les index sur la base locale puis mesurer à nouveau")
+    parser.add_argument("--entites", "--entities", nargs="?", const="", default=None,
+                        help="Exécution groupée sur les bases [database.<entité>] de config.ini, "
+                             "en même temps : toutes, ou liste ex: FR,ES")
     args = parser.parse_args()
 
-    year = args.am[:4]
-    month = args.am[4:6]
+    try:
+        periodes = parser_periodes(args.am)
+        controles = selectionner_controles(args.controles)
+        entites = selectionner_entites(args.entites) if args.entites is not None else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.appliquer and not args.conseiller:
+        parser.error("--appliquer s'utilise avec --conseiller")
+    if args.conseiller:
+        if entites is not None:
+            parser.error("--conseiller analyse la base de [database] : sans --entites")
+        conseiller_index(periodes, appliquer=args.appliquer)
+        return
+    options = dict(classeur=args.classeur, incremental=args.incremental, hors_ligne=args.hors_ligne,
+                   controles=[c.nom for c in controles], emails=not args.sans_emails)
+    if entites is not None:
+        executer_entites(periodes, entites, **options)
+    else:
+        executer_controles(periodes, **options)
+
+
+def selectionner_entites(texte):
+    """
+    Entités d'une exécution groupée, parmi les sections [database.<entité>] de config.ini.
+
+    Args:
+        texte (str): liste séparée par des virgules, ex: 'FR,ES' (vide : toutes les entités)
+
+    Returns:
+        list: entités, dans l'ordre demandé (ou celui de config.ini)
+
+    Raises:
+        ValueError: aucune entité configurée, ou entité inconnue
+    """
+    configurees = entites_configurees(load_config())
+    if not configurees:
+        raise ValueError("--entites : aucune section [database.<entité>] dans config.ini")
+    demandees = list(dict.fromkeys(e.strip() for e in texte.split(',') if e.strip()))
+    inconnues = [e for e in demandees if e not in configurees]
+    if inconnues:
+        raise ValueError(f"--entites : entité(s) inconnue(s) {', '.join(inconnues)} "
+                         f"(configurées : {', '.join(configurees)})")
+    return demandees or configurees
+
+
+def conseiller_index(periodes, appliquer=False):
+    """
+    Mode conseil : plans EXPLAIN des requêtes des contrôles, index proposés
+    (script output/conseils_index_<date>.sql) et, sur une base locale, création
+    des index et nouvelle mesure (voir conseiller.py).
+    """
+    from conseiller import conseiller, afficher
+
+    fichier = os.path.join("output", f"conseils_index_{datetime.now().strftime('%Y%m%d_%H%M')}.sql")
+    pool = get_db_pool()
+    try:
+        diagnostics = conseiller(pool, periodes, appliquer=appliquer, fichier_ddl=fichier)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+    finally:
+        if hasattr(pool, 'fermer'):
+            pool.fermer()
+    print(afficher(diagnostics))
+    return True
+
+
+def executer_controles(periodes, classeur="par_periode", incremental=False, pool=None, references=None,
+                       envoyer_emails=True, hors_ligne=False, controles=None, emails=True, entite=None,
+                       boite=None, mesures=None, bilan=None):
+    """
+    Exécute les contrôles pour un ensemble de périodes : snapshots, contrôles,
+    classeurs Excel et emails.
+
+    Args:
+        periodes (list): périodes contrôlées
+        classeur (str): 'par_periode' ou 'consolide' (plusieurs périodes)
+        incremental (bool): ne relire que les lignes nouvelles ou modifiées
+        pool: pool de connexions déjà ouvert (par défaut : nouveau pool)
+        references (dict): données de référence en cache (voir snapshot.charger_references)
+        envoyer_emails (bool): False pour construire les emails sans les envoyer (banc d'essai)
+        hors_ligne (bool): relire les extraits Parquet sans se connecter à la base (voir extraits.py)
+        controles (list): noms des contrôles exécutés (par défaut : tous, voir controles.CONTROLES) ;
+            seules leurs tables sources sont lues, seuls leurs emails sont construits
+        emails (bool): False pour n'écrire que le classeur, sans construire aucun email
+        entite (str): entité contrôlée ([database.<entité>] de config.ini) : sa base, ses fichiers
+            locaux (output/<entité>/) et des classeurs à son nom (voir executer_entites)
+        boite: boîte d'envoi partagée, non fermée ici (par défaut : nouvelle courrier.BoiteEnvoi)
+        mesures (MesuresExecution): mesures partagées, ni terminées ni écrites ici
+            (par défaut : mesures propres à l'exécution)
+        bilan (entites.ExecutionEntite): reçoit les anomalies par contrôle, les rapports
+            et les classeurs de l'exécution
+
+    Returns:
+        bool: True si l'exécution est allée à son terme
+    """
+    libelle = libelle_periodes(periodes)
+    mesures_propres = mesures is None
+    if mesures_propres:
+        mesures = MesuresExecution(libelle).demarrer()
+
+    selection = [CONTROLES[nom] for nom in (controles or CONTROLES)]
+    partielle = len(selection) < len(CONTROLES)
+    if partielle:
+        logger.info(f"Contrôles exécutés : {', '.join(c.nom for c in selection)}")
 
     config = load_config()
 
     OUTPUT_DIR = "output"
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    # Exécution partielle : contrôles exécutés dans le nom des classeurs, ex: _c1_c3
+    suffixe = "".join(f"_c{c.numero}" for c in selection) if partielle else ""
+    # Exécution d'une entité : entité dans le nom des classeurs, ex: rapport_controles_FR_...
+    prefixe = f"rapport_controles_{entite}" if entite else "rapport_controles"
 
     # Fichiers Excel spécifiques
-    rapport_file = os.path.join(OUTPUT_DIR, f"rapport_controles_{timestamp}.xlsx")
+    if len(periodes) == 1:
+        rapport_files = {periodes[0].code: os.path.join(OUTPUT_DIR, f"{prefixe}_{timestamp}{suffixe}.xlsx")}
+    else:
+        rapport_files = {p.code: os.path.join(OUTPUT_DIR, f"{prefixe}_{p.code}_{timestamp}{suffixe}.xlsx")
+                         for p in periodes}
 
+    boite_propre = boite is None
+    rapports = {}
     try:
-        conn = get_db_connection()
+        # Destinataires depuis config
+        dest1 = config['email']['dest1'].split(',')
+        dest2 = config['email']['dest2'].split(',')
+        dest3 = config['email']['dest3'].split(',')
+        dest4 = config['email']['dest4'].split(',')
 
-        # -------- CONTROL 1 --------
-        df_all, df_L, df_F, df_autres = controle_1(conn, year, month, rapport_file)
+        # Boîte d'envoi : sessions SMTP réutilisées, envois en arrière-plan
+        if not emails:
+            boite = None
+        elif boite_propre:
+            boite = BoiteEnvoi(config, simulation=not envoyer_emails)
 
-        # -------- CONTROL 2 --------
-        df_c2 = controle_2(conn, year, month, rapport_file)
+        # Extraits Parquet par période ([extraits] de config.ini, ou forcés hors ligne)
+        parametres = load_parametres(entite=entite)
+        # Délais des requêtes (MAX_EXECUTION_TIME, KILL QUERY) et des contrôles, nouvelles tentatives
+        delais = Delais.depuis_config(config, entite)
+        extraits = CacheExtraits.depuis_config(config, parametres, hors_ligne=hors_ligne, entite=entite)
+        if pool is None and not hors_ligne:
+            pool = get_db_pool(entite=entite)
 
-        # -------- CONTROL 3 --------
-        df_c3 = controle_3(conn, year, month, rapport_file)
+        # -------- SNAPSHOTS DES PÉRIODES --------
+        # Chaque table source n'est lue qu'une fois pour toutes les périodes (requêtes en
+        # parallèle sur le pool), puis répartie par période et partagée par les contrôles
+        etat = EtatIncremental(",".join(p.code for p in periodes),
+                               chemin_entite(os.path.join(OUTPUT_DIR, "etat_incremental.sqlite"), entite)
+                               ) if incremental else None
+        # Seules les tables (et l'annuaire F0101) des contrôles exécutés sont lues
+        if references is None and not any(c.annuaire for c in selection):
+            references = {}
+        snapshots = charger_snapshots(pool, periodes, etat=etat, references=references, extraits=extraits,
+                                      tables={table for c in selection for table in c.tables}, entite=entite,
+                                      delais=delais)
 
-        # -------- CONTROL 4 --------
-        df_c4 = controle_4(conn, year, month, rapport_file)
+        # Registre des anomalies : les emails ne reprennent que les anomalies nouvelles, toujours
+        # ouvertes et résolues. Pas de registre sans envoi (banc d'essai) : l'exécution suivante
+        # doit encore signaler comme nouvelles les anomalies de cette exécution.
+        registre = RegistreAnomalies.depuis_config(config, entite) if envoyer_emails and emails else None
+        execution = registre.ouvrir_execution(",".join(p.code for p in periodes)) if registre else None
+        suivis = {}
 
-        # -------- CONTROL 5 --------
-        df_c5 = controle_5(conn, year, month, rapport_file)
+        def suivre(nom, periode, snapshot, resultat):
+            if registre is not None:
+                with dans_controle(nom), mesurer('registre', nom) as mesure:
+                    df = resultat[0] if isinstance(resultat, tuple) else resultat
+                    suivis[(periode.code, nom)] = registre.enregistrer(execution, nom, periode.code, df,
+                                                                       complet=not snapshot.incomplet)
+                    mesure.lignes = len(df)
+            return resultat
 
-        conn.close()
-        logger.info("Tous les contrôles terminés.")
+        # Suivi d'un contrôle pour toutes les périodes (None sans registre), éventuellement restreint
+        def suivi_controle(nom, masque=None):
+            if registre is None:
+                return None
+            suivi = Suivi.concat({p.code: suivis[(p.code, nom)] for p in periodes})
+            return suivi.selection(masque) if masque is not None else suivi
+
+        # Tableaux d'un email : suivi du registre, ou toutes les anomalies sans registre
+        def tableaux(df, nom, budget, masque=None):
+            suivi = suivi_controle(nom, masque)
+            if suivi is None:
+                return tableau_html(df, budget)
+            return suivi.html(budget, cle=CLES_CONTROLES[nom])
+
+        # Rien à signaler : aucune anomalie, ni résolue depuis l'exécution précédente
+        def rien_a_signaler(df, nom, masque=None):
+            suivi = suivi_controle(nom, masque)
+            return df.empty if suivi is None else suivi.vide
+
+        # Résultats regroupés par contrôle (colonne PERIODE si plusieurs périodes),
+        # à partir des résultats d'un contrôle pour chaque période, dans l'ordre des périodes
+        def par_controle(resultats_periodes, indice=None):
+            return concat_periodes({
+                periode.code: resultat[indice] if indice is not None else resultat
+                for periode, resultat in zip(periodes, resultats_periodes)
+            })
 
         # -----------------------
-        # ENVOI EMAILS CIBLES
+        # EMAILS CIBLES
         # -----------------------
+        # Chaque email part dès que le contrôle dont il dépend est terminé pour toutes les périodes
+        def emails_controle_1(*resultats_periodes):
+            df_L, df_F, df_autres = (par_controle(resultats_periodes, i) for i in (1, 2, 3))
 
-        # Destinataires depuis config
-        dest1 = config['email']['dest1'].split(',')
-        dest2 = config['email']['dest2'].split(',')
-        dest3 = config['email']['dest3'].split(',')
-        dest4 = config['email']['dest4'].split(',')
+            # Email destinataire 1(Admin_PGOP) : ("Autres états" contrôle 1à et controle 2
+            ids_factures = ','.join(map(str, df_autres['IDINTERNO'].tolist())) if not df_autres.empty else ''
+            autres = lambda df: ~df['ESTADO'].isin(['L', 'F'])
+            body1 = "<p>Bonjour Hermione,</p>"
+            if rien_a_signaler(df_autres, "controle_1", autres):
+                body1 +="<p>Aucune facture 'Autres états' trouvé.</p>"
+            else:
+                if not df_autres.empty:
+                    body1 +="<p>Je te prie de bien vouloir mettre les factures suivantes à l'état 'F' dans PGOP :</p>"
+                    body1 +="<p> UPDATE LQ_FACTURA_B SET ESTADO = 'F' WHERE IDINTERNO IN (" + ids_factures + ");</p>"
+                body1 += tableaux(df_autres, "controle_1", BudgetEmail.depuis_config(config), autres)
+                body1 +="<p>Merci, <br> Cordialement </p>"
+            boite.envoyer(f"[PGOP] Contrôle 1 - Autres états {libelle}", body1, recipients=dest1)
 
-        # Email destinataire 1(Admin_PGOP) : ("Autres états" contrôle 1à et controle 2
-        ids_factures = ','.join(map(str, df_autres['IDINTERNO'].tolist()))
-        body1 = "<p>Bonjour Hermione,</p>"
-        if df_autres.empty:
-            body1 +="<p>Aucune facture 'Autres états' trouvé.</p>"
-        else:
-            body1 +="<p>Je te prie de bien vouloir mettre les factures suivantes à l'état 'F' dans PGOP :</p>"
-            body1 +="<p> UPDATE LQ_FACTURA_B SET ESTADO = 'F' WHERE IDINTERNO IN (" + ids_factures + ");</p>"
-            body1 += df_autres.to_html(index=False)
-            body1 +="<p>Merci, <br> Cordialement </p>"
-        send_email(f"[PGOP] Contrôle 1 - Autres états {year}/{month}", body1, recipients=dest1)
-        
-        # Email destination 1(Admin_PGOP) : (Control 2) Facture transmise ou non de PGOP vers JDE
-        if df_c2.empty:
-            body5 = "<p> Aucun décalage entre PGOP et JDE </p>"
-        else:
-            body5 = "<p> Bien vouloir effectuer le transfert des factures suivantes de PGOP vers JDE </p>"
-            body5 += df_c2.to_html(index=False)   
-            body5 += "<p> Merci, <br> Cordialement. </p>"   
-        send_email(f"[PGOP-JDE] Contrôle 2  {year}/{month}", body5, recipients=dest1)    
-    
-
-        # Email destinataire 2 (facturation) : Factures L et F contrôle 1
-        if df_L.empty:
-            body2 = "<p>Aucune facture 'L' en attente de transfert.</p>"
-        else:
-            body2 = "<p>Je te prie de bien vouloir traiter les factures à l'état 'L' dans PGOP, en attente de transfert:</p>"
-            body2 += df_L.to_html(index=False)
-            
-        if df_F.empty:
-            body2 += "<p>Aucune facture 'F' en attente de transfert.</p>"
-        else:
-            body2 += "<h3>Je te prie de bien vouloir traiter les factures à l'état 'F' dans PGOP, en attente de transfert:</h3>"
-            body2 += df_F.to_html(index=False)                                    
-        send_email(f"[PGOP] Contrôle 1 - États L et F {year}/{month}", body2, recipients=dest2)
+            # Email destinataire 2 (facturation) : Factures L et F contrôle 1
+            budget2 = BudgetEmail.depuis_config(config)
+            etat_l = lambda df: df['ESTADO'] == 'L'
+            etat_f = lambda df: df['ESTADO'] == 'F'
+            if rien_a_signaler(df_L, "controle_1", etat_l):
+                body2 = "<p>Aucune facture 'L' en attente de transfert.</p>"
+            else:
+                body2 = "<p>Je te prie de bien vouloir traiter les factures à l'état 'L' dans PGOP, en attente de transfert:</p>"
+                body2 += tableaux(df_L, "controle_1", budget2, etat_l)
+
+            if rien_a_signaler(df_F, "controle_1", etat_f):
+                body2 += "<p>Aucune facture 'F' en attente de transfert.</p>"
+            else:
+                body2 += "<h3>Je te prie de bien vouloir traiter les factures à l'état 'F' dans PGOP, en attente de transfert:</h3>"
+                body2 += tableaux(df_F, "controle_1", budget2, etat_f)
+            boite.envoyer(f"[PGOP] Contrôle 1 - États L et F {libelle}", body2, recipients=dest2)
+
+        def emails_controle_2(*resultats_periodes):
+            df_c2 = par_controle(resultats_periodes)
 
-        # Email destinataire 3 (Admin_JDE): Résultat contrôle 3
-        if df_c3.empty:
-            body3 = "<p>Aucune facture non transmise en comptabilité.</p>"
+            # Email destination 1(Admin_PGOP) : (Control 2) Facture transmise ou non de PGOP vers JDE
+            if rien_a_signaler(df_c2, "controle_2"):
+                body5 = "<p> Aucun décalage entre PGOP et JDE </p>"
+            else:
+                body5 = "<p> Bien vouloir effectuer le transfert des factures suivantes de PGOP vers JDE </p>"
+                body5 += tableaux(df_c2, "controle_2", BudgetEmail.depuis_config(config))
+                body5 += "<p> Merci, <br> Cordialement. </p>"
+            boite.envoyer(f"[PGOP-JDE] Contrôle 2  {libelle}", body5, recipients=dest1)
+
+        def emails_controle_3(*resultats_periodes):
+            df_c3 = par_controle(resultats_periodes)
+
+            # Email destinataire 3 (Admin_JDE): Résultat contrôle 3
+            if rien_a_signaler(df_c3, "controle_3"):
+                body3 = "<p>Aucune facture non transmise en comptabilité.</p>"
+            else:
+                body3 = "<h3>Contrôle 3 - Factures non transmises en comptabilité</h3>"
+                body3 += tableaux(df_c3, "controle_3", BudgetEmail.depuis_config(config))
+            boite.envoyer(f"[JDE] Contrôle 3 {libelle}", body3, recipients=dest3)
+
+        # Emails des contrôles exécutés seulement
+        emails_controles = {nom: email for nom, email in (("controle_1", emails_controle_1),
+                                                          ("controle_2", emails_controle_2),
+                                                          ("controle_3", emails_controle_3))
+                            if emails and any(c.nom == nom for c in selection)}
+
+        # -------- CONTROLES SÉLECTIONNÉS (en parallèle, pour chaque période) --------
+        # Chaque contrôle dépose ses feuilles dans sa section ; les classeurs sont écrits une seule fois.
+        # Classeur par période : chaque section terminée est écrite en arrière-plan pendant les
+        # autres contrôles (RapportExcel.demarrer) ; le classeur consolidé attend toutes les périodes.
+        # Un contrôle en erreur, hors délai ou dont une table source n'a pas pu être lue n'arrête
+        # pas les autres : ses feuilles sont écartées, ses emails ne partent pas, le bilan (email
+        # DSI, mesures) l'indique.
+        # Les modules des contrôles ne sont importés qu'ici, pour les contrôles exécutés.
+        fonctions = {c.nom: c.fonction() for c in selection}
+        consolide = len(periodes) > 1 and classeur == "consolide"
+
+        def executer_controle(nom, controle, periode, snapshot, rapport, section):
+            # Table source non lue : contrôle en échec (ni feuilles ni emails), plutôt que des
+            # anomalies calculées sur une table vide
+            snapshot.exiger(CONTROLES[nom].tables)
+            resultat = mesurer_controle(nom, controle, snapshot, section)
+            return suivre(nom, periode, snapshot, terminer_section(rapport, section, resultat))
+
+        taches, sections = [], {}
+        for periode, snapshot in snapshots.items():
+            rapport = rapports[periode.code] = RapportExcel(rapport_files[periode.code])
+            for nom, controle in fonctions.items():
+                section = sections[f"{periode.code}/{nom}"] = rapport.section(nom)
+                taches.append(Tache(f"{periode.code}/{nom}",
+                                    lambda controle=controle, periode=periode, snapshot=snapshot,
+                                    rapport=rapport, section=section, nom=nom:
+                                    executer_controle(nom, controle, periode, snapshot, rapport, section),
+                                    delai=delais.controle or None))
+            if not consolide:
+                rapport.demarrer()
+        for nom, email in emails_controles.items():
+            taches.append(Tache(f"email/{nom}",
+                                lambda *resultats, nom=nom, email=email:
+                                mesurer_controle(nom, email, *resultats, categorie='email'),
+                                tuple(f"{p.code}/{nom}" for p in periodes)))
+        etats = {}
+        resultats = executer_taches(taches, max_workers=getattr(pool, 'pool_size', parametres.pool_size),
+                                    bilan=etats)
+        for nom_tache, section in sections.items():
+            if etats[nom_tache].statut != TERMINEE:
+                rapports[nom_tache.split('/')[0]].ecarter(section)
+        deroulement = bilan_taches(etats, delais, snapshots)
+        mesures.ajouter_taches(deroulement, entite)
+        incidents = [ligne for ligne in deroulement if ligne['STATUT'] != TERMINEE]
+
+        if consolide:
+            rapport_file = os.path.join(OUTPUT_DIR, f"{prefixe}_{periodes[0].code}_"
+                                                    f"{periodes[-1].code}_{timestamp}{suffixe}.xlsx")
+            RapportExcel.consolider(rapport_file, rapports).ecrire()
+            pieces_jointes = [rapport_file]
         else:
-            body3 = "<h3>Contrôle 3 - Factures non transmises en comptabilité</h3>"
-            body3 += df_c3.to_html(index=False)
-        send_email(f"[JDE] Contrôle 3 {year}/{month}", body3, recipients=dest3)
+            for rapport in rapports.values():
+                rapport.ecrire()
+            pieces_jointes = list(rapport_files.values())
+
+        if bilan is not None:
+            # Anomalies de chaque contrôle (premier DataFrame de son résultat), toutes périodes confondues
+            # Contrôle non terminé pour une période : pas de nombre d'anomalies (vide dans la synthèse)
+            bilan.anomalies = {nom: sum(len(r[0] if isinstance(r, tuple) else r)
+                                        for r in (resultats[f"{p.code}/{nom}"] for p in snapshots))
+                               for nom in fonctions
+                               if all(f"{p.code}/{nom}" in resultats for p in snapshots)}
+            bilan.rapports, bilan.pieces_jointes = rapports, pieces_jointes
+
+        for ligne in incidents:
+            duree = f" après {ligne['DUREE_S']}s" if ligne['DUREE_S'] is not None else ""
+            logger.warning(f"{ligne['TACHE']} : {ligne['STATUT']}{duree} ({ligne['DETAIL']})")
+        fin = f"Contrôles terminés avec {len(incidents)} incident(s)" if incidents else "Tous les contrôles terminés"
+        (logger.warning if incidents else logger.info)(f"{fin} (entité {entite})." if entite else f"{fin}.")
 
         # Email destinataire 4 (DSI): Bilan complet avec fichier Excel
-        body4 = "<h3>Bilan complet des contrôles de factures PGOP-JDE</h3>"
-        body4 += "<p>Veuillez trouver ci-joint le fichier Excel contenant tous les résultats.</p>"
-        send_email(f"[PGOP-JDE] Bilan complet {year}/{month}", body4, attachment_path=rapport_file, recipients=dest4)
+        if boite is not None:
+            if partielle:
+                numeros = ", ".join(c.numero for c in selection)
+                executes = f"contrôle {numeros}" if len(selection) == 1 else f"contrôles {numeros}"
+                body4 = f"<h3>Bilan des factures PGOP-JDE : {executes}</h3>"
+                sujet4 = f"[PGOP-JDE] Bilan {executes} {libelle}"
+            else:
+                body4 = "<h3>Bilan complet des contrôles de factures PGOP-JDE</h3>"
+                sujet4 = f"[PGOP-JDE] Bilan complet {libelle}"
+            body4 += "<p>Veuillez trouver ci-joint le fichier Excel contenant tous les résultats.</p>"
+            if incidents:
+                sujet4 += " (partiel)"
+                body4 += ("<p><b>Résultats partiels :</b> contrôles ou requêtes non terminés ci-dessous ; "
+                          "leurs feuilles et leurs emails sont absents.</p>")
+            body4 += "<h3>Déroulement de l'exécution</h3>" + tableau_html(
+                pd.DataFrame(deroulement, columns=['TACHE', 'STATUT', 'DUREE_S', 'DETAIL']), BudgetEmail())
+            boite.envoyer(sujet4, body4, attachment_path=pieces_jointes, recipients=dest4)
+        return True
 
     except Exception as e:
         logger.error(f"Erreur critique: {e}")
+        return False
+    finally:
+        # Exécution interrompue : écritures en arrière-plan arrêtées sans produire de classeur
+        for rapport in rapports.values():
+            rapport.abandonner()
+        if boite is not None and boite_propre:
+            boite.fermer()
+        if mesures_propres:
+            mesures.terminer()
+            ecrire_mesures(mesures, config, timestamp)
+
+
+def executer_entites(periodes, entites, classeur="par_periode", incremental=False, envoyer_emails=True,
+                     hors_ligne=False, controles=None, emails=True, simultanees=None):
+    """
+    Exécution groupée : les contrôles de plusieurs entités, chacune sur sa base
+    ([database.<entité>] de config.ini), en même temps.
+
+    Chaque entité a son pool, ses fichiers locaux (output/<entité>/) et ses
+    classeurs ; le groupe produit ensuite un classeur consolidé (synthèse puis
+    feuilles de toutes les entités) et un seul email par rôle destinataire
+    (voir entites.py). Le groupe dure autant que l'entité la plus lente, dans
+    la limite de [entites] simultanees entités à la fois.
+
+    Args:
+        periodes (list): périodes contrôlées
+        entites (list): entités contrôlées (voir selectionner_entites)
+        simultanees (int): entités contrôlées à la fois (par défaut : [entites] simultanees, sinon 4)
+        classeur, incremental, envoyer_emails, hors_ligne, controles, emails: voir executer_controles
+
+    Returns:
+        bool: True si l'exécution de chaque entité est allée à son terme
+    """
+    from entites import ExecutionEntite, EmailsGroupe, synthese_entites, rapport_groupe
+
+    libelle = libelle_periodes(periodes)
+    mesures = MesuresExecution(f"{libelle} ({', '.join(entites)})").demarrer()
+    config = load_config()
+    if simultanees is None:
+        simultanees = config.getint('entites', 'simultanees', fallback=4)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M")
+    noms = controles or list(CONTROLES)
+    partielle = len(noms) < len(CONTROLES)
+    suffixe = "".join(f"_c{CONTROLES[nom].numero}" for nom in noms) if partielle else ""
+
+    logger.info(f"Exécution groupée {libelle} : {len(entites)} entité(s), {simultanees} à la fois")
+    groupe = EmailsGroupe() if emails else None
+    executions = {entite: ExecutionEntite(entite) for entite in entites}
+
+    def executer(entite):
+        execution, pool = executions[entite], None
+        debut = time.perf_counter()
+        try:
+            with mesurer('entite', entite, controle='groupe'):
+                if not hors_ligne:
+                    pool = get_db_pool(entite=entite)
+                execution.succes = executer_controles(
+                    periodes, classeur=classeur, incremental=incremental, pool=pool,
+                    envoyer_emails=envoyer_emails, hors_ligne=hors_ligne, controles=noms, emails=emails,
+                    entite=entite, boite=groupe.pour(entite) if groupe is not None else None,
+                    mesures=mesures, bilan=execution)
+        except Exception as e:
+            logger.error(f"Entité {entite} : erreur critique: {e}")
+        finally:
+            if hasattr(pool, 'fermer'):
+                pool.fermer()
+            execution.duree = time.perf_counter() - debut
+        logger.info(f"Entité {entite} {'terminée' if execution.succes else 'en échec'} en {execution.duree:.1f}s")
+        return execution
+
+    try:
+        executer_taches([Tache(entite, lambda entite=entite: executer(entite)) for entite in entites],
+                        max_workers=simultanees)
+
+        synthese = synthese_entites(executions.values(), noms)
+        os.makedirs("output", exist_ok=True)
+        rapport_file = os.path.join("output", f"rapport_groupe_{timestamp}{suffixe}.xlsx")
+        pieces_groupe = [rapport_file] if rapport_groupe(rapport_file, executions.values(), synthese).ecrire() else []
+        en_echec = [e for e, execution in executions.items() if not execution.succes]
+        if en_echec:
+            logger.error(f"Entité(s) en échec : {', '.join(en_echec)}")
+
+        # Un email par rôle destinataire pour tout le groupe
+        if groupe is not None:
+            boite = BoiteEnvoi(config, simulation=not envoyer_emails)
+            try:
+                groupe.envoyer(boite, libelle, entites, en_echec, synthese, pieces_groupe)
+            finally:
+                boite.fermer()
+        return not en_echec
+
+    except Exception as e:
+        logger.error(f"Erreur critique: {e}")
+        return False
+    finally:
+        mesures.terminer()
+        ecrire_mesures(mesures, config, timestamp)
+
+
+def mesurer_controle(nom, fonction, *args, categorie='controle'):
+    """Exécute un contrôle (ou ses emails) en rattachant ses opérations au contrôle `nom`."""
+    with dans_controle(nom), mesurer(categorie, fonction.__name__) as mesure:
+        resultat = fonction(*args)
+        frames = resultat if isinstance(resultat, tuple) else (resultat,)
+        mesure.lignes = sum(len(df) for df in frames if isinstance(df, pd.DataFrame))
+    return resultat
+
+
+def bilan_taches(etats, delais, snapshots=None):
+    """
+    Déroulement d'une exécution : issue et durée de chaque contrôle et email, puis requêtes
+    hors délai et tables sources non lues.
+
+    Args:
+        etats (dict): {tâche: ordonnanceur.EtatTache}
+        delais (Delais): délais de l'exécution (requêtes arrêtées à leur délai)
+        snapshots (dict): {Periode: Snapshot} (tables dont la requête a échoué, Snapshot.echecs)
+
+    Returns:
+        list: {TACHE, STATUT, DUREE_S, DETAIL} par tâche, par requête hors délai, puis par table non lue
+    """
+    lignes = [{'TACHE': etat.nom, 'STATUT': etat.statut,
+               'DUREE_S': None if etat.duree is None else round(etat.duree, 2), 'DETAIL': etat.erreur or ""}
+              for etat in etats.values()]
+    depassees = list(delais.depassees)
+    lignes += [{'TACHE': f"requête {nom}", 'STATUT': DELAI_DEPASSE, 'DUREE_S': round(duree, 2),
+                'DETAIL': "requête interrompue : résultat vide"}
+               for nom, duree in depassees]
+    # Tables non lues pour une autre raison (erreur SQL, connexion perdue après les nouvelles tentatives)
+    echecs = {}
+    for periode, snapshot in (snapshots or {}).items():
+        for nom in snapshot.echecs:
+            echecs.setdefault(nom, []).append(periode.code)
+    hors_delai = {nom for nom, _ in depassees}
+    lignes += [{'TACHE': f"requête {nom}", 'STATUT': EN_ECHEC, 'DUREE_S': None,
+                'DETAIL': f"table source non lue ({', '.join(codes)}) : contrôles qui la lisent non exécutés"}
+               for nom, codes in echecs.items() if nom not in hors_delai]
+    return lignes
+
+
+def terminer_section(rapport, section, resultat):
+    """Signale au rapport la section d'un contrôle terminé (écriture en arrière-plan) ; renvoie `resultat`."""
+    rapport.terminer(section)
+    return resultat
+
+
+def ecrire_mesures(mesures, config, timestamp):
+    """
+    Écrit le rapport de mesures JSON à côté du journal execution_*.log, et le
+    fichier Prometheus ([mesures] prometheus, par défaut à côté du journal aussi).
+    """
+    repertoire = os.path.dirname(os.path.abspath(FICHIER_LOG))
+    prometheus = config.get('mesures', 'prometheus', fallback='pgop_jde_control.prom')
+    try:
+        mesures.ecrire(os.path.join(repertoire, f"execution_{timestamp}.json"),
+                       os.path.join(repertoire, prometheus) if prometheus else None)
+    except OSError as e:
+        logger.error(f"Erreur lors de l'écriture des mesures : {e}")
 
 if __name__ == "__main__":
+    configurer_journal()
     main()
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Préfixe des métriques Prometheus
+PREFIXE_METRIQUES = "pgop_jde"
+
+_courantes = None
+_contexte = threading.local()
+
+
+# -----------------------
+# MESURES D'UNE EXÉCUTION
+# -----------------------
+class Mesure:
+    """
+    Une opération mesurée.
+
+    Attributes:
+        categorie (str): requete, transformation, controle, feuille, email, registre
+        nom (str): requête, contrôle, feuille ou objet de l'email
+        controle (str): contrôle auquel l'opération est rattachée ('snapshot' pour le chargement)
+        duree (float): durée en secondes
+        lignes (int): lignes lues ou produites
+        octets (int): octets lus, écrits ou envoyés
+        memoire_pic (int): pic de mémoire du processus (octets) à la fin de l'opération
+        statut (str): issue anormale signalée pendant l'opération (ex: délai dépassé), None sinon
+    """
+
+    def __init__(self, categorie, nom, controle):
+        self.categorie = categorie
+        self.nom = nom
+        self.controle = controle
+        self.duree = 0.0
+        self.lignes = None
+        self.octets = None
+        self.memoire_pic = None
+        self.statut = None
+
+    def vers_dict(self):
+        return dict(self.__dict__)
+
+
+class MesuresExecution:
+    """
+    Chronomètres et compteurs d'une exécution, regroupés par contrôle.
+
+    Une seule exécution est mesurée à la fois : `demarrer()` la rend courante
+    et les modules y enregistrent leurs opérations via `mesurer()`.
+    """
+
+    def __init__(self, libelle=""):
+        self.libelle = libelle
+        self.debut = datetime.now()
+        self._chrono = time.perf_counter()
+        self.mesures = []
+        self.taches = []
+        self._verrou = threading.Lock()
+
+    def demarrer(self):
+        global _courantes
+        _courantes = self
+        return self
+
+    def terminer(self):
+        global _courantes
+        if _courantes is self:
+            _courantes = None
+        self.duree = time.perf_counter() - self._chrono
+
+    def ajouter(self, mesure):
+        with self._verrou:
+            self.mesures.append(mesure)
+
+    def ajouter_taches(self, taches, entite=None):
+        """Conserve le déroulement des tâches (issue, durée) pour le rapport JSON, par entité."""
+        with self._verrou:
+            self.taches.extend(dict(tache, ENTITE=entite) if entite else dict(tache) for tache in taches)
+
+    def synthese(self):
+        """Totaux par contrôle et par catégorie : {controle: {categorie: {nombre, duree, lignes, octets}}}."""
+        totaux = {}
+        for mesure in self.mesures:
+            total = totaux.setdefault(mesure.controle, {}).setdefault(
+                mesure.categorie, {'nombre': 0, 'duree': 0.0, 'lignes': 0, 'octets': 0})
+            total['nombre'] += 1
+            total['duree'] += mesure.duree
+            total['lignes'] += mesure.lignes or 0
+            total['octets'] += mesure.octets or 0
+        return totaux
+
+    def ecrire(self, chemin_json, chemin_prometheus=None):
+        """
+        Écrit le rapport d'exécution JSON et, en option, le fichier Prometheus (textfile collector).
+
+        Le fichier Prometheus est remplacé de façon atomique, comme l'attend le collecteur.
+        """
+        rapport = {
+            'execution': self.libelle,
+            'debut': self.debut.isoformat(timespec='seconds'),
+            'duree': getattr(self, 'duree', time.perf_counter() - self._chrono),
+            'memoire_pic': memoire_pic(),
+            'synthese': self.synthese(),
+            'taches': self.taches,
+            'mesures': [m.vers_dict() for m in self.mesures],
+        }
+        with open(chemin_json, 'w', encoding='utf-8') as f:
+            json.dump(rapport, f, ensure_ascii=False, indent=2, default=str)
+        logger.info(f"Rapport de mesures écrit : {chemin_json}")
+
+        if chemin_prometheus:
+            temporaire = f"{chemin_prometheus}.tmp"
+            with open(temporaire, 'w', encoding='utf-8') as f:
+                f.write(self.metriques_prometheus(rapport))
+            os.replace(temporaire, chemin_prometheus)
+
+    def metriques_prometheus(self, rapport):
+        p = PREFIXE_METRIQUES
+        lignes = [
+            f"# HELP {p}_execution_duree_secondes Durée totale de la dernière exécution",
+            f"# TYPE {p}_execution_duree_secondes gauge",
+            f"{p}_execution_duree_secondes {rapport['duree']:.6f}",
+            f"# HELP {p}_execution_fin_timestamp_secondes Fin de la dernière exécution (epoch)",
+            f"# TYPE {p}_execution_fin_timestamp_secondes gauge",
+            f"{p}_execution_fin_timestamp_secondes {time.time():.0f}",
+        ]
+        if rapport['memoire_pic'] is not None:
+            lignes += [f"# HELP {p}_memoire_pic_octets Pic de mémoire du processus",
+                       f"# TYPE {p}_memoire_pic_octets gauge",
+                       f"{p}_memoire_pic_octets {rapport['memoire_pic']}"]
+
+        series = {'duree_secondes': ('duree', "Durée cumulée"), 'lignes': ('lignes', "Lignes lues ou produites"),
+                  'octets': ('octets', "Octets lus, écrits ou envoyés"), 'operations': ('nombre', "Opérations")}
+        for suffixe, (cle, aide) in series.items():
+            lignes += [f"# HELP {p}_{suffixe} {aide}, par contrôle et catégorie",
+                       f"# TYPE {p}_{suffixe} gauge"]
+            for controle, categories in rapport['synthese'].items():
+                for categorie, total in categories.items():
+                    etiquettes = f'controle="{_etiquette(controle)}",categorie="{_etiquette(categorie)}"'
+                    lignes.append(f"{p}_{suffixe}{{{etiquettes}}} {total[cle]}")
+        return "\n".join(lignes) + "\n"
+
+
+# -----------------------
+# ENREGISTREMENT
+# -----------------------
+@contextmanager
+def mesurer(categorie, nom, controle=None):
+    """
+    Chronomètre une opération et l'enregistre dans l'exécution courante.
+
+    Le bloc peut renseigner `lignes` et `octets` sur la mesure retournée.
+    Sans exécution courante, la mesure est faite mais n'est pas conservée.
+
+    Args:
+        categorie (str): requete, transformation, controle, feuille, email, registre
+        nom (str): objet mesuré
+        controle (str): contrôle de rattachement (par défaut : contrôle du fil courant)
+    """
+    mesure = Mesure(categorie, nom, controle or controle_courant())
+    en_cours = _contexte.__dict__.setdefault('mesures', [])
+    en_cours.append(mesure)
+    debut = time.perf_counter()
+    try:
+        yield mesure
+    finally:
+        en_cours.pop()
+        mesure.duree = time.perf_counter() - debut
+        mesure.memoire_pic = memoire_pic()
+        if _courantes is not None:
+            _courantes.ajouter(mesure)
+
+
+@contextmanager
+def dans_controle(nom):
+    """Rattache les opérations du fil courant au contrôle `nom` pendant le bloc."""
+    precedent = getattr(_contexte, 'controle', None)
+    _contexte.controle = nom
+    try:
+        yield
+    finally:
+        _contexte.controle = precedent
+
+
+def signaler(statut):
+    """Signale une issue anormale (ex: délai dépassé) sur l'opération mesurée en cours dans le fil courant."""
+    en_cours = getattr(_contexte, 'mesures', None)
+    if en_cours:
+        en_cours[-1].statut = statut
+
+
+def controle_courant():
+    return getattr(_contexte, 'controle', None) or 'snapshot'
+
+
+def taille_dataframe(df):
+    """Octets occupés par un DataFrame (chaînes comprises)."""
+    return int(df.memory_usage(index=False, deep=True).sum()) if not df.columns.empty else 0
+
+
+def memoire_pic():
+    """Pic de mémoire résidente du processus en octets (None si indisponible)."""
+    if resource is None:
+        return None
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux : kilo-octets ; macOS : octets
+    return pic if os.uname().sysname == 'Darwin' else pic * 1024
+
+
+def _etiquette(valeur):
+    return str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
@@ -0,0 +1,34 @@
+-- ------------------------------------------------------------
+-- MIGRATION 001 : colonnes de période normalisées et indexées
+-- ------------------------------------------------------------
+-- Les dates sont stockées en texte (FECFACTURA 'JJ/MM/AAAA', PGLOT 'MM/JJ/AAAA',
+-- année dans RPVR01 'REF|PAC|AAAA|...'), ce qui oblige les contrôles à filtrer
+-- avec des LIKE à joker initial et donc à parcourir toute la table.
+-- On ajoute des colonnes générées (STORED) indexées ; le filtre du mois devient
+-- un intervalle [début, fin[ résolu par un range scan.
+--
+-- Après application, activer dans config.ini : [database] predicats_indexes = true
+
+USE `espigon_test`;
+
+-- 1. LQ_FACTURA_B : date de facture (accepte aussi l'ancien format JJ/MM/AA)
+ALTER TABLE `LQ_FACTURA_B`
+  ADD COLUMN `FECFACTURA_D` DATE
+    GENERATED ALWAYS AS (
+      STR_TO_DATE(`FECFACTURA`, IF(CHAR_LENGTH(`FECFACTURA`) = 8, '%d/%m/%y', '%d/%m/%Y'))
+    ) STORED,
+  ADD INDEX `IX_LQ_FACTURA_B_FECFACTURA_D` (`FECFACTURA_D`, `BFUSIC`, `ESTADO`);
+
+-- 2. F58PGOP1 : date du lot (10 premiers caractères de PGLOT)
+ALTER TABLE `F58PGOP1`
+  ADD COLUMN `PGLOT_D` DATE
+    GENERATED ALWAYS AS (STR_TO_DATE(LEFT(`PGLOT`, 10), '%m/%d/%Y')) STORED,
+  ADD INDEX `IX_F58PGOP1_PGLOT_D` (`PGLOT_D`, `PGCCID`);
+
+-- 3. F03B11 : année PAC extraite de RPVR01
+ALTER TABLE `F03B11`
+  ADD COLUMN `RPVR01_AN` CHAR(4)
+    GENERATED ALWAYS AS (
+      IF(LOCATE('|PAC|', `RPVR01`) > 0, SUBSTRING(`RPVR01`, LOCATE('|PAC|', `RPVR01`) + 5, 4), NULL)
+    ) STORED,
+  ADD INDEX `IX_F03B11_RPVR01_AN` (`RPVR01_AN`, `RPDOC`);
@@ -0,0 +1,31 @@
+-- ------------------------------------------------------------
+-- MIGRATION 002 : index des clés de rapprochement
+-- ------------------------------------------------------------
+-- F58PGOP1 n'a ni clé ni index : sous MySQL, les sous-requêtes
+-- RPDOC IN (SELECT PGCCID FROM F58PGOP1 ...) (table f03b11, dont le OR empêche
+-- la semi-jointure) et IDINTERNO IN (SELECT PGCCID ... AND PGEV01 = 4)
+-- (table clients_code4) deviennent des DEPENDENT SUBQUERY qui parcourent
+-- F58PGOP1 en entier pour chaque ligne externe. F0101 n'a pas d'index non plus :
+-- le rafraîchissement incrémental de l'annuaire (ABAN8 > plus grand connu)
+-- relit toute la table.
+--
+-- Index proposés par `main.py -am AAAAMM --conseiller` (voir conseiller.py),
+-- qui signale les requêtes concernées et mesure leur durée avant / après sur
+-- une base locale (--appliquer).
+--
+-- ESTADO, BFUSIC et CABDSP sont filtrés en mémoire sur les snapshots et RPDOC,
+-- IDINTERNO et IDFACTURA sont déjà des clés primaires : pas d'index pour eux.
+-- Le filtre de période est couvert par migrations/001.
+
+USE `espigon_test`;
+
+-- 1. F58PGOP1 : clé comptable (sous-requêtes dépendantes), lot PGOP (contrôle 2),
+--    lignes rejetées en code 4
+ALTER TABLE `F58PGOP1`
+  ADD INDEX `IX_F58PGOP1_PGCCID` (`PGCCID`, `PGEV01`),
+  ADD INDEX `IX_F58PGOP1_PGASID` (`PGASID`),
+  ADD INDEX `IX_F58PGOP1_PGEV01` (`PGEV01`, `PGCCID`);
+
+-- 2. F0101 : numéro de client (rafraîchissement incrémental de l'annuaire)
+ALTER TABLE `F0101`
+  ADD INDEX `IX_F0101_ABAN8` (`ABAN8`);
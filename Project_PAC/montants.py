@@ -0,0 +1,148 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from mesures import mesurer
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Colonnes stockées en centimes dans les tables sources (les autres sont en unités, DECIMAL(10,2))
+COLONNES_EN_CENTIMES = {'PG74UAMT1'}
+
+
+# -----------------------
+# MONTANTS EN CENTIMES
+# -----------------------
+def en_centimes(valeurs, centimes=False):
+    """
+    Convertit une colonne de montants en centimes entiers.
+
+    Les DECIMAL(10,2) arrivent en Decimal ou en float ; leur produit par 100,
+    arrondi à l'entier le plus proche, est exact tant que le montant a au plus
+    deux décimales et reste sous 2^53 centimes.
+
+    Args:
+        valeurs (Series): montants
+        centimes (bool): la colonne est déjà en centimes (ex: PG74UAMT1)
+
+    Returns:
+        tuple: (ndarray int64 des centimes, ndarray bool des valeurs NULL)
+    """
+    flottants = pd.to_numeric(valeurs, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    nulles = np.isnan(flottants)
+    if not centimes:
+        flottants = flottants * 100
+    return np.where(nulles, 0, np.rint(flottants)).astype(np.int64), nulles
+
+
+def cles_entieres(valeurs):
+    """
+    Clés de jointure en int64.
+
+    Returns:
+        tuple: (ndarray int64, ndarray bool des clés utilisables : non NULL et entières)
+    """
+    flottants = pd.to_numeric(valeurs, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    valides = ~np.isnan(flottants) & (flottants == np.floor(np.nan_to_num(flottants)))
+    return np.where(valides, flottants, 0).astype(np.int64), valides
+
+
+# -----------------------
+# RAPPROCHEMENT
+# -----------------------
+def apparier(cles_gauche, cles_droite):
+    """
+    Jointure interne sur clés entières triées (équivalent de merge how='inner').
+
+    Les lignes de droite sont triées une fois ; chaque clé de gauche est
+    localisée par np.searchsorted. Les clés en double à droite produisent une
+    paire par correspondance, comme pd.merge. L'ordre des lignes de gauche
+    est conservé.
+
+    Args:
+        cles_gauche (ndarray): clés int64 de gauche
+        cles_droite (ndarray): clés int64 de droite
+
+    Returns:
+        tuple: (indices de gauche, indices de droite) des paires appariées
+    """
+    ordre = np.argsort(cles_droite, kind='stable')
+    triees = cles_droite[ordre]
+    debuts = np.searchsorted(triees, cles_gauche, side='left')
+    fins = np.searchsorted(triees, cles_gauche, side='right')
+    nombres = fins - debuts
+
+    indices_gauche = np.repeat(np.arange(len(cles_gauche)), nombres)
+    decalages = np.arange(nombres.sum()) - np.repeat(np.cumsum(nombres) - nombres, nombres)
+    indices_droite = ordre[np.repeat(debuts, nombres) + decalages]
+    return indices_gauche, indices_droite
+
+
+def rapprocher_montants(gauche, cle_gauche, droite, cle_droite, champs, tolerances=None):
+    """
+    Rapproche les montants de deux tables et restitue les lignes divergentes.
+
+    Les montants sont comparés en centimes entiers : aucun faux écart dû à
+    l'arrondi des flottants. Deux montants NULL sont égaux ; un montant NULL
+    face à un montant renseigné est un écart.
+
+    Args:
+        gauche (DataFrame): table de référence (ex: LQ_FACTURA_B)
+        cle_gauche (str): colonne clé de gauche
+        droite (DataFrame): table rapprochée (ex: F03B11)
+        cle_droite (str): colonne clé de droite
+        champs (list): couples (colonne de gauche, colonne de droite) à comparer
+        tolerances (dict): écart absolu toléré en centimes par colonne de gauche (0 par défaut)
+
+    Returns:
+        DataFrame: paires divergentes (colonnes de gauche puis de droite), suivies
+        d'une colonne ECART_<champ> par champ (gauche - droite, en unités) et de
+        CHAMPS_ECART (champs hors tolérance, séparés par des virgules)
+    """
+    tolerances = tolerances or {}
+    if not champs:
+        raise ValueError("Aucun champ à rapprocher")
+    with mesurer('transformation', f"rapprochement {cle_gauche}/{cle_droite}") as mesure:
+        df = _rapprocher(gauche, cle_gauche, droite, cle_droite, champs, tolerances)
+        mesure.lignes = len(df)
+    return df
+
+
+def _rapprocher(gauche, cle_gauche, droite, cle_droite, champs, tolerances):
+    k_gauche, valides_gauche = cles_entieres(gauche[cle_gauche])
+    k_droite, valides_droite = cles_entieres(droite[cle_droite])
+    lignes_gauche = np.flatnonzero(valides_gauche)
+    lignes_droite = np.flatnonzero(valides_droite)
+    i_gauche, i_droite = apparier(k_gauche[lignes_gauche], k_droite[lignes_droite])
+    i_gauche, i_droite = lignes_gauche[i_gauche], lignes_droite[i_droite]
+
+    ecarts, hors_tolerance = {}, {}
+    for col_gauche, col_droite in champs:
+        c_gauche, n_gauche = en_centimes(gauche[col_gauche], col_gauche in COLONNES_EN_CENTIMES)
+        c_droite, n_droite = en_centimes(droite[col_droite], col_droite in COLONNES_EN_CENTIMES)
+        c_gauche, n_gauche = c_gauche[i_gauche], n_gauche[i_gauche]
+        c_droite, n_droite = c_droite[i_droite], n_droite[i_droite]
+
+        difference = c_gauche - c_droite
+        une_nulle = n_gauche != n_droite
+        hors_tolerance[col_gauche] = une_nulle | (
+            ~n_gauche & ~n_droite & (np.abs(difference) > tolerances.get(col_gauche, 0)))
+        ecarts[f"ECART_{col_gauche}"] = np.where(n_gauche | n_droite, np.nan, difference / 100)
+
+    divergentes = np.logical_or.reduce([hors_tolerance[col] for col, _ in champs])
+
+    df = pd.concat([
+        gauche.iloc[i_gauche[divergentes]].reset_index(drop=True),
+        droite.iloc[i_droite[divergentes]].reset_index(drop=True),
+    ], axis=1)
+    for nom, valeurs in ecarts.items():
+        df[nom] = valeurs[divergentes]
+    libelles = pd.Series('', index=df.index)
+    for col, _ in champs:
+        libelles += np.where(hors_tolerance[col][divergentes], f"{col},", '')
+    df['CHAMPS_ECART'] = libelles.str.rstrip(',')
+
+    logger.info(f"Rapprochement {cle_gauche}/{cle_droite} : {len(i_gauche)} paires, "
+                f"{int(divergentes.sum())} hors tolérance.")
+    return df
@@ -0,0 +1,227 @@
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import date
+
+try:
+    import duckdb
+except ImportError:  # moteur optionnel
+    duckdb = None
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Moteurs sélectionnables dans config.ini ([database] moteur)
+MOTEURS = ('mysql', 'sqlite', 'duckdb')
+MOTEURS_EMBARQUES = ('sqlite', 'duckdb')
+
+
+# -----------------------
+# DIALECTES SQL
+# -----------------------
+class Dialecte:
+    """
+    Différences de syntaxe d'un moteur avec le SQL des contrôles, écrit pour MySQL.
+
+    Les requêtes restent écrites une seule fois (marqueurs %s, identifiants
+    entre backquotes, EXPLAIN FORMAT=JSON) ; elles sont traduites ici, à
+    l'exécution, pour les moteurs embarqués.
+
+    Attributes:
+        nom (str): mysql, sqlite ou duckdb
+        marqueur (str): marqueur de paramètre du moteur
+        explain (str): préfixe du plan d'exécution
+        guillemet (str): délimiteur d'identifiant
+        liste_index (str): requête des noms d'index d'une table (marqueur %s : nom de la table)
+    """
+
+    def __init__(self, nom, marqueur='%s', explain='EXPLAIN FORMAT=JSON', guillemet='`',
+                 liste_index="SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+                             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"):
+        self.nom = nom
+        self.marqueur = marqueur
+        self.explain = explain
+        self.guillemet = guillemet
+        self.liste_index = liste_index
+
+    def traduire(self, sql):
+        """Requête écrite pour MySQL -> requête du moteur."""
+        if self.marqueur != '%s':
+            sql = sql.replace('%s', self.marqueur)
+        if self.guillemet != '`':
+            sql = sql.replace('`', self.guillemet)
+        return sql
+
+    def expliquer(self, sql):
+        """Requête du plan d'exécution de `sql` (avant traduction)."""
+        return f"{self.explain} {sql}"
+
+    def creer_index(self, table, nom, colonnes):
+        """DDL de création d'un index (avant traduction)."""
+        liste = ", ".join(f"`{c}`" for c in colonnes)
+        if self.nom == 'mysql':
+            return f"ALTER TABLE `{table}` ADD INDEX `{nom}` ({liste})"
+        return f"CREATE INDEX IF NOT EXISTS `{nom}` ON `{table}` ({liste})"
+
+    def parametres(self, params):
+        """Paramètres liés : les dates sont passées en texte ISO aux moteurs qui stockent les dates en texte."""
+        if self.nom == 'sqlite':
+            return [v.isoformat() if isinstance(v, date) else v for v in (params or ())]
+        return list(params or ())
+
+
+MYSQL = Dialecte('mysql')
+DIALECTES = {
+    'mysql': MYSQL,
+    'sqlite': Dialecte('sqlite', marqueur='?', explain='EXPLAIN QUERY PLAN', guillemet='"',
+                       liste_index="SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s"),
+    'duckdb': Dialecte('duckdb', marqueur='?', explain='EXPLAIN', guillemet='"',
+                       liste_index="SELECT index_name FROM duckdb_indexes() WHERE table_name = %s"),
+}
+
+
+def dialecte_de(connection):
+    """Dialecte d'une connexion (MySQL pour une connexion mysql.connector)."""
+    return getattr(connection, 'dialecte', MYSQL)
+
+
+# -----------------------
+# MOTEURS EMBARQUÉS
+# -----------------------
+class PoolEmbarque:
+    """
+    Pool de connexions sur une base locale SQLite ou DuckDB.
+
+    Offre ce que les contrôles attendent d'un pool MySQL (`get_connection()`,
+    `pool_size`, connexions rendues par `close()`), pour exécuter les mêmes
+    contrôles sur un extrait local sans solliciter la base de production.
+    """
+
+    def __init__(self, moteur, chemin, pool_size=5):
+        """
+        Args:
+            moteur (str): 'sqlite' ou 'duckdb'
+            chemin (str): fichier de la base
+            pool_size (int): connexions simultanées annoncées (tâches parallèles)
+        """
+        if moteur not in MOTEURS_EMBARQUES:
+            raise ValueError(f"Moteur embarqué inconnu '{moteur}' ({', '.join(MOTEURS_EMBARQUES)})")
+        if moteur == 'duckdb' and duckdb is None:
+            raise ImportError("Le moteur duckdb nécessite le paquet duckdb (pip install duckdb)")
+        if not chemin or not os.path.exists(chemin):
+            raise FileNotFoundError(f"Base {moteur} introuvable : {chemin}")
+        self.moteur = moteur
+        self.chemin = chemin
+        self.pool_size = pool_size
+        self._base = None
+        self._verrou = threading.Lock()
+
+    def get_connection(self):
+        if self.moteur == 'sqlite':
+            return ConnexionEmbarquee(sqlite3.connect(self.chemin, check_same_thread=False), 'sqlite')
+        # DuckDB : une base ouverte par pool, une connexion dupliquée par emprunt
+        with self._verrou:
+            if self._base is None:
+                self._base = duckdb.connect(self.chemin)
+            return ConnexionEmbarquee(self._base.cursor(), 'duckdb')
+
+    def fermer(self):
+        with self._verrou:
+            if self._base is not None:
+                self._base.close()
+                self._base = None
+
+
+def ouvrir_connexion(moteur, chemin):
+    """Connexion directe à une base embarquée (créée si elle n'existe pas)."""
+    if moteur == 'sqlite':
+        return ConnexionEmbarquee(sqlite3.connect(chemin, check_same_thread=False), 'sqlite')
+    if moteur == 'duckdb':
+        if duckdb is None:
+            raise ImportError("Le moteur duckdb nécessite le paquet duckdb (pip install duckdb)")
+        return ConnexionEmbarquee(duckdb.connect(chemin), 'duckdb')
+    raise ValueError(f"Moteur embarqué inconnu '{moteur}' ({', '.join(MOTEURS_EMBARQUES)})")
+
+
+class ConnexionEmbarquee:
+    """Connexion SQLite ou DuckDB au protocole mysql.connector utilisé par utils.py, etat.py et catalogue.py."""
+
+    def __init__(self, connexion, moteur):
+        self._connexion = connexion
+        self.dialecte = DIALECTES[moteur]
+        _fonctions_mysql(connexion, moteur)
+
+    def cursor(self, buffered=None, prepared=False):
+        # SQLite : un curseur par appel ; DuckDB : la connexion sert de curseur
+        natif = self._connexion.cursor() if self.dialecte.nom == 'sqlite' else self._connexion
+        return CurseurEmbarque(natif, self.dialecte)
+
+    def charger_dataframe(self, table, df):
+        """Insertion en masse d'un DataFrame (colonnes = colonnes de la table)."""
+        if self.dialecte.nom == 'duckdb':
+            self._connexion.register('_lot_dataframe', df)
+            try:
+                self._connexion.execute(
+                    f"INSERT INTO {table} ({', '.join(df.columns)}) SELECT * FROM _lot_dataframe")
+            finally:
+                self._connexion.unregister('_lot_dataframe')
+            return
+        lignes = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        self._connexion.executemany(
+            f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES ({', '.join(['?'] * len(df.columns))})",
+            list(lignes))
+
+    def interrompre(self):
+        """Interrompt la requête en cours, depuis un autre fil (délai dépassé, voir delais.py)."""
+        self._connexion.interrupt()
+
+    def commit(self):
+        self._connexion.commit()
+
+    def rollback(self):
+        self._connexion.rollback()
+
+    def close(self):
+        self._connexion.close()
+
+
+class CurseurEmbarque:
+    """Curseur traduisant les requêtes MySQL dans le dialecte du moteur."""
+
+    def __init__(self, natif, dialecte):
+        self._natif = natif
+        self.dialecte = dialecte
+
+    def execute(self, sql, params=None):
+        self._natif.execute(self.dialecte.traduire(sql), self.dialecte.parametres(params))
+        return self
+
+    def executemany(self, sql, lignes):
+        self._natif.executemany(self.dialecte.traduire(sql), [self.dialecte.parametres(l) for l in lignes])
+
+    @property
+    def description(self):
+        return self._natif.description
+
+    def fetchall(self):
+        return self._natif.fetchall()
+
+    def fetchmany(self, taille):
+        return self._natif.fetchmany(taille)
+
+    def close(self):
+        if self.dialecte.nom == 'sqlite':
+            self._natif.close()
+
+
+def _fonctions_mysql(connexion, moteur):
+    # Fonctions MySQL utilisées par le chargement incrémental (etat.py), absentes des moteurs embarqués
+    if moteur == 'sqlite':
+        connexion.create_function('CRC32', 1, lambda v: None if v is None else zlib.crc32(str(v).encode('utf-8')))
+        connexion.create_function('CONCAT_WS', -1, lambda sep, *v: sep.join(str(x) for x in v if x is not None))
+    elif moteur == 'duckdb':
+        # Macro native plutôt qu'une fonction Python : une fonction Python appelée pendant qu'un
+        # autre curseur de la même base lit ses lots fait planter DuckDB. Les sommes de contrôle
+        # ne sont comparées qu'entre valeurs du même moteur : un hachage 32 bits suffit.
+        connexion.execute("CREATE OR REPLACE TEMP MACRO CRC32(v) AS hash(v) % 4294967296")
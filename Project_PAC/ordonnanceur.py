@@ -0,0 +1,269 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+
+# -----------------------
+# ORDONNANCEUR DE TÂCHES
+# -----------------------
+# Issue d'une tâche dans le bilan d'exécution (executer_taches(bilan=...)) ; DELAI_DEPASSE est aussi
+# le statut d'une requête arrêtée à son délai (delais.py, mesures.Mesure.statut)
+TERMINEE = "terminée"
+EN_ECHEC = "en échec"
+DELAI_DEPASSE = "délai dépassé"
+NON_EXECUTEE = "non exécutée"
+# Intervalle de surveillance des délais des tâches (secondes)
+INTERVALLE_DELAIS = 0.5
+
+
+@dataclass
+class Tache:
+    """
+    Tâche à exécuter par l'ordonnanceur.
+
+    Attributes:
+        nom (str): identifiant unique de la tâche
+        fonction (callable): appelée avec les résultats des dépendances, dans l'ordre déclaré
+        dependances (tuple): noms des tâches dont le résultat est requis
+        delai (float): durée maximale en secondes depuis son démarrage (None : sans limite) ;
+            appliqué avec un bilan seulement (voir executer_taches)
+    """
+    nom: str
+    fonction: Callable
+    dependances: tuple = field(default_factory=tuple)
+    delai: float = None
+
+
+@dataclass
+class EtatTache:
+    """
+    Issue d'une tâche dans le bilan d'exécution.
+
+    Attributes:
+        nom (str): tâche
+        statut (str): TERMINEE, EN_ECHEC, DELAI_DEPASSE ou NON_EXECUTEE
+        duree (float): durée en secondes (jusqu'à l'abandon si délai dépassé ; None si non exécutée)
+        erreur (str): erreur, délai ou dépendance en cause
+    """
+    nom: str
+    statut: str = NON_EXECUTEE
+    duree: float = None
+    erreur: str = None
+
+
+def executer_taches(taches, max_workers=4, bilan=None):
+    """
+    Exécute des tâches en parallèle en respectant leurs dépendances.
+
+    Une tâche démarre dès que toutes ses dépendances sont terminées. Les
+    résultats sont restitués dans l'ordre de déclaration des tâches, quel
+    que soit l'ordre de fin d'exécution.
+
+    Avec un bilan, une tâche en erreur n'arrête pas les autres : seules les
+    tâches qui dépendent d'elle ne sont pas exécutées. Une tâche avec un délai
+    tourne alors dans un fil démon, hors du pool : si elle dépasse son délai,
+    elle est abandonnée et libère sa place. Son fil ne peut pas être arrêté ;
+    il continue tant que le processus vit et son résultat est ignoré, mais
+    il n'empêche pas le processus de se terminer.
+
+    Args:
+        taches (list): liste de Tache
+        max_workers (int): nombre maximal de tâches simultanées
+        bilan (dict): si fourni, reçoit {nom: EtatTache} de chaque tâche, dans l'ordre de `taches`
+
+    Returns:
+        dict: {nom: résultat}, dans l'ordre de `taches` (avec un bilan : tâches terminées seulement)
+
+    Raises:
+        ValueError: dépendance inconnue ou cycle
+        Exception: sans bilan, première erreur levée par une tâche (les tâches non démarrées sont abandonnées)
+    """
+    noms = [t.nom for t in taches]
+    for tache in taches:
+        inconnues = set(tache.dependances) - set(noms)
+        if inconnues:
+            raise ValueError(f"Tâche '{tache.nom}': dépendances inconnues {sorted(inconnues)}")
+
+    etats = {nom: EtatTache(nom) for nom in noms}
+    resultats = {}
+    en_attente = list(taches)
+    en_cours = {}
+    debuts = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while en_attente or en_cours:
+            # Dépendance en échec, abandonnée ou elle-même non exécutée : tâche non exécutée
+            while _ecarter(en_attente, etats):
+                pass
+            for tache in list(en_attente):
+                if len(en_cours) < max_workers and all(d in resultats for d in tache.dependances):
+                    en_attente.remove(tache)
+                    args = [resultats[d] for d in tache.dependances]
+                    if bilan is not None and tache.delai:
+                        en_cours[_demarrer_fil(tache, args, debuts)] = tache
+                    else:
+                        en_cours[executor.submit(_chronometrer, tache, args, debuts)] = tache
+
+            if not en_cours:
+                if en_attente:
+                    raise ValueError(f"Dépendances cycliques entre {[t.nom for t in en_attente]}")
+                break
+
+            surveillees = bilan is not None and any(t.delai for t in en_cours.values())
+            termines, _ = wait(en_cours, timeout=INTERVALLE_DELAIS if surveillees else None,
+                               return_when=FIRST_COMPLETED)
+            for future in termines:
+                tache = en_cours.pop(future)
+                etat = etats[tache.nom]
+                try:
+                    resultats[tache.nom], etat.duree = future.result()
+                    etat.statut = TERMINEE
+                except Exception as e:
+                    if bilan is None:
+                        for autre in en_cours:
+                            autre.cancel()
+                        raise
+                    etat.statut, etat.erreur = EN_ECHEC, f"{type(e).__name__}: {e}"
+                    etat.duree = time.perf_counter() - debuts.get(tache.nom, time.perf_counter())
+                    logger.error(f"Tâche '{tache.nom}' en échec : {e}")
+
+            if surveillees:
+                maintenant = time.perf_counter()
+                for future, tache in list(en_cours.items()):
+                    debut = debuts.get(tache.nom)
+                    if tache.delai and debut is not None and maintenant - debut > tache.delai:
+                        del en_cours[future]
+                        etat = etats[tache.nom]
+                        etat.statut, etat.duree = DELAI_DEPASSE, maintenant - debut
+                        etat.erreur = f"délai de {tache.delai:g}s dépassé"
+                        logger.error(f"Tâche '{tache.nom}' abandonnée : délai de {tache.delai:g}s dépassé")
+    finally:
+        # Les tâches abandonnées ne sont pas dans le pool : seules les tâches sans délai sont attendues
+        executor.shutdown(wait=True)
+
+    if bilan is not None:
+        bilan.update(etats)
+    return {nom: resultats[nom] for nom in noms if nom in resultats}
+
+
+def _ecarter(en_attente, etats):
+    # Retire les tâches dont une dépendance ne s'est pas terminée ; True si au moins une l'a été
+    ecartees = False
+    for tache in list(en_attente):
+        cause = next((d for d in tache.dependances if etats[d].statut != TERMINEE
+                      and (etats[d].statut != NON_EXECUTEE or etats[d].erreur)), None)
+        if cause is not None:
+            en_attente.remove(tache)
+            etats[tache.nom].erreur = f"dépendance '{cause}' {etats[cause].statut}"
+            ecartees = True
+    return ecartees
+
+
+def _demarrer_fil(tache, args, debuts):
+    # Tâche avec délai : fil démon, qui n'est pas attendu à la fin du processus s'il est abandonné
+    # (les fils d'un ThreadPoolExecutor le sont, même après shutdown(wait=False))
+    future = Future()
+
+    def executer():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(_chronometrer(tache, args, debuts))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=executer, daemon=True, name=f"tache-{tache.nom}").start()
+    return future
+
+
+def _chronometrer(tache, args, debuts):
+    debut = debuts[tache.nom] = time.perf_counter()
+    resultat = tache.fonction(*args)
+    duree = time.perf_counter() - debut
+    logger.info(f"Tâche '{tache.nom}' terminée en {duree:.2f}s")
+    return resultat, duree
+
+
+# -----------------------
+# FILE BORNÉE PRODUCTEUR / CONSOMMATEUR
+# -----------------------
+# Fin de la production, ou erreur du producteur à relever chez le consommateur
+_FIN = object()
+
+
+class _Erreur:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def anticiper(elements, profondeur=2, nom="anticipation"):
+    """
+    Parcourt un itérable dans un fil producteur, jusqu'à `profondeur` éléments d'avance.
+
+    Le producteur (ex: lecture des lots d'un curseur, en attente du réseau)
+    avance pendant que le consommateur traite l'élément précédent (ex:
+    conversion pandas). La file est bornée : le producteur attend dès que
+    `profondeur` éléments sont en attente, ce qui borne la mémoire.
+
+    Une erreur du producteur est relevée chez le consommateur. Si le
+    consommateur s'arrête avant la fin, le producteur s'arrête après
+    l'élément en cours et ferme l'itérable (bloc finally d'un générateur),
+    dans son propre fil, avant le retour du consommateur.
+
+    Args:
+        elements (iterable): éléments produits (parcourus dans le fil producteur seulement)
+        profondeur (int): éléments d'avance au plus (0 : pas de fil, parcours direct)
+        nom (str): nom du fil producteur
+
+    Yields:
+        éléments de `elements`, dans l'ordre
+    """
+    if profondeur <= 0:
+        yield from elements
+        return
+
+    file = queue.Queue(maxsize=profondeur)
+    arret = threading.Event()
+
+    def deposer(element):
+        while not arret.is_set():
+            try:
+                file.put(element, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produire():
+        try:
+            for element in elements:
+                if not deposer(element):
+                    break
+            else:
+                deposer(_FIN)
+        except BaseException as e:
+            deposer(_Erreur(e))
+        finally:
+            fermer = getattr(elements, 'close', None)
+            if fermer is not None:
+                fermer()
+
+    fil = threading.Thread(target=produire, name=nom, daemon=True)
+    fil.start()
+    try:
+        while True:
+            element = file.get()
+            if element is _FIN:
+                return
+            if isinstance(element, _Erreur):
+                raise element.exception
+            yield element
+    finally:
+        arret.set()
+        fil.join()
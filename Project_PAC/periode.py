@@ -0,0 +1,176 @@
+import re
+from dataclasses import dataclass
+from datetime import date
+
+
+# -----------------------
+# PÉRIODE DE CONTRÔLE
+# -----------------------
+@dataclass(frozen=True, order=True)
+class Periode:
+    """
+    Période mensuelle de contrôle, issue de l'argument `-am` (AAAAMM).
+
+    Traduit le mois en prédicats SQL pour chaque table source :
+    - avec les colonnes normalisées de migrations/001_colonnes_periode.sql,
+      un intervalle [début, fin[ exploitable par un index (range scan) ;
+    - sinon, des motifs LIKE cohérents entre tables (année sur 4 chiffres).
+
+    Attributes:
+        year (str): année AAAA
+        month (str): mois MM
+    """
+    year: str
+    month: str
+
+    @classmethod
+    def depuis_argument(cls, am):
+        """
+        Construit la période depuis l'argument `-am`.
+
+        Args:
+            am (str): période au format AAAAMM, ex: 202407
+
+        Returns:
+            Periode
+        """
+        if not re.fullmatch(r"\d{4}(0[1-9]|1[0-2])", am or ""):
+            raise ValueError(f"Période invalide '{am}', format attendu AAAAMM (ex: 202407)")
+        return cls(am[:4], am[4:6])
+
+    @property
+    def code(self):
+        """Période au format AAAAMM."""
+        return f"{self.year}{self.month}"
+
+    @property
+    def debut(self):
+        """Premier jour du mois (inclus)."""
+        return date(int(self.year), int(self.month), 1)
+
+    @property
+    def fin(self):
+        """Premier jour du mois suivant (exclu)."""
+        return self.suivante().debut
+
+    def suivante(self):
+        """Période du mois suivant."""
+        if self.month == '12':
+            return Periode(str(int(self.year) + 1), '01')
+        return Periode(self.year, f"{int(self.month) + 1:02d}")
+
+    def predicat(self, table, alias=None, indexe=True):
+        """
+        Prédicat SQL de la période pour une table source.
+
+        Args:
+            table (str): LQ_FACTURA_B, F58PGOP1 ou F03B11
+            alias (str): alias de la table dans la requête
+            indexe (bool): utiliser les colonnes normalisées indexées
+
+        Returns:
+            tuple: (fragment SQL avec marqueurs %s, liste des paramètres)
+        """
+        return predicat_periodes([self], table, alias=alias, indexe=indexe)
+
+    def __str__(self):
+        return f"{self.year}/{self.month}"
+
+
+def parser_periodes(am):
+    """
+    Interprète l'argument `-am` : une période, une plage ou une liste.
+
+    Exemples : `202407`, `202401-202412`, `202401,202403,202406-202408`.
+
+    Args:
+        am (str): argument `-am`
+
+    Returns:
+        list: périodes triées, sans doublon
+
+    Raises:
+        ValueError: format invalide ou plage inversée
+    """
+    periodes = set()
+    for element in (am or "").split(','):
+        bornes = element.strip().split('-')
+        if len(bornes) == 1:
+            periodes.add(Periode.depuis_argument(bornes[0]))
+        elif len(bornes) == 2:
+            courante, derniere = (Periode.depuis_argument(b) for b in bornes)
+            if derniere < courante:
+                raise ValueError(f"Plage de périodes inversée '{element}'")
+            while courante <= derniere:
+                periodes.add(courante)
+                courante = courante.suivante()
+        else:
+            raise ValueError(f"Période invalide '{element}', format attendu AAAAMM ou AAAAMM-AAAAMM")
+    return sorted(periodes)
+
+
+def _plages_contigues(periodes):
+    """Regroupe des périodes triées en plages de mois consécutifs [(première, dernière)]."""
+    plages = []
+    for periode in sorted(set(periodes)):
+        if plages and plages[-1][1].suivante() == periode:
+            plages[-1][1] = periode
+        else:
+            plages.append([periode, periode])
+    return [tuple(plage) for plage in plages]
+
+
+def predicat_periodes(periodes, table, alias=None, indexe=True):
+    """
+    Prédicat SQL couvrant plusieurs périodes pour une table source.
+
+    Les mois consécutifs sont fusionnés en un seul intervalle, de sorte qu'une
+    plage annuelle reste un unique range scan sur l'index.
+
+    Args:
+        periodes (list): périodes à couvrir
+        table (str): LQ_FACTURA_B, F58PGOP1 ou F03B11
+        alias (str): alias de la table dans la requête
+        indexe (bool): utiliser les colonnes normalisées indexées
+
+    Returns:
+        tuple: (fragment SQL avec marqueurs %s, liste des paramètres)
+    """
+    prefixe = f"{alias}." if alias else ""
+    colonnes = {
+        # FECFACTURA au format JJ/MM/AAAA
+        'LQ_FACTURA_B': ('FECFACTURA_D', 'FECFACTURA', lambda p: f"%/{p.month}/{p.year}"),
+        # PGLOT au format MM/JJ/AAAA
+        'F58PGOP1': ('PGLOT_D', 'PGLOT', lambda p: f"{p.month}/%/{p.year}%"),
+    }
+
+    if table in colonnes:
+        colonne_indexee, colonne_texte, motif = colonnes[table]
+        fragments, params = [], []
+        if indexe:
+            for premiere, derniere in _plages_contigues(periodes):
+                fragments.append(f"({prefixe}{colonne_indexee} >= %s AND {prefixe}{colonne_indexee} < %s)")
+                params += [premiere.debut, derniere.fin]
+        else:
+            for periode in sorted(set(periodes)):
+                fragments.append(f"{prefixe}{colonne_texte} LIKE %s")
+                params.append(motif(periode))
+        return f"({' OR '.join(fragments)})", params
+
+    if table == 'F03B11':
+        # RPVR01 au format REF|PAC|AAAA|... : seule l'année est connue
+        annees = sorted({p.year for p in periodes})
+        if indexe:
+            return f"{prefixe}RPVR01_AN IN ({', '.join(['%s'] * len(annees))})", annees
+        fragments = [f"{prefixe}RPVR01 LIKE %s"] * len(annees)
+        return f"({' OR '.join(fragments)})", [f"%|PAC|{annee}%" for annee in annees]
+
+    raise ValueError(f"Pas de prédicat de période pour la table {table}")
+
+
+def libelle_periodes(periodes):
+    """Libellé lisible d'un ensemble de périodes, ex: '2024/01-2024/12, 2025/03'."""
+    return ", ".join(
+        str(premiere) if premiere == derniere else f"{premiere}-{derniere}"
+        for premiere, derniere in _plages_contigues(periodes)
+    )
@@ -0,0 +1,269 @@
+import logging
+import os
+import queue
+import threading
+
+import pandas as pd
+
+from mesures import mesurer
+from utils import concat_periodes
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Lignes converties à la fois en valeurs Python avant écriture
+TAILLE_LOT = 10000
+# Sections terminées en attente du fil d'écriture (écriture au fil de l'eau, voir RapportExcel.demarrer)
+SECTIONS_EN_ATTENTE = 2
+# Fin des sections terminées : classeur à compléter (ecrire) ou abandonné (abandonner)
+_FIN, _ABANDON = object(), object()
+
+
+# -----------------------
+# RAPPORT EXCEL
+# -----------------------
+class RapportExcel:
+    """
+    Classeur de résultats construit en une seule passe.
+
+    Les contrôles déposent leurs feuilles (DataFrames) pendant l'exécution ;
+    `ecrire()` produit ensuite le fichier une seule fois, en mode openpyxl
+    write-only : les lignes partent directement sur disque sans jamais être
+    matérialisées en objets cellule.
+
+    Les feuilles sont rangées par section (déclarées dans l'ordre voulu), puis
+    par ordre d'ajout dans la section, ce qui rend le classeur déterministe
+    même quand les contrôles tournent en parallèle.
+
+    Après `demarrer()`, les sections signalées terminées (`terminer()`) sont
+    écrites par un fil dédié pendant que les autres contrôles tournent ;
+    `ecrire()` n'a plus qu'à écrire les sections restantes et enregistrer.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._sections = []
+        self._verrou = threading.Lock()
+        self._classeur = None
+        self._terminees = None
+        self._fil = None
+        self._erreur = None
+
+    def section(self, nom, en_tete=False):
+        """
+        Déclare une section du classeur (typiquement un contrôle).
+
+        Args:
+            nom (str): nom de la section
+            en_tete (bool): placer la section avant celles déjà déclarées (synthèse)
+
+        Returns:
+            SectionRapport: objet exposant `ajouter(df, sheet_name)`
+        """
+        section = SectionRapport(nom)
+        with self._verrou:
+            self._sections.insert(0 if en_tete else len(self._sections), section)
+        return section
+
+    @classmethod
+    def consolider(cls, file_path, rapports, colonne='PERIODE'):
+        """
+        Fusionne des rapports de plusieurs périodes en un classeur unique.
+
+        Chaque feuille regroupe les lignes de toutes les périodes, précédées
+        d'une colonne PERIODE.
+
+        Args:
+            file_path (str): chemin du classeur consolidé
+            rapports (dict): {code période AAAAMM: RapportExcel}
+            colonne (str): colonne portant la clé de `rapports` (ENTITE pour les entités d'un groupe)
+
+        Returns:
+            RapportExcel: rapport consolidé (non encore écrit)
+        """
+        consolide = cls(file_path)
+        noms_sections = list(dict.fromkeys(s.nom for r in rapports.values() for s in r._retenues()))
+        for nom in noms_sections:
+            feuilles = {}
+            for code, rapport in rapports.items():
+                for section in rapport._retenues():
+                    if section.nom == nom:
+                        for sheet_name, df in section.feuilles:
+                            feuilles.setdefault(sheet_name, {})[code] = df
+            section = consolide.section(nom)
+            for sheet_name, frames in feuilles.items():
+                section.ajouter(concat_periodes(frames, toujours=True, colonne=colonne), sheet_name)
+        return consolide
+
+    def feuilles(self):
+        """Liste ordonnée des (nom de feuille, DataFrame) à écrire."""
+        return [feuille for section in self._retenues() for feuille in section.feuilles]
+
+    def ecarter(self, section):
+        """
+        Écarte du classeur une section dont le contrôle ne s'est pas terminé (erreur, délai dépassé).
+
+        Ses feuilles, éventuellement partielles, ne sont ni écrites ni consolidées.
+        À appeler avant ecrire() ; sans effet sur une section déjà écrite au fil de l'eau.
+        """
+        section.ecartee = True
+
+    def _retenues(self):
+        with self._verrou:
+            return [section for section in self._sections if not section.ecartee]
+
+    def demarrer(self, profondeur=SECTIONS_EN_ATTENTE):
+        """
+        Écriture au fil de l'eau : les sections terminées sont écrites par un fil dédié.
+
+        Le fil écrit les sections strictement dans l'ordre de déclaration : une
+        section terminée avant la précédente attend que celle-ci le soit. Les
+        sections sont à déclarer avant l'appel.
+
+        Args:
+            profondeur (int): sections terminées en attente du fil au plus (terminer() attend au-delà)
+
+        Returns:
+            RapportExcel: self
+        """
+        from openpyxl import Workbook
+        self._classeur = Workbook(write_only=True)
+        self._terminees = queue.Queue(maxsize=profondeur)
+        self._fil = threading.Thread(target=self._ecrire_terminees, daemon=True,
+                                     name=f"rapport-{os.path.basename(self.file_path)}")
+        self._fil.start()
+        return self
+
+    def terminer(self, section):
+        """Signale qu'une section est complète (sans effet hors écriture au fil de l'eau)."""
+        if self._fil is not None:
+            self._terminees.put(section)
+
+    def abandonner(self):
+        """Arrête l'écriture au fil de l'eau sans produire de fichier (exécution interrompue)."""
+        if self._fil is not None:
+            self._terminees.put(_ABANDON)
+            self._fil.join()
+            self._fil = self._classeur = None
+
+    def _ecrire_terminees(self):
+        terminees, ecrites = set(), 0
+        while True:
+            element = self._terminees.get()
+            if element is _ABANDON:
+                return
+            if element is _FIN:
+                # Sections restantes (non signalées), dans l'ordre
+                self._ecrire_sections(ecrites)
+                return
+            terminees.add(id(element))
+            ecrites = self._ecrire_sections(ecrites, terminees)
+
+    def _ecrire_sections(self, ecrites, terminees=None):
+        # Écrit les sections à partir du rang `ecrites` tant qu'elles sont terminées (toutes si None)
+        with self._verrou:
+            sections = list(self._sections)
+        while ecrites < len(sections) and (terminees is None or id(sections[ecrites]) in terminees):
+            if self._erreur is None and not sections[ecrites].ecartee:
+                try:
+                    ecrire_section(self._classeur, sections[ecrites])
+                except Exception as e:
+                    self._erreur = e
+            ecrites += 1
+        return ecrites
+
+    def ecrire(self):
+        """
+        Écrit le classeur en une passe (ou achève l'écriture au fil de l'eau).
+
+        Returns:
+            bool: True si un fichier a été produit (au moins une feuille)
+        """
+        wb = None
+        if self._fil is not None:
+            self._terminees.put(_FIN)
+            self._fil.join()
+            wb, self._fil, self._classeur = self._classeur, None, None
+
+        feuilles = self.feuilles()
+        if not feuilles:
+            logger.info("Aucune feuille à écrire, pas de rapport Excel.")
+            return False
+
+        try:
+            if self._erreur is not None:
+                raise self._erreur
+            if wb is None:
+                # openpyxl importé à l'écriture seulement : une exécution sans feuille ne le charge pas
+                from openpyxl import Workbook
+                wb = Workbook(write_only=True)
+                for section in self._retenues():
+                    ecrire_section(wb, section)
+            with mesurer('feuille', os.path.basename(self.file_path), controle='rapport') as mesure:
+                wb.save(self.file_path)
+                mesure.octets = os.path.getsize(self.file_path)
+            logger.info(f"Rapport Excel écrit : {len(feuilles)} feuille(s) dans {self.file_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Erreur lors de l'écriture du rapport Excel {self.file_path}: {e}")
+            return False
+
+
+class SectionRapport:
+    """Feuilles d'une section du rapport, dans leur ordre d'ajout."""
+
+    def __init__(self, nom):
+        self.nom = nom
+        self.feuilles = []
+        self.ecartee = False
+
+    def ajouter(self, df, sheet_name):
+        """
+        Ajoute une feuille au rapport (écrite lors de RapportExcel.ecrire()).
+
+        Args:
+            df (DataFrame): données de la feuille
+            sheet_name (str): nom de la feuille (31 caractères max)
+        """
+        self.feuilles.append((sheet_name, df))
+        logger.info(f"Feuille '{sheet_name}' ajoutée au rapport ({len(df)} lignes)")
+
+
+def ecrire_section(wb, section):
+    """Écrit les feuilles d'une section dans un classeur write-only (mesurées)."""
+    for sheet_name, df in section.feuilles:
+        with mesurer('feuille', sheet_name, controle=section.nom) as mesure:
+            ecrire_feuille(wb, df, sheet_name)
+            mesure.lignes = len(df)
+
+
+def ecrire_feuille(wb, df, sheet_name):
+    """
+    Écrit un DataFrame dans une feuille d'un classeur write-only, par lots.
+
+    Args:
+        wb (Workbook): classeur openpyxl ouvert en write_only
+        df (DataFrame): données
+        sheet_name (str): nom de la feuille
+    """
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    ws = wb.create_sheet(title=sheet_name)
+
+    entete = []
+    for colonne in df.columns:
+        cell = WriteOnlyCell(ws, value=str(colonne))
+        cell.font = Font(bold=True)
+        entete.append(cell)
+    ws.append(entete)
+
+    # Conversion par lots : NaN/NA -> cellule vide, types numpy -> types Python, dates sans heure
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    for debut in range(0, len(df), TAILLE_LOT):
+        lot = df.iloc[debut:debut + TAILLE_LOT]
+        if dates:
+            lot = lot.assign(**{c: lot[c].dt.date for c in dates})
+        lot = lot.astype(object)
+        lot = lot.where(lot.notna(), None)
+        for ligne in lot.itertuples(index=False, name=None):
+            ws.append(ligne)
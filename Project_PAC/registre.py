@@ -0,0 +1,359 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from schemas import textes_dates
+from tableau_html import tableau_html
+from utils import concat_periodes, chemin_entite
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Colonne identifiant une anomalie dans le résultat de chaque contrôle
+CLES_CONTROLES = {
+    'controle_1': 'IDINTERNO',
+    'controle_2': 'IDFACTURA',
+    'controle_3': 'PGCCID',
+    'controle_4': 'PGCCID',
+    'controle_5': 'IDINTERNO',
+}
+# Colonnes des anomalies toujours ouvertes reprises dans les emails (en plus de la clé)
+COLONNES_OUVERTES = ['NUMFACTURA']
+
+
+# -----------------------
+# SUIVI D'UN CONTRÔLE
+# -----------------------
+@dataclass
+class Suivi:
+    """
+    Anomalies d'un contrôle classées par rapport aux exécutions précédentes.
+
+    Attributes:
+        nouvelles (DataFrame): lignes du contrôle jamais vues, ou réapparues après
+            résolution (colonne SUIVI : 'nouvelle' ou 'réapparue')
+        ouvertes (DataFrame): lignes déjà signalées et toujours présentes
+            (colonnes OUVERTE_LE et AGE_JOURS)
+        resolues (DataFrame): anomalies ouvertes absentes de cette exécution, telles
+            que vues à leur signalement (colonnes OUVERTE_LE, RESOLUE_LE, AGE_JOURS)
+    """
+    nouvelles: pd.DataFrame
+    ouvertes: pd.DataFrame
+    resolues: pd.DataFrame
+
+    @property
+    def vide(self):
+        return self.nouvelles.empty and self.ouvertes.empty and self.resolues.empty
+
+    @property
+    def en_cours(self):
+        """True s'il reste des anomalies à traiter (nouvelles ou toujours ouvertes)."""
+        return not (self.nouvelles.empty and self.ouvertes.empty)
+
+    def selection(self, masque):
+        """
+        Suivi restreint aux lignes retenues par `masque` (fonction DataFrame -> Series booléenne),
+        ex: lambda df: df['ESTADO'] == 'L'.
+        """
+        def filtrer(df):
+            return df if df.empty else df[masque(df)]
+        return Suivi(filtrer(self.nouvelles), filtrer(self.ouvertes), filtrer(self.resolues))
+
+    @classmethod
+    def concat(cls, suivis):
+        """Suivis de plusieurs périodes ({code AAAAMM: Suivi}) regroupés, colonne PERIODE comme concat_periodes."""
+        return cls(*(concat_periodes({code: getattr(s, partie) for code, s in suivis.items()})
+                     for partie in ('nouvelles', 'ouvertes', 'resolues')))
+
+    def html(self, budget=None, cle=None):
+        """
+        Tableaux de l'email : anomalies nouvelles (lignes complètes), toujours ouvertes
+        (clé, numéro de facture et âge) et résolues depuis l'exécution précédente.
+
+        Args:
+            budget (BudgetEmail): budget partagé des tableaux
+            cle (str): colonne clé, reprise dans les tableaux réduits
+        """
+        html = ""
+        if not self.nouvelles.empty:
+            html += tableau_html(self.nouvelles, budget, titre=f"Nouvelles anomalies ({len(self.nouvelles)})")
+        if not self.ouvertes.empty:
+            ouvertes = self.ouvertes.sort_values('AGE_JOURS', ascending=False, kind='stable')
+            html += tableau_html(ouvertes[_colonnes_reduites(ouvertes, cle) + ['OUVERTE_LE', 'AGE_JOURS']], budget,
+                                 titre=f"Toujours ouvertes ({len(ouvertes)})", colonnes_sommes=[])
+        if not self.resolues.empty:
+            html += tableau_html(self.resolues[_colonnes_reduites(self.resolues, cle)
+                                               + ['OUVERTE_LE', 'RESOLUE_LE', 'AGE_JOURS']], budget,
+                                 titre=f"Résolues depuis la dernière exécution ({len(self.resolues)})",
+                                 colonnes_sommes=[])
+        return html
+
+
+def _colonnes_reduites(df, cle):
+    return [c for c in ['PERIODE', cle, *COLONNES_OUVERTES] if c is not None and c in df.columns]
+
+
+# -----------------------
+# REGISTRE DES ANOMALIES
+# -----------------------
+class RegistreAnomalies:
+    """
+    Registre local (SQLite) des anomalies trouvées par les contrôles 1 à 5.
+
+    Chaque anomalie est identifiée par (contrôle, période, clé) — la clé est
+    l'identifiant de facture du résultat du contrôle (CLES_CONTROLES). Le
+    registre conserve pour chacune sa date d'ouverture, sa dernière
+    observation, sa résolution et le nombre de réouvertures, ainsi que
+    chaque observation par exécution (historique).
+
+    À chaque exécution, le résultat d'un contrôle est comparé aux anomalies
+    connues de la période : nouvelles, réapparues, toujours ouvertes ou
+    résolues (absentes du résultat). Les emails ne reprennent que ce suivi.
+    """
+
+    def __init__(self, chemin=os.path.join("output", "registre_anomalies.sqlite"), retention_jours=400):
+        """
+        Args:
+            chemin (str): fichier SQLite du registre
+            retention_jours (int): durée de conservation des observations (0 : sans limite)
+        """
+        self.chemin = chemin
+        self.retention_jours = retention_jours
+        self._verrou = threading.Lock()
+        os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+        with self._connexion() as conn:
+            conn.executescript("""
+            CREATE TABLE IF NOT EXISTS executions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, periodes TEXT);
+            CREATE TABLE IF NOT EXISTS anomalies (
+                controle TEXT, periode TEXT, cle TEXT,
+                premiere_vue TEXT, ouverte_le TEXT, derniere_vue TEXT,
+                resolue_le TEXT, resolue_execution INTEGER, reouvertures INTEGER DEFAULT 0, details TEXT,
+                PRIMARY KEY (controle, periode, cle));
+            CREATE INDEX IF NOT EXISTS anomalies_cle ON anomalies (cle);
+            CREATE INDEX IF NOT EXISTS anomalies_ouvertes ON anomalies (resolue_le, controle);
+            CREATE TABLE IF NOT EXISTS observations (
+                cle TEXT, controle TEXT, periode TEXT, execution INTEGER,
+                PRIMARY KEY (cle, controle, periode, execution)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS observations_execution ON observations (execution);
+            """)
+
+    @classmethod
+    def depuis_config(cls, config, entite=None):
+        """
+        Registre configuré par la section [registre] de config.ini, ou None s'il est désactivé.
+
+        Args:
+            entite (str): entité contrôlée : registre dans son sous-répertoire (voir utils.chemin_entite)
+        """
+        section = config['registre'] if config.has_section('registre') else {}
+        if str(section.get('actif', 'true')).lower() not in ('true', '1', 'yes', 'on'):
+            return None
+        return cls(chemin_entite(section.get('chemin', os.path.join("output", "registre_anomalies.sqlite")), entite),
+                   retention_jours=int(section.get('retention_jours', 400)))
+
+    def _connexion(self):
+        return sqlite3.connect(self.chemin, timeout=30)
+
+    def ouvrir_execution(self, periodes):
+        """
+        Enregistre une exécution et purge les observations au-delà de la rétention.
+
+        Args:
+            periodes (str): périodes contrôlées, ex: '202406,202407'
+
+        Returns:
+            tuple: (identifiant, date ISO) de l'exécution
+        """
+        date = datetime.now().isoformat(timespec='seconds')
+        with self._verrou, self._connexion() as conn:
+            execution = conn.execute("INSERT INTO executions (date, periodes) VALUES (?, ?)",
+                                     (date, periodes)).lastrowid
+            if self.retention_jours:
+                limite = (datetime.now() - timedelta(days=self.retention_jours)).isoformat(timespec='seconds')
+                conn.execute("DELETE FROM observations WHERE execution IN "
+                             "(SELECT id FROM executions WHERE date < ?)", (limite,))
+        return execution, date
+
+    def enregistrer(self, execution, controle, periode, df, complet=True):
+        """
+        Enregistre le résultat d'un contrôle pour une période et le classe.
+
+        Args:
+            execution (tuple): exécution (ouvrir_execution)
+            controle (str): nom du contrôle (clé de CLES_CONTROLES)
+            periode (str): code AAAAMM
+            df (DataFrame): anomalies trouvées
+            complet (bool): False si les données sources étaient incomplètes (table en
+                erreur) : aucune anomalie n'est alors considérée comme résolue
+
+        Returns:
+            Suivi: anomalies nouvelles, toujours ouvertes et résolues
+        """
+        identifiant, date = execution
+        colonne = CLES_CONTROLES[controle]
+        if colonne in df.columns:
+            df = df[df[colonne].notna()].drop_duplicates(colonne)
+            cles = _textes_cles(df[colonne])
+        else:
+            df, cles = df.iloc[0:0], pd.Series(dtype=str)
+
+        cles = cles.to_numpy(dtype=object)
+        with self._verrou, self._connexion() as conn:
+            connues = dict(((cle, (ouverte_le, resolue_le)) for cle, ouverte_le, resolue_le in conn.execute(
+                "SELECT cle, ouverte_le, resolue_le FROM anomalies WHERE controle = ? AND periode = ?",
+                (controle, periode))))
+            etats = [connues.get(c) for c in cles]
+            deja_vues = np.fromiter((e is not None for e in etats), bool, len(cles))
+            reapparues = np.fromiter((e is not None and e[1] is not None for e in etats), bool, len(cles))
+            toujours = deja_vues & ~reapparues
+            signalees = ~toujours
+            presentes = set(cles)
+            resolues = [c for c, (_, resolue_le) in connues.items()
+                        if resolue_le is None and c not in presentes] if complet else []
+
+            conn.executemany(
+                "UPDATE anomalies SET resolue_le = ?, resolue_execution = ? WHERE controle = ? AND periode = ? "
+                "AND cle = ?", [(date, identifiant, controle, periode, c) for c in resolues])
+            details = _details(df[signalees])
+            conn.executemany(
+                "UPDATE anomalies SET ouverte_le = ?, resolue_le = NULL, resolue_execution = NULL,"
+                " reouvertures = reouvertures + 1, details = ? WHERE controle = ? AND periode = ? AND cle = ?",
+                [(date, d, controle, periode, c) for c, d in zip(cles[reapparues], details[reapparues[signalees]])])
+            conn.executemany(
+                "INSERT INTO anomalies (controle, periode, cle, premiere_vue, ouverte_le, details) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(controle, periode, c, date, date, d)
+                 for c, d in zip(cles[~deja_vues], details[~deja_vues[signalees]])])
+            # Après résolution : les anomalies ouvertes de la période sont exactement celles observées
+            conn.execute("UPDATE anomalies SET derniere_vue = ? WHERE controle = ? AND periode = ? "
+                         "AND resolue_le IS NULL", (date, controle, periode))
+            conn.executemany(
+                "INSERT OR IGNORE INTO observations (cle, controle, periode, execution) VALUES (?, ?, ?, ?)",
+                [(c, controle, periode, identifiant) for c in cles])
+            resolues = pd.read_sql(
+                "SELECT ouverte_le, details FROM anomalies WHERE controle = ? AND periode = ? "
+                "AND resolue_execution = ?", conn, params=(controle, periode, identifiant)) if resolues else None
+
+        jour = pd.Timestamp(date).normalize()
+        nouvelles = df[signalees].assign(
+            SUIVI=np.where(reapparues[signalees], 'réapparue', 'nouvelle'))
+        ouverte_le = pd.to_datetime([etats[i][0] for i in np.flatnonzero(toujours)])
+        ouvertes = df[toujours].assign(OUVERTE_LE=ouverte_le.strftime('%Y-%m-%d'),
+                                       AGE_JOURS=(jour - ouverte_le.normalize()).days)
+        if resolues is not None:
+            debut = pd.to_datetime(resolues['ouverte_le'])
+            resolues = pd.DataFrame.from_records([json.loads(d) for d in resolues['details']]).assign(
+                OUVERTE_LE=debut.dt.strftime('%Y-%m-%d').to_numpy(), RESOLUE_LE=jour.strftime('%Y-%m-%d'),
+                AGE_JOURS=(jour - debut.dt.normalize()).dt.days.to_numpy())
+        else:
+            resolues = pd.DataFrame()
+        logger.info(f"Registre {controle} {periode} : {len(nouvelles)} nouvelle(s), {len(ouvertes)} toujours "
+                    f"ouverte(s), {len(resolues)} résolue(s).")
+        return Suivi(nouvelles, ouvertes, resolues)
+
+    # ----- consultation -----
+    def historique(self, cle, controle=None):
+        """
+        Observations d'une facture, de la plus récente à la plus ancienne.
+
+        Returns:
+            DataFrame: date, execution, controle, periode
+        """
+        sql = ("SELECT e.date, o.execution, o.controle, o.periode FROM observations o "
+               "JOIN executions e ON e.id = o.execution WHERE o.cle = ?")
+        params = [str(cle)]
+        if controle:
+            sql += " AND o.controle = ?"
+            params.append(controle)
+        with self._connexion() as conn:
+            return pd.read_sql(sql + " ORDER BY o.execution DESC", conn, params=params)
+
+    def anomalies(self, cle):
+        """Anomalies du registre pour une facture, tous contrôles et périodes confondus."""
+        with self._connexion() as conn:
+            return pd.read_sql(
+                "SELECT controle, periode, premiere_vue, ouverte_le, derniere_vue, resolue_le, reouvertures "
+                "FROM anomalies WHERE cle = ? ORDER BY controle, periode", conn, params=(str(cle),))
+
+    def ouvertes(self, controle=None, periode=None, age_min=0):
+        """
+        Anomalies ouvertes, des plus anciennes aux plus récentes.
+
+        Args:
+            controle (str): restreindre à un contrôle
+            periode (str): restreindre à une période AAAAMM
+            age_min (int): âge minimal en jours
+
+        Returns:
+            DataFrame: controle, periode, cle, ouverte_le, derniere_vue, reouvertures, AGE_JOURS
+        """
+        sql = ("SELECT controle, periode, cle, ouverte_le, derniere_vue, reouvertures FROM anomalies "
+               "WHERE resolue_le IS NULL")
+        params = []
+        if controle:
+            sql += " AND controle = ?"
+            params.append(controle)
+        if periode:
+            sql += " AND periode = ?"
+            params.append(periode)
+        if age_min:
+            sql += " AND ouverte_le <= ?"
+            params.append((datetime.now() - timedelta(days=age_min)).isoformat(timespec='seconds'))
+        with self._connexion() as conn:
+            df = pd.read_sql(sql + " ORDER BY ouverte_le", conn, params=params)
+        return df.assign(AGE_JOURS=(pd.Timestamp.now().normalize()
+                                    - pd.to_datetime(df['ouverte_le']).dt.normalize()).dt.days)
+
+
+def _textes_cles(valeurs):
+    """Clés en texte, identiques quel que soit le type lu (1004, 1004.0, Decimal('1004') -> '1004')."""
+    nombres = pd.to_numeric(valeurs, errors='coerce')
+    if nombres.notna().all() and (nombres % 1 == 0).all():
+        return nombres.astype('int64').astype(str)
+    return valeurs.astype(str)
+
+
+def _details(df):
+    """Ligne de chaque anomalie en JSON (reprise dans le tableau des anomalies résolues)."""
+    if df.empty:
+        return pd.Series(dtype=object).to_numpy()
+    textes = textes_dates(df).astype(object)
+    textes = textes.where(textes.notna(), None)
+    return pd.Series([json.dumps(ligne, ensure_ascii=False, default=str)
+                      for ligne in textes.to_dict('records')], dtype=object).to_numpy()
+
+
+# -----------------------
+# MAIN
+# -----------------------
+def main():
+    parser = argparse.ArgumentParser(description="Consultation du registre des anomalies PGOP → JDE")
+    parser.add_argument("--registre", type=str, default=os.path.join("output", "registre_anomalies.sqlite"),
+                        help="Fichier SQLite du registre")
+    parser.add_argument("--cle", type=str, default=None,
+                        help="Facture (IDINTERNO / IDFACTURA / PGCCID) : anomalies et historique")
+    parser.add_argument("--controle", type=str, default=None, choices=sorted(CLES_CONTROLES))
+    parser.add_argument("--periode", type=str, default=None, help="Période AAAAMM")
+    parser.add_argument("--age-min", type=int, default=0, help="Anomalies ouvertes depuis au moins N jours")
+    args = parser.parse_args()
+
+    registre = RegistreAnomalies(args.registre, retention_jours=0)
+    with pd.option_context('display.max_rows', 200, 'display.width', 200):
+        if args.cle:
+            print(registre.anomalies(args.cle).to_string(index=False))
+            print()
+            print(registre.historique(args.cle, args.controle).to_string(index=False))
+        else:
+            print(registre.ouvertes(args.controle, args.periode, args.age_min).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
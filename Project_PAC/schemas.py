@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+# Types compacts des colonnes
+ENTIER = 'entier'          # identifiants : int32 (int64 au-delà), float64 s'il y a des NULL
+CATEGORIE = 'categorie'    # peu de valeurs distinctes (états, indicateurs, lots, noms clients)
+MONTANT = 'montant'        # DECIMAL(10,2) : float64 plutôt que des objets Decimal
+DATE = 'date'              # dates texte JJ/MM/AAAA (ou JJ/MM/AA) : datetime64
+
+# Affichage des dates dans les emails et le registre (format des tables sources)
+FORMAT_DATE = '%d/%m/%Y'
+FORMATS_DATE = ('%d/%m/%Y', '%d/%m/%y')
+
+
+# -----------------------
+# SCHÉMAS DES TABLES SOURCES
+# -----------------------
+# Table du snapshot -> {colonne: type} ; les colonnes absentes du schéma restent telles que lues
+SCHEMAS = {
+    'factures': {'IDINTERNO': ENTIER, 'ESTADO': CATEGORIE, 'FECFACTURA': DATE,
+                 'IMPNET': MONTANT, 'IMPIVA': MONTANT, 'IMPTOT': MONTANT, 'NOMUSU': CATEGORIE},
+    'cabfac': {'IDFACTURA': ENTIER, 'CABDSP': CATEGORIE, 'FECFACTURA': DATE, 'TIPOSERIE': CATEGORIE,
+               'IMPNET': MONTANT},
+    'pgop1': {'PGCCID': ENTIER, 'PGASID': ENTIER, 'PGLOT': CATEGORIE, 'PG74UAMT1': ENTIER, 'PGEV01': CATEGORIE},
+    'f03b11': {'RPDOC': ENTIER, 'RPATXA': MONTANT, 'RPSTAM': MONTANT, 'RPAG': MONTANT},
+    'clients_code4': {'IDINTERNO': ENTIER, 'NOMUSU': CATEGORIE},
+}
+SCHEMAS['hors_compta'] = SCHEMAS['pgop1']
+# Colonnes de montants des tables sources (totaux des tableaux d'email, voir tableau_html.ligne_totaux)
+COLONNES_MONTANTS = frozenset(colonne for schema in SCHEMAS.values()
+                              for colonne, type_colonne in schema.items() if type_colonne == MONTANT)
+
+
+def appliquer_schema(df, schema):
+    """
+    Convertit les colonnes d'un DataFrame aux types compacts de son schéma.
+
+    Une colonne n'est convertie que si toutes ses valeurs renseignées le sont
+    (identifiant texte non numérique, date illisible : colonne inchangée). Une
+    colonne déjà au bon type n'est pas recopiée : l'appel est idempotent.
+
+    Args:
+        df (DataFrame): résultat lu
+        schema (str | dict): nom de table de SCHEMAS, ou {colonne: type} (None : inchangé)
+
+    Returns:
+        DataFrame: df converti (le même objet si rien n'a changé)
+    """
+    if isinstance(schema, str):
+        schema = SCHEMAS.get(schema)
+    if not schema or df.columns.empty:
+        return df
+    conversions = {}
+    for colonne, type_colonne in schema.items():
+        if colonne in df.columns:
+            valeurs = df[colonne]
+            convertie = _CONVERSIONS[type_colonne](valeurs)
+            if convertie is not valeurs:
+                conversions[colonne] = convertie
+    return df.assign(**conversions) if conversions else df
+
+
+def concat_lots(lots, schema=None):
+    """
+    Assemble des lots lus séparément, sans perdre les types compacts.
+
+    Les catégories des lots sont unifiées avant l'assemblage (pd.concat
+    convertirait sinon en objets des catégories différentes d'un lot à l'autre),
+    dans un type commun : un lot entièrement NULL a des catégories vides de
+    type objet, un lot d'entiers avec NULL des catégories float64.
+    """
+    if len(lots) == 1:
+        return lots[0]
+    colonnes = lots[0].columns
+    for colonne in colonnes:
+        if any(isinstance(lot[colonne].dtype, pd.CategoricalDtype) for lot in lots):
+            type_commun = pd.CategoricalDtype(_categories_communes([lot[colonne] for lot in lots]))
+            lots = [lot.assign(**{colonne: lot[colonne].astype(type_commun)}) for lot in lots]
+    return appliquer_schema(pd.concat(lots, ignore_index=True), schema)
+
+
+def _categories_communes(colonnes):
+    # Union triée des catégories des lots, dans le type commun de leurs catégories non vides
+    categories = [c.cat.categories if isinstance(c.dtype, pd.CategoricalDtype) else c.dropna().unique()
+                  for c in colonnes]
+    categories = [pd.Index(c) for c in categories if len(c)] or [pd.Index([], dtype=object)]
+    union = categories[0].append(categories[1:]).unique() if len(categories) > 1 else categories[0]
+    try:
+        return union.sort_values()
+    except TypeError:
+        # Types non comparables entre eux (texte et nombres) : ordre de première apparition
+        return union
+
+
+def _entier(valeurs):
+    if pd.api.types.is_integer_dtype(valeurs) and valeurs.dtype.itemsize <= 4:
+        return valeurs
+    nombres = pd.to_numeric(valeurs, errors='coerce')
+    nulles = nombres.isna()
+    if (nulles != valeurs.isna()).any():
+        return valeurs
+    if nulles.any() or (nombres % 1 != 0).any():
+        return valeurs if valeurs.dtype == 'float64' else nombres.astype('float64')
+    if nombres.empty or (nombres.min() >= np.iinfo(np.int32).min and nombres.max() <= np.iinfo(np.int32).max):
+        return nombres.astype('int32')
+    return valeurs if valeurs.dtype == 'int64' else nombres.astype('int64')
+
+
+def _categorie(valeurs):
+    if isinstance(valeurs.dtype, pd.CategoricalDtype):
+        return valeurs
+    return valeurs.astype('category')
+
+
+def _montant(valeurs):
+    if valeurs.dtype == 'float64':
+        return valeurs
+    try:
+        # Decimal et nombres : conversion directe, bien plus rapide que pd.to_numeric sur des objets
+        return valeurs.astype('float64')
+    except (TypeError, ValueError):
+        nombres = pd.to_numeric(valeurs, errors='coerce')
+    if (nombres.isna() != valeurs.isna()).any():
+        return valeurs
+    return nombres.astype('float64')
+
+
+def _date(valeurs):
+    if pd.api.types.is_datetime64_any_dtype(valeurs):
+        return valeurs
+    # JJ/MM/AA (8 caractères, ancien format) ou JJ/MM/AAAA, comme migrations/001
+    textes = valeurs if pd.api.types.is_string_dtype(valeurs) else valeurs.astype(object).astype('string')
+    courtes = (textes.str.len() == 8).fillna(False)
+    dates = pd.to_datetime(textes.where(~courtes), format=FORMATS_DATE[0], errors='coerce')
+    if courtes.any():
+        dates = dates.where(~courtes, pd.to_datetime(textes.where(courtes), format=FORMATS_DATE[1],
+                                                     errors='coerce'))
+    if (dates.isna() & textes.notna()).any():
+        return valeurs
+    return dates
+
+
+_CONVERSIONS = {ENTIER: _entier, CATEGORIE: _categorie, MONTANT: _montant, DATE: _date}
+
+
+def textes_dates(df):
+    """Colonnes de dates en texte JJ/MM/AAAA (affichage), les autres colonnes inchangées."""
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    if not dates:
+        return df
+    return df.assign(**{c: df[c].dt.strftime(FORMAT_DATE) for c in dates})
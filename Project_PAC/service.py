@@ -0,0 +1,319 @@
+import argparse
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+
+from main import executer_controles, configurer_journal
+from periode import Periode, parser_periodes, libelle_periodes
+from snapshot import charger_references
+from utils import get_db_pool, load_parametres
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Bornes des champs cron : minute, heure, jour du mois, mois, jour de la semaine (0 ou 7 = dimanche)
+BORNES_CRON = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+# -----------------------
+# PLANIFICATION CRON
+# -----------------------
+class Planification:
+    """
+    Expression cron à cinq champs : `minute heure jour mois jour_semaine`.
+
+    Chaque champ accepte `*`, une valeur, une plage `a-b`, une liste `a,b`
+    et un pas `*/n` ou `a-b/n`. Comme cron, si le jour du mois et le jour de
+    la semaine sont tous deux restreints, l'un ou l'autre suffit.
+    """
+
+    def __init__(self, expression):
+        champs = expression.split()
+        if len(champs) != 5:
+            raise ValueError(f"Planification invalide '{expression}' : 5 champs attendus")
+        self.expression = expression
+        self.minutes, self.heures, self.jours, self.mois, self.jours_semaine = (
+            _valeurs_cron(champ, *bornes) for champ, bornes in zip(champs, BORNES_CRON))
+        if 7 in self.jours_semaine:
+            self.jours_semaine = self.jours_semaine | {0}
+        self._jour_libre = champs[2] == '*'
+        self._semaine_libre = champs[4] == '*'
+
+    def correspond(self, instant):
+        """True si l'exécution est due à la minute de `instant`."""
+        jour = instant.day in self.jours
+        jour_semaine = (instant.weekday() + 1) % 7 in self.jours_semaine
+        if self._jour_libre or self._semaine_libre:
+            jour_ok = jour and jour_semaine
+        else:
+            jour_ok = jour or jour_semaine
+        return (instant.minute in self.minutes and instant.hour in self.heures
+                and instant.month in self.mois and jour_ok)
+
+    def __str__(self):
+        return self.expression
+
+
+def _valeurs_cron(champ, minimum, maximum):
+    valeurs = set()
+    for element in champ.split(','):
+        plage, _, pas = element.partition('/')
+        if plage == '*':
+            debut, fin = minimum, maximum
+        elif '-' in plage:
+            debut, fin = (int(v) for v in plage.split('-'))
+        else:
+            debut = fin = int(plage)
+        if not (minimum <= debut <= fin <= maximum):
+            raise ValueError(f"Valeur cron hors bornes '{element}' ({minimum}-{maximum})")
+        valeurs.update(range(debut, fin + 1, int(pas) if pas else 1))
+    return valeurs
+
+
+def periodes_planifiees(am, maintenant=None):
+    """
+    Périodes d'une exécution planifiée.
+
+    Args:
+        am (str): 'courante', 'precedente' ou un argument -am (AAAAMM, plage, liste)
+        maintenant (datetime): instant de référence
+
+    Returns:
+        list: périodes
+    """
+    maintenant = maintenant or datetime.now()
+    courante = Periode(f"{maintenant.year:04d}", f"{maintenant.month:02d}")
+    if am == 'courante':
+        return [courante]
+    if am == 'precedente':
+        veille = courante.debut - timedelta(days=1)
+        return [Periode(f"{veille.year:04d}", f"{veille.month:02d}")]
+    return parser_periodes(am)
+
+
+# -----------------------
+# SERVICE RÉSIDENT
+# -----------------------
+class Service:
+    """
+    Mode service : processus résident qui garde chaud ce qu'une exécution cron refait à chaque fois.
+
+    - modules pandas / mysql.connector / openpyxl importés une fois ;
+    - paramètres typés de config.ini en cache, relus seulement si le fichier change ;
+    - pool de connexions ouvert, recréé si les paramètres de base changent ;
+    - données de référence (F0101) en cache pendant [service] ttl_references secondes.
+
+    Les exécutions sont déclenchées par les planifications cron de [service]
+    planification, ou à la demande sur le socket de commande local (voir
+    CommandeHandler). Elles passent une par une dans une file.
+    """
+
+    def __init__(self):
+        self._file = queue.Queue()
+        self._verrou = threading.Lock()
+        self._arret = threading.Event()
+        self._pool, self._cle_pool = None, None
+        self._references, self._references_chargees = None, 0.0
+        self.en_cours = None
+        self.derniere = None
+
+    # ----- ressources chaudes -----
+    def pool(self):
+        """Pool de connexions, recréé si moteur/host/base/utilisateur/taille ont changé dans config.ini."""
+        parametres = load_parametres()
+        cle = (parametres.moteur, parametres.chemin_base, tuple(sorted(parametres.db.items())), parametres.pool_size)
+        with self._verrou:
+            if self._pool is None or cle != self._cle_pool:
+                if self._pool is not None:
+                    logger.info("Paramètres de base modifiés : recréation du pool.")
+                    _fermer_pool(self._pool)
+                    self._references = None
+                self._pool, self._cle_pool = get_db_pool(parametres.pool_size), cle
+            return self._pool
+
+    def references(self):
+        """Données de référence en cache, rechargées à expiration."""
+        pool = self.pool()
+        ttl = load_parametres().ttl_references
+        with self._verrou:
+            if self._references is None or time.monotonic() - self._references_chargees > ttl:
+                # Rafraîchissement incrémental de l'annuaire F0101 déjà en mémoire
+                self._references = charger_references(pool, self._references)
+                self._references_chargees = time.monotonic()
+                logger.info("Données de référence rafraîchies.")
+            return self._references
+
+    def oublier_references(self):
+        """Vide le cache des références : l'annuaire F0101 sera relu en entier."""
+        with self._verrou:
+            if self._references is not None:
+                self._references['annuaire'].vider()
+            self._references = None
+
+    # ----- exécutions -----
+    def demander(self, periodes, classeur="par_periode", incremental=False, origine="commande"):
+        """Place une exécution dans la file."""
+        self._file.put((periodes, classeur, incremental, origine))
+        logger.info(f"Exécution {libelle_periodes(periodes)} en file ({origine}).")
+
+    def _executer_file(self):
+        while not self._arret.is_set():
+            try:
+                periodes, classeur, incremental, origine = self._file.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            libelle = libelle_periodes(periodes)
+            debut = time.perf_counter()
+            self.en_cours = f"{libelle} ({origine})"
+            try:
+                ok = executer_controles(periodes, classeur=classeur, incremental=incremental,
+                                        pool=self.pool(), references=self.references())
+            except Exception as e:
+                logger.error(f"Exécution {libelle} en erreur : {e}")
+                ok = False
+            self.en_cours = None
+            self.derniere = (f"{libelle} ({origine}) {'OK' if ok else 'ERREUR'} en "
+                             f"{time.perf_counter() - debut:.1f}s à {datetime.now():%Y-%m-%d %H:%M:%S}")
+            logger.info(f"Service : exécution {self.derniere}")
+
+    def _planifier(self):
+        derniere_minute = None
+        while not self._arret.is_set():
+            maintenant = datetime.now().replace(second=0, microsecond=0)
+            if maintenant != derniere_minute:
+                derniere_minute = maintenant
+                parametres = load_parametres()
+                for expression in parametres.planifications:
+                    try:
+                        if Planification(expression).correspond(maintenant):
+                            self.demander(periodes_planifiees(parametres.service_am, maintenant),
+                                          origine=f"planification {expression}")
+                    except ValueError as e:
+                        logger.error(f"Planification ignorée : {e}")
+            self._arret.wait(1)
+
+    def statut(self):
+        return (f"en cours: {self.en_cours or '-'} ; en file: {self._file.qsize()} ; "
+                f"dernière: {self.derniere or '-'}")
+
+    def arreter(self):
+        self._arret.set()
+
+    def servir(self, port=None):
+        """Démarre le service et bloque jusqu'à la commande ARRET (ou Ctrl+C)."""
+        self.pool()
+        fils = [threading.Thread(target=self._executer_file, name="service-executions", daemon=True),
+                threading.Thread(target=self._planifier, name="service-planification", daemon=True)]
+        for fil in fils:
+            fil.start()
+
+        port = load_parametres().service_port if port is None else port
+        serveur = None
+        if port:
+            serveur = socketserver.ThreadingTCPServer(("127.0.0.1", port), CommandeHandler)
+            serveur.daemon_threads = True
+            serveur.service = self
+            threading.Thread(target=serveur.serve_forever, name="service-commandes", daemon=True).start()
+            logger.info(f"Service démarré, commandes sur 127.0.0.1:{port}.")
+        else:
+            logger.info("Service démarré, sans socket de commande.")
+
+        try:
+            while not self._arret.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.arreter()
+        if serveur is not None:
+            serveur.shutdown()
+            serveur.server_close()
+        for fil in fils:
+            fil.join()
+        logger.info("Service arrêté.")
+
+
+class CommandeHandler(socketserver.StreamRequestHandler):
+    """
+    Socket de commande du service, une commande texte par ligne :
+
+    - `RUN <am> [consolide] [incremental]` : met une exécution en file (am au format de -am)
+    - `STATUT` : exécution en cours, taille de la file, dernière exécution
+    - `RECHARGER` : vide le cache des données de référence
+    - `ARRET` : arrête le service
+    """
+
+    def handle(self):
+        service = self.server.service
+        for ligne in self.rfile:
+            mots = ligne.decode('utf-8').split()
+            if not mots:
+                continue
+            commande, arguments = mots[0].upper(), mots[1:]
+            try:
+                if commande == 'RUN' and arguments:
+                    periodes = parser_periodes(arguments[0])
+                    service.demander(periodes,
+                                     classeur="consolide" if "consolide" in arguments[1:] else "par_periode",
+                                     incremental="incremental" in arguments[1:])
+                    reponse = f"OK en file : {libelle_periodes(periodes)}"
+                elif commande == 'STATUT':
+                    reponse = f"OK {service.statut()}"
+                elif commande == 'RECHARGER':
+                    service.oublier_references()
+                    reponse = "OK cache des références vidé"
+                elif commande == 'ARRET':
+                    service.arreter()
+                    reponse = "OK arrêt"
+                else:
+                    reponse = "ERREUR commande inconnue (RUN <am>, STATUT, RECHARGER, ARRET)"
+            except ValueError as e:
+                reponse = f"ERREUR {e}"
+            self.wfile.write(f"{reponse}\n".encode('utf-8'))
+
+
+def envoyer_commande(commande, port=None, timeout=10):
+    """
+    Envoie une commande au service en cours d'exécution.
+
+    Returns:
+        str: réponse du service
+    """
+    port = port or load_parametres().service_port
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as connexion:
+        connexion.sendall(f"{commande}\n".encode('utf-8'))
+        connexion.shutdown(socket.SHUT_WR)
+        return connexion.makefile(encoding='utf-8').readline().strip()
+
+
+def _fermer_pool(pool):
+    try:
+        if hasattr(pool, 'fermer'):
+            pool.fermer()
+        else:
+            pool._remove_connections()
+    except Exception as e:
+        logger.warning(f"Fermeture du pool incomplète : {e}")
+
+
+# -----------------------
+# MAIN
+# -----------------------
+def main():
+    parser = argparse.ArgumentParser(description="Mode service des contrôles PGOP → JDE")
+    parser.add_argument("--port", type=int, default=None,
+                        help="Port local du socket de commande (par défaut : [service] port)")
+    parser.add_argument("--commande", type=str, default=None,
+                        help="Envoyer une commande au service lancé, ex: \"RUN 202407\" ou STATUT")
+    args = parser.parse_args()
+
+    if args.commande:
+        print(envoyer_commande(args.commande, port=args.port))
+        return
+    Service().servir(port=args.port)
+
+
+if __name__ == "__main__":
+    configurer_journal()
+    main()
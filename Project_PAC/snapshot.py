@@ -0,0 +1,475 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from annuaire import AnnuaireClients
+from periode import Periode, predicat_periodes
+from catalogue import obtenir_catalogue
+from delais import Delais
+from extraits import TABLES_VERIFIEES
+from mesures import mesurer, taille_dataframe
+from ordonnanceur import Tache, executer_taches
+from schemas import appliquer_schema
+from utils import (load_config, section_database, run_query_pool, anti_jointure, corps_anti_jointure,
+                   STRATEGIES_SERVEUR, TAILLE_LOT_REQUETE)
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# États PGOP pris en compte par les contrôles 1 et 5
+ETATS_FACTURE = ['R', 'A', 'C', 'N', 'F', 'G', 'H', 'K', 'L', 'E', 'J', 'V']
+
+
+# Tables d'un snapshot, dans l'ordre des champs de Snapshot (hors_compta en plus si calculé côté serveur)
+TABLES_SNAPSHOT = ('factures', 'cabfac', 'pgop1', 'f03b11', 'clients_code4')
+
+
+class SourcesIndisponibles(Exception):
+    """Table source d'un contrôle non lue (requête en erreur ou hors délai) : contrôle non exécuté."""
+
+
+# -----------------------
+# SNAPSHOT DE LA PÉRIODE
+# -----------------------
+@dataclass
+class Snapshot:
+    """
+    Photographie en mémoire des tables sources pour une période.
+
+    Chaque table est lue une seule fois par exécution ; les contrôles
+    appliquent ensuite leurs filtres et anti-jointures localement.
+
+    Attributes:
+        periode (Periode): période contrôlée
+        factures (DataFrame): LQ_FACTURA_B du mois (BFUSIC IS NULL)
+        cabfac (DataFrame): FCABFAC des factures du mois
+        pgop1 (DataFrame): F58PGOP1 du mois
+        f03b11 (DataFrame): F03B11 des documents du mois (factures ou lots F58PGOP1)
+        clients_code4 (DataFrame): LQ_FACTURA_B des lignes F58PGOP1 en code 4
+        hors_compta (DataFrame): F58PGOP1 du mois absents de F03B11, si calculé côté serveur
+        annuaire (AnnuaireClients): annuaire F0101 (noms et identifiants fiscaux du contrôle 4)
+        chargees (tuple): tables lues ; les autres, inutiles aux contrôles exécutés, sont vides
+        strategie (str): stratégie des anti-jointures locales ('auto', 'hachage', 'tri')
+    """
+    periode: Periode
+    factures: pd.DataFrame
+    cabfac: pd.DataFrame
+    pgop1: pd.DataFrame
+    f03b11: pd.DataFrame
+    clients_code4: pd.DataFrame
+    hors_compta: pd.DataFrame = None
+    annuaire: AnnuaireClients = None
+    chargees: tuple = TABLES_SNAPSHOT
+    strategie: str = 'auto'
+    _cache: dict = field(default_factory=dict, repr=False)
+    _verrou: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def echecs(self):
+        """Tables dont la requête a échoué (DataFrame sans colonnes, voir utils.run_query_pool), dans l'ordre."""
+        noms = [*self.chargees, *(['hors_compta'] if self.hors_compta is not None else [])]
+        return tuple(nom for nom in noms if getattr(self, nom).columns.empty)
+
+    @property
+    def incomplet(self):
+        """True si une table source n'a pas pu être lue."""
+        return bool(self.echecs)
+
+    def exiger(self, tables):
+        """
+        Vérifie que les tables lues par un contrôle ont été chargées.
+
+        Args:
+            tables (iterable): tables du contrôle (controles.Controle.tables)
+
+        Raises:
+            SourcesIndisponibles: une de ces tables n'a pas pu être lue ; le contrôle ne doit
+                pas s'exécuter (ses anomalies seraient calculées sur une table vide)
+        """
+        manquantes = [nom for nom in self.echecs if nom in tables]
+        if manquantes:
+            raise SourcesIndisponibles(f"table(s) source(s) non lue(s) : {', '.join(manquantes)}")
+
+    def pgop1_hors_compta(self):
+        """
+        Lignes F58PGOP1 du mois absentes de F03B11 (partagé par les contrôles 3 et 4).
+
+        Calculé côté serveur au chargement si une stratégie serveur est configurée,
+        sinon localement par utils.anti_jointure. Sémantique NOT EXISTS : une ligne
+        sans PGCCID n'a pas d'écriture comptable et figure dans le résultat.
+        """
+        with self._verrou:
+            if 'pgop1_hors_compta' not in self._cache:
+                if self.hors_compta is not None:
+                    df = self.hors_compta
+                else:
+                    df = anti_jointure(self.pgop1, 'PGCCID', self.f03b11, 'RPDOC', strategie=self.strategie)
+                if not df.empty:
+                    df = df.sort_values('PGCCID', kind='stable')
+                self._cache['pgop1_hors_compta'] = df
+            return self._cache['pgop1_hors_compta']
+
+
+@dataclass
+class RequeteSource:
+    """
+    Requête de chargement d'une table source.
+
+    Attributes:
+        colonnes (str): liste SELECT, ex: "k.IDFACTURA, k.NUMFACTURA"
+        corps (str): clauses FROM / WHERE (sans ORDER BY)
+        params (list): paramètres des marqueurs %s du corps
+        cle (str): colonne clé (expression SQL) servant au chargement incrémental
+    """
+    colonnes: str
+    corps: str
+    params: list = None
+    cle: str = None
+
+    @property
+    def sql(self):
+        return f"SELECT {self.colonnes}{self.corps}"
+
+
+def charger_references(pool, references=None, entite=None, delais=None):
+    """
+    Charge ou rafraîchit les données de référence, indépendantes de la période :
+    l'annuaire clients F0101 (voir annuaire.py).
+
+    Args:
+        pool: pool de connexions (None : copie locale de l'annuaire seulement, mode hors ligne)
+        references (dict): références déjà chargées, rafraîchies de façon incrémentale
+        entite (str): entité de la base (copie locale de l'annuaire propre à l'entité)
+        delais (Delais): délai des requêtes et nouvelles tentatives (par défaut : [delais] de config.ini)
+
+    Returns:
+        dict: {'annuaire': AnnuaireClients}
+    """
+    annuaire = (references or {}).get('annuaire')
+    if annuaire is None:
+        annuaire = AnnuaireClients.depuis_config(load_config(), entite)
+    if pool is not None:
+        with mesurer('requete', 'annuaire', controle='references') as mesure:
+            annuaire.rafraichir(pool, delais or Delais.depuis_config(load_config(), entite))
+            mesure.lignes = len(annuaire)
+    return {'annuaire': annuaire}
+
+
+def requetes_sources(periodes, indexe=False, strategie='auto', tables=None):
+    """
+    Requêtes de chargement des tables sources d'un ensemble de périodes.
+
+    Args:
+        periodes (list): périodes contrôlées
+        indexe (bool): utiliser les colonnes de période indexées
+        strategie (str): stratégie d'anti-jointure F58PGOP1 / F03B11 ([database] anti_jointure)
+        tables (iterable): tables à charger (par défaut : toutes)
+
+    Returns:
+        dict: {nom: RequeteSource}
+    """
+    serveur = strategie in STRATEGIES_SERVEUR
+    filtre_lq, params_lq = predicat_periodes(periodes, 'LQ_FACTURA_B', indexe=indexe)
+    filtre_lq_l, _ = predicat_periodes(periodes, 'LQ_FACTURA_B', alias='l', indexe=indexe)
+    filtre_pg, params_pg = predicat_periodes(periodes, 'F58PGOP1', indexe=indexe)
+    filtre_pg_g, _ = predicat_periodes(periodes, 'F58PGOP1', alias='g', indexe=indexe)
+    filtre_rp, params_rp = predicat_periodes(periodes, 'F03B11', indexe=indexe)
+
+    requetes = {
+        'factures': RequeteSource(
+            "IDINTERNO, NUMFACTURA, ESTADO, FECFACTURA, IMPNET, IMPIVA, IMPTOT, NOMUSU",
+            f"""
+            FROM LQ_FACTURA_B
+            WHERE {filtre_lq}
+            AND BFUSIC IS NULL
+            """, params_lq, cle="IDINTERNO"),
+
+        'cabfac': RequeteSource(
+            "k.IDFACTURA, k.NUMFACTURA, k.CABDSP, k.FECFACTURA, k.TIPOSERIE, k.IMPNET",
+            f"""
+            FROM FCABFAC k
+            INNER JOIN LQ_FACTURA_B l ON k.IDFACTURA = l.IDINTERNO
+            WHERE {filtre_lq_l}
+            AND l.BFUSIC IS NULL
+            """, params_lq, cle="k.IDFACTURA"),
+
+        'pgop1': RequeteSource(
+            "PGCCID, PGASID, PGLOT, PGBP01, PG74UAMT1, PGEV01",
+            f"""
+            FROM F58PGOP1
+            WHERE {filtre_pg}
+            """, params_pg, cle="PGCCID"),
+
+        # Contrôle 5 : documents PAC de l'année pour les factures du mois.
+        # Contrôles 3/4 (anti-jointure en mémoire) : documents des lots du mois, toutes années confondues.
+        'f03b11': RequeteSource(
+            "RPDOC, RPVR01, RPATXA, RPSTAM, RPAG",
+            f"""
+            FROM F03B11
+            WHERE ({filtre_rp}
+                AND RPDOC IN (SELECT IDINTERNO FROM LQ_FACTURA_B WHERE {filtre_lq} AND BFUSIC IS NULL))
+            """, params_rp + params_lq, cle="RPDOC") if serveur else RequeteSource(
+            "RPDOC, RPVR01, RPATXA, RPSTAM, RPAG",
+            f"""
+            FROM F03B11
+            WHERE (RPDOC IN (SELECT PGCCID FROM F58PGOP1 WHERE {filtre_pg})
+            OR ({filtre_rp}
+                AND RPDOC IN (SELECT IDINTERNO FROM LQ_FACTURA_B WHERE {filtre_lq} AND BFUSIC IS NULL)))
+            """, params_pg + params_rp + params_lq, cle="RPDOC"),
+
+        'clients_code4': RequeteSource(
+            "IDINTERNO, NUMFACTURA, NOMUSU",
+            f"""
+            FROM LQ_FACTURA_B
+            WHERE IDINTERNO IN (SELECT PGCCID FROM F58PGOP1 WHERE {filtre_pg} AND PGEV01 = 4)
+            """, params_pg, cle="IDINTERNO"),
+    }
+    if serveur:
+        requetes['hors_compta'] = RequeteSource(
+            "g.PGCCID, g.PGASID, g.PGLOT, g.PGBP01, g.PG74UAMT1, g.PGEV01",
+            corps_anti_jointure('F58PGOP1', 'PGCCID', 'F03B11', 'RPDOC', filtre=filtre_pg_g, strategie=strategie),
+            params_pg, cle="g.PGCCID")
+    if tables is not None:
+        requetes = {nom: requete for nom, requete in requetes.items() if nom in tables}
+    return requetes
+
+
+def charger_snapshot(pool, periode, indexe=None, max_workers=None, etat=None):
+    """
+    Charge une seule fois les tables sources du mois.
+
+    Args:
+        pool: pool de connexions (utils.get_db_pool)
+        periode (Periode): période contrôlée
+        indexe (bool): utiliser les colonnes de période indexées
+            (par défaut : [database] predicats_indexes de config.ini)
+        max_workers (int): requêtes simultanées (par défaut : taille du pool)
+        etat (EtatIncremental): état local pour un chargement incrémental
+
+    Returns:
+        Snapshot: données de la période
+    """
+    return charger_snapshots(pool, [periode], indexe=indexe, max_workers=max_workers, etat=etat)[periode]
+
+
+def charger_snapshots(pool, periodes, indexe=None, max_workers=None, etat=None, references=None,
+                      extraits=None, tables=None, entite=None, delais=None):
+    """
+    Charge les tables sources d'un ensemble de périodes, une requête par table.
+
+    Les requêtes couvrent toutes les périodes à la fois ; les lignes sont
+    ensuite réparties par période en mémoire. Elles sont indépendantes et
+    s'exécutent en parallèle, chacune sur une connexion du pool : le
+    chargement dure autant que la plus lente.
+
+    Args:
+        pool: pool de connexions (utils.get_db_pool)
+        periodes (list): périodes contrôlées
+        indexe (bool): utiliser les colonnes de période indexées
+            (par défaut : [database] predicats_indexes de config.ini)
+        max_workers (int): requêtes simultanées (par défaut : taille du pool)
+        etat (EtatIncremental): si fourni, seules les lignes nouvelles ou modifiées
+            depuis la dernière exécution sont relues (voir etat.py)
+        references (dict): données de référence déjà chargées (voir charger_references) ;
+            à défaut, elles sont chargées en parallèle des tables sources
+        extraits (CacheExtraits): si fourni, les périodes dont l'extrait Parquet est à
+            jour sont relues depuis l'extrait ; les autres sont chargées puis extraites
+        tables (iterable): tables sources à charger (par défaut : toutes) ; les autres restent
+            vides. Ignoré avec un cache d'extraits, dont chaque extrait contient toutes les tables
+        entite (str): entité de la base ([database.<entité>] de config.ini, par défaut [database])
+        delais (Delais): délai de chaque requête et nouvelles tentatives sur erreur transitoire
+            (par défaut : [delais] de config.ini). Une table non lue (erreur, délai dépassé) reste
+            vide, sans colonnes : elle figure dans Snapshot.echecs
+
+    Returns:
+        dict: {Periode: Snapshot}, dans l'ordre chronologique
+    """
+    periodes = sorted(set(periodes))
+    config = load_config()
+    database = section_database(config, entite)
+    if delais is None:
+        delais = Delais.depuis_config(config, entite)
+    if indexe is None:
+        indexe = database.getboolean('predicats_indexes', fallback=False)
+    # Anti-jointure F58PGOP1 / F03B11 des contrôles 3 et 4 :
+    # 'auto', 'hachage' ou 'tri' -> en mémoire ; 'not_exists' ou 'left_join' -> côté serveur
+    strategie = database.get('anti_jointure', fallback='auto')
+    serveur = strategie in STRATEGIES_SERVEUR
+
+    if extraits is not None:
+        return _charger_avec_extraits(pool, periodes, extraits, indexe, strategie,
+                                      max_workers=max_workers, etat=etat, references=references,
+                                      entite=entite, delais=delais)
+
+    logger.info(f"Chargement des tables sources pour {', '.join(map(str, periodes))}")
+    requetes = requetes_sources(periodes, indexe, strategie, tables)
+
+    if max_workers is None:
+        max_workers = getattr(pool, 'pool_size', len(requetes))
+
+    # Lecture par lots sur curseur non bufferisé (0 : lecture d'un bloc par pd.read_sql)
+    taille_lot = database.getint('taille_lot', fallback=TAILLE_LOT_REQUETE)
+
+    def executer(sql, params=None, schema=None):
+        return run_query_pool(pool, sql, params, taille_lot=taille_lot, schema=schema,
+                              delais=delais, nom=schema)
+
+    # Requêtes complètes : curseurs préparés du catalogue (sauf [database] instructions_preparees = false)
+    catalogue = obtenir_catalogue()
+
+    # Types compacts (schemas.SCHEMAS) appliqués lot par lot, dès la lecture
+    def charger(nom, requete):
+        with mesurer('requete', nom, controle='snapshot') as mesure:
+            if etat is not None and requete.cle is not None:
+                # Lignes mémorisées et relues fusionnées : catégories unifiées après la fusion
+                df = appliquer_schema(etat.charger(nom, requete, lambda sql, params=None:
+                                                   executer(sql, params, schema=nom)), nom)
+            elif catalogue is not None:
+                df = catalogue.executer_pool(pool, nom, requete.sql, requete.params, taille_lot=taille_lot,
+                                             schema=nom, delais=delais)
+            else:
+                df = executer(requete.sql, requete.params, schema=nom)
+            mesure.lignes, mesure.octets = len(df), taille_dataframe(df)
+        return df
+
+    taches = [Tache(nom, lambda nom=nom, requete=requete: charger(nom, requete))
+              for nom, requete in requetes.items()]
+    if references is None:
+        taches.append(Tache('references', lambda: charger_references(pool, entite=entite, delais=delais)))
+    tables = executer_taches(taches, max_workers=max_workers)
+    references = tables.pop('references', references)
+
+    with mesurer('transformation', 'partitionner', controle='snapshot'):
+        return partitionner(tables, periodes, strategie='auto' if serveur else strategie,
+                            annuaire=references.get('annuaire'))
+
+
+def _charger_avec_extraits(pool, periodes, extraits, indexe, strategie, **options):
+    """Relit les périodes dont l'extrait est à jour, charge et extrait les autres (voir extraits.py)."""
+    strategie_snapshots = 'auto' if strategie in STRATEGIES_SERVEUR else strategie
+    if options.get('references') is None:
+        options['references'] = charger_references(pool, entite=options.get('entite'),
+                                                   delais=options.get('delais'))
+    annuaire = options['references'].get('annuaire')
+    snapshots, a_charger = {}, []
+    for periode in periodes:
+        def empreintes(periode=periode):
+            return empreintes_sources(pool, requetes_sources([periode], indexe, strategie),
+                                      options.get('delais'))
+        if extraits.reutilisable(periode, strategie, empreintes):
+            # Tables d'un ancien extrait absentes de Snapshot (ex: ifu) ignorées
+            tables = {nom: df for nom, df in extraits.lire(periode).items()
+                      if nom in TABLES_SNAPSHOT or nom == 'hors_compta'}
+            snapshots[periode] = Snapshot(periode, **tables, annuaire=annuaire, strategie=strategie_snapshots)
+        else:
+            a_charger.append(periode)
+
+    if a_charger:
+        if pool is None:
+            raise RuntimeError(f"Pas d'extrait utilisable pour {', '.join(map(str, a_charger))} : "
+                               f"chargement hors ligne impossible")
+        charges = charger_snapshots(pool, a_charger, indexe=indexe, **options)
+        for periode, snapshot in charges.items():
+            tables = {nom: getattr(snapshot, nom) for nom in TABLES_SNAPSHOT}
+            if snapshot.hors_compta is not None:
+                tables['hors_compta'] = snapshot.hors_compta
+            extraits.ecrire(periode, tables, strategie)
+        snapshots.update(charges)
+    return dict(sorted(snapshots.items()))
+
+
+def empreintes_sources(pool, requetes, delais=None):
+    """
+    Nombre de lignes et clé maximale des tables vérifiées, lus dans la base (COUNT / MAX).
+
+    Args:
+        delais (Delais): délai des requêtes et nouvelles tentatives (voir delais.py)
+
+    Returns:
+        dict: {table: (lignes, clé max en texte ou None)} ; table absente si la requête échoue
+    """
+    def compter(nom, requete):
+        df = run_query_pool(pool, f"SELECT COUNT(*) AS NB, MAX({requete.cle}) AS CLE_MAX{requete.corps}",
+                            requete.params, taille_lot=TAILLE_LOT_REQUETE, delais=delais, nom=f"empreinte/{nom}")
+        return df if not df.empty else None
+
+    taches = [Tache(nom, lambda nom=nom, requete=requetes[nom]: compter(nom, requete)) for nom in TABLES_VERIFIEES]
+    empreintes = {}
+    for nom, df in executer_taches(taches, max_workers=len(taches)).items():
+        if df is not None:
+            nb, maximum = df.iloc[0]['NB'], df.iloc[0]['CLE_MAX']
+            empreintes[nom] = (int(nb), None if pd.isna(maximum) else str(int(maximum)))
+    return empreintes
+
+
+def _cle_periode(dates, format_date):
+    """
+    Code AAAAMM de chaque date texte.
+
+    Args:
+        dates (Series): FECFACTURA (JJ/MM/AAAA ou JJ/MM/AA) ou PGLOT (MM/JJ/AAAA...)
+        format_date (str): 'JJ/MM/AAAA' ou 'MM/JJ/AAAA'
+    """
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        # Dates converties à la lecture (schemas.py)
+        return (dates.dt.year * 100 + dates.dt.month).astype('Int64').astype(str)
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        # Lots PGOP en catégories (schemas.py) : une clé par lot distinct
+        categories = pd.Series(dates.cat.categories)
+        return dates.map(dict(zip(categories, _cle_periode(categories, format_date))))
+    dates = dates.astype(str)
+    if format_date == 'JJ/MM/AAAA':
+        annee = dates.str[6:10]
+        annee = annee.where(annee.str.len() == 4, '20' + annee.str[:2])
+        return annee + dates.str[3:5]
+    return dates.str[6:10] + dates.str[0:2]
+
+
+def partitionner(tables, periodes, strategie='auto', annuaire=None):
+    """
+    Répartit les tables chargées pour plusieurs périodes en un Snapshot par période.
+
+    Args:
+        tables (dict): DataFrames chargés (factures, cabfac, pgop1, f03b11, clients_code4
+            et, si l'anti-jointure est faite côté serveur, hors_compta) ; une table absente
+            (non chargée) est vide dans les snapshots
+        periodes (list): périodes chargées
+        strategie (str): stratégie d'anti-jointure transmise aux snapshots
+        annuaire (AnnuaireClients): annuaire F0101 partagé par les snapshots
+
+    Returns:
+        dict: {Periode: Snapshot}
+    """
+    chargees = tuple(nom for nom in TABLES_SNAPSHOT if nom in tables)
+    tables = {**{nom: pd.DataFrame() for nom in TABLES_SNAPSHOT}, **tables}
+    if len(periodes) == 1:
+        return {periodes[0]: Snapshot(periodes[0], **tables, annuaire=annuaire, chargees=chargees,
+                                      strategie=strategie)}
+
+    factures, pgop1 = tables['factures'], tables['pgop1']
+    cle_factures = _cle_periode(factures['FECFACTURA'], 'JJ/MM/AAAA') if not factures.empty else None
+    cle_pgop1 = _cle_periode(pgop1['PGLOT'], 'MM/JJ/AAAA') if not pgop1.empty else None
+    hors_compta = tables.get('hors_compta')
+
+    snapshots = {}
+    for periode in periodes:
+        f = factures[cle_factures == periode.code] if cle_factures is not None else factures
+        g = pgop1[cle_pgop1 == periode.code] if cle_pgop1 is not None else pgop1
+        ids_factures, ids_pgop1 = f['IDINTERNO'] if not f.empty else [], g['PGCCID'] if not g.empty else []
+
+        cabfac, f03b11, clients = tables['cabfac'], tables['f03b11'], tables['clients_code4']
+        if not cabfac.empty:
+            cabfac = cabfac[cabfac['IDFACTURA'].isin(ids_factures)]
+        if not f03b11.empty:
+            f03b11 = f03b11[f03b11['RPDOC'].isin(ids_factures) | f03b11['RPDOC'].isin(ids_pgop1)]
+        if not clients.empty:
+            clients = clients[clients['IDINTERNO'].isin(ids_pgop1)]
+
+        h = hors_compta
+        if h is not None and not h.empty:
+            h = h[_cle_periode(h['PGLOT'], 'MM/JJ/AAAA') == periode.code]
+
+        snapshots[periode] = Snapshot(periode, f, cabfac, g, f03b11, clients,
+                                      hors_compta=h, annuaire=annuaire, chargees=chargees, strategie=strategie)
+    return snapshots
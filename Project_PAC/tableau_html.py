@@ -0,0 +1,151 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from schemas import textes_dates, COLONNES_MONTANTS
+
+logger = logging.getLogger("PGOP_JDE_Control")
+
+# Budget par défaut d'un email (surchargé par [email] max_lignes_email / max_octets_email)
+MAX_LIGNES_EMAIL = 500
+MAX_OCTETS_EMAIL = 1_000_000
+
+STYLE_TABLE = ("border-collapse: collapse; font-family: Arial, sans-serif; font-size: 14px; "
+               "background-color: white;")
+STYLE_TH = "border: 1px solid #ddd; padding: 8px; background-color: #95a5a6; color: white;"
+STYLE_TD = "border: 1px solid #ddd; padding: 6px;"
+STYLE_TOTAL = "border: 1px solid #ddd; padding: 6px; background-color: #ecf0f1; font-weight: bold;"
+FONDS_LIGNES = ("#f2f2f2", "#ffffff")
+
+NOTE_TRONQUE = ("{affichees} ligne(s) affichée(s) sur {total} : "
+                "liste complète dans le rapport Excel joint au bilan complet.")
+
+
+# -----------------------
+# BUDGET D'UN EMAIL
+# -----------------------
+class BudgetEmail:
+    """
+    Lignes de tableau et octets HTML encore disponibles dans un email.
+
+    Partagé par les tableaux d'un même email : chacun consomme sa part et
+    le suivant est tronqué d'autant.
+    """
+
+    def __init__(self, max_lignes=MAX_LIGNES_EMAIL, max_octets=MAX_OCTETS_EMAIL):
+        self.lignes = max_lignes
+        self.octets = max_octets
+
+    @classmethod
+    def depuis_config(cls, config):
+        """Budget lu dans la section [email] de config.ini."""
+        email = config['email']
+        return cls(email.getint('max_lignes_email', fallback=MAX_LIGNES_EMAIL),
+                   email.getint('max_octets_email', fallback=MAX_OCTETS_EMAIL))
+
+    def consommer(self, lignes, octets):
+        self.lignes = max(self.lignes - lignes, 0)
+        self.octets = max(self.octets - octets, 0)
+
+
+# -----------------------
+# RENDU DES TABLEAUX
+# -----------------------
+def echapper(valeurs):
+    """Échappement HTML d'une Series de textes (vectorisé)."""
+    return (valeurs.str.replace('&', '&amp;', regex=False)
+            .str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False)
+            .str.replace('"', '&quot;', regex=False))
+
+
+def lignes_html(df):
+    """
+    Lignes <tr> d'un DataFrame, construites colonne par colonne (sans boucle sur les lignes).
+
+    Returns:
+        Series: une chaîne HTML par ligne, fonds alternés
+    """
+    lignes = pd.Series(
+        np.where(np.arange(len(df)) % 2 == 0,
+                 f'<tr style="background-color: {FONDS_LIGNES[0]};">',
+                 f'<tr style="background-color: {FONDS_LIGNES[1]};">'),
+        index=df.index, dtype=object)
+    if df.empty:
+        # Budget épuisé : pas de ligne (object + str vides n'est pas pris en charge par pandas)
+        return lignes
+    df = textes_dates(df)
+    for colonne in df.columns:
+        valeurs = df[colonne]
+        textes = echapper(valeurs.astype(object).where(valeurs.notna(), '').astype(str))
+        lignes = lignes + f'<td style="{STYLE_TD}">' + textes + '</td>'
+    return lignes + '</tr>'
+
+
+def tableau_html(df, budget=None, titre=None, colonnes_sommes=None):
+    """
+    Tableau HTML stylé pour email, limité au budget restant.
+
+    Au-delà du budget (lignes ou octets), seules les premières lignes sont
+    affichées, suivies d'une ligne de totaux (nombre de lignes, somme des
+    colonnes de montants sur l'ensemble) et d'un renvoi vers le rapport Excel.
+
+    Args:
+        df (DataFrame): données
+        budget (BudgetEmail): budget de l'email, décrémenté (par défaut : illimité)
+        titre (str): titre affiché au-dessus du tableau
+        colonnes_sommes (list): colonnes totalisées si le tableau est tronqué
+            (par défaut : montants des schémas sources et leurs écarts ECART_<montant>)
+
+    Returns:
+        str: fragment HTML
+    """
+    entete = (f'<h3 style="color: #2c3e50; font-family: Arial, sans-serif;">{titre}</h3>' if titre else '')
+    entete += (f'<table border="0" cellpadding="6" cellspacing="0" style="{STYLE_TABLE}"><tr>'
+               + ''.join(f'<th align="left" style="{STYLE_TH}">{c}</th>' for c in echapper(
+                   pd.Series(df.columns, dtype=object).astype(str)))
+               + '</tr>')
+    fin = '</table>'
+
+    affichees = len(df) if budget is None else min(len(df), budget.lignes)
+    lignes = lignes_html(df.iloc[:affichees])
+    if budget is not None:
+        # Réserve pour l'en-tête, la ligne de totaux et la note de renvoi
+        reserve = len(entete.encode('utf-8')) + 200 * (len(df.columns) + 2)
+        octets = np.cumsum(lignes.str.encode('utf-8').str.len().to_numpy())
+        affichees = int(np.searchsorted(octets, budget.octets - reserve, side='right'))
+
+    html = entete + ''.join(lignes.iloc[:affichees])
+    if affichees < len(df):
+        html += ligne_totaux(df, colonnes_sommes) + fin
+        html += (f'<p style="color: #666; font-style: italic; font-family: Arial, sans-serif;">'
+                 f'{NOTE_TRONQUE.format(affichees=affichees, total=len(df))}</p>')
+        logger.info(f"Tableau email {titre or ''} tronqué : {affichees}/{len(df)} lignes.")
+    else:
+        html += fin
+
+    if budget is not None:
+        budget.consommer(affichees, len(html.encode('utf-8')))
+    return html
+
+
+def ligne_totaux(df, colonnes_sommes=None):
+    """Ligne <tr> de totaux : nombre de lignes, puis somme des colonnes à totaliser."""
+    if colonnes_sommes is None:
+        colonnes_sommes = [c for c in df.columns if _est_montant(c)]
+    cellules = []
+    for i, colonne in enumerate(df.columns):
+        if i == 0:
+            valeur = f"TOTAL ({len(df)} lignes)"
+        elif colonne in colonnes_sommes:
+            valeur = f"{df[colonne].sum():,.2f}".replace(',', ' ')
+        else:
+            valeur = ''
+        cellules.append(f'<td style="{STYLE_TOTAL}">{valeur}</td>')
+    return '<tr>' + ''.join(cellules) + '</tr>'
+
+
+def _est_montant(colonne):
+    # Par le nom, pas par le type : un identifiant avec des NULL est en float64 sans être un montant
+    nom = str(colonne)
+    return nom.removeprefix('ECART_') in COLONNES_MONTANTS
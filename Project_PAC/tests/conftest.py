@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules du projet importés comme depuis Project_PAC (python main.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
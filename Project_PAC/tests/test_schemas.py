@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from moteurs import ouvrir_connexion
+from schemas import concat_lots
+from utils import lire_assemblee
+
+
+@pytest.fixture
+def connexion(tmp_path):
+    connection = ouvrir_connexion('sqlite', str(tmp_path / "pgop1.sqlite"))
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE F58PGOP1 (PGCCID INT, PGEV01 INT)")
+    cursor.close()
+    yield connection
+    connection.close()
+
+
+def _lire(connection, valeurs, taille_lot):
+    # Lecture par lots, schéma de pgop1 appliqué à chaque lot puis assemblage (comme snapshot.py)
+    connection.charger_dataframe('F58PGOP1', pd.DataFrame({'PGCCID': range(len(valeurs)), 'PGEV01': valeurs},
+                                                          dtype=object))
+    connection.commit()
+    return lire_assemblee(connection, "SELECT PGCCID, PGEV01 FROM F58PGOP1 ORDER BY PGCCID", [],
+                          taille_lot=taille_lot, schema='pgop1')
+
+
+def test_lot_entierement_null_apres_lot_entier(connexion):
+    # PGEV01 : un lot d'entiers, puis un lot entièrement NULL (catégories vides de type objet)
+    df = _lire(connexion, [4, 1, 4, None, None, None], taille_lot=3)
+
+    assert isinstance(df['PGEV01'].dtype, pd.CategoricalDtype)
+    assert list(df['PGEV01'].cat.categories) == [1, 4]
+    assert df['PGEV01'].isna().tolist() == [False, False, False, True, True, True]
+    assert (df['PGEV01'] == 4).sum() == 2
+
+
+def test_lot_entierement_null_avant_lot_entier(connexion):
+    df = _lire(connexion, [None, None, 4, 1], taille_lot=2)
+
+    assert df['PGEV01'].isna().tolist() == [True, True, False, False]
+    assert (df['PGEV01'] == 4).sum() == 1
+
+
+def test_lots_entiers_et_decimaux():
+    # Catégories int64 d'un lot, float64 d'un lot avec NULL
+    lots = [pd.DataFrame({'PGEV01': pd.Series([4, 1]).astype('category')}),
+            pd.DataFrame({'PGEV01': pd.Series([2.0, None]).astype('category')})]
+
+    df = concat_lots(lots, 'pgop1')
+
+    assert list(df['PGEV01'].cat.categories) == [1.0, 2.0, 4.0]
+    assert (df['PGEV01'] == 4).sum() == 1
@@ -1,34 +1,174 @@
 import os
+import re
 import logging
+import threading
+from contextlib import closing
+from dataclasses import dataclass
+import numpy as np
 import pandas as pd
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
 from configparser import ConfigParser
 from datetime import datetime
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+from delais import Delais
+from mesures import mesurer
+from moteurs import MOTEURS, PoolEmbarque
+from ordonnanceur import anticiper
+from schemas import appliquer_schema, concat_lots
 
 # -----------------------
 # CONFIGURATION
 # -----------------------
+# Configurations lues, par fichier : (date de modification, ConfigParser, Parametres)
+_configs = {}
+_verrou_config = threading.Lock()
+
+# Sections [database.<entité>] : une base ERP par entité (exécution groupée, main.py --entites)
+PREFIXE_ENTITE = "database."
+NOM_ENTITE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+@dataclass(frozen=True)
+class Parametres:
+    """
+    Paramètres typés de config.ini.
+
+    Attributes:
+        moteur (str): moteur SQL (mysql, sqlite, duckdb)
+        chemin_base (str): fichier de la base locale (moteurs sqlite et duckdb)
+        db (dict): paramètres de connexion MySQL (host, database, user, password)
+        pool_size (int): connexions du pool
+        instructions_preparees (bool): requêtes du catalogue sur curseurs préparés
+        smtp_server (str), smtp_port (int), sender_email (str): serveur et expéditeur des emails
+        planifications (tuple): expressions cron du mode service
+        service_am (str): période des exécutions planifiées (courante, precedente ou AAAAMM)
+        service_port (int): port local du socket de commande du mode service (0 : désactivé)
+        ttl_references (int): durée de validité en secondes des données de référence en cache
+    """
+    moteur: str
+    chemin_base: str
+    db: dict
+    pool_size: int
+    instructions_preparees: bool
+    smtp_server: str
+    smtp_port: int
+    sender_email: str
+    planifications: tuple
+    service_am: str
+    service_port: int
+    ttl_references: int
+
+    @classmethod
+    def depuis_config(cls, config, entite=None):
+        database = section_database(config, entite)
+        email = config['email'] if config.has_section('email') else {}
+        service = config['service'] if config.has_section('service') else {}
+        moteur = database.get('moteur', fallback='mysql')
+        if moteur not in MOTEURS:
+            raise ValueError(f"[database] moteur inconnu '{moteur}' ({', '.join(MOTEURS)})")
+        return cls(
+            moteur=moteur,
+            chemin_base=database.get('chemin', fallback=''),
+            db={cle: database[cle] for cle in ('host', 'database', 'user', 'password') if cle in database},
+            pool_size=database.getint('pool_size', fallback=5),
+            instructions_preparees=database.getboolean('instructions_preparees', fallback=True),
+            smtp_server=email.get('smtp_server', ''),
+            smtp_port=int(email.get('smtp_port', 587)),
+            sender_email=email.get('sender_email', ''),
+            planifications=tuple(p.strip() for p in service.get('planification', '').split(';') if p.strip()),
+            service_am=service.get('am', 'courante'),
+            service_port=int(service.get('port', 0)),
+            ttl_references=int(service.get('ttl_references', 3600)),
+        )
+
+
 def load_config(config_file='config.ini'):
-    config = ConfigParser()
-    config.read(config_file)
-    return config
+    """
+    Lit config.ini, une seule fois tant que le fichier n'est pas modifié.
+
+    Le ConfigParser retourné est partagé : il ne doit pas être modifié.
+    """
+    return _lire_config(config_file)[1]
+
+
+def load_parametres(config_file='config.ini', entite=None):
+    """
+    Paramètres typés de config.ini (voir Parametres), relus seulement si le fichier change.
+
+    Args:
+        entite (str): entité dont la base est décrite par [database.<entité>] (par défaut : [database])
+    """
+    _, config, parametres = _lire_config(config_file)
+    return parametres if entite is None else Parametres.depuis_config(config, entite)
+
+
+def entites_configurees(config):
+    """Entités des sections [database.<entité>] de config.ini, dans l'ordre du fichier."""
+    entites = [s[len(PREFIXE_ENTITE):] for s in config.sections() if s.startswith(PREFIXE_ENTITE)]
+    for entite in entites:
+        if not NOM_ENTITE.match(entite):
+            raise ValueError(f"[{PREFIXE_ENTITE}{entite}] : nom d'entité invalide (lettres, chiffres, _ et -)")
+    return entites
+
 
+def section_database(config, entite=None):
+    """
+    Section de base de données d'une entité : [database.<entité>], complétée par [database].
 
-def get_db_connection():
+    Args:
+        config (ConfigParser): configuration (load_config)
+        entite (str): entité (None : [database] seule)
+
+    Returns:
+        SectionProxy: clés de [database.<entité>], à défaut celles de [database]
+
+    Raises:
+        ValueError: entité sans section [database.<entité>]
+    """
+    if entite is None:
+        return config['database']
+    nom = PREFIXE_ENTITE + entite
+    if not config.has_section(nom):
+        raise ValueError(f"Entité inconnue '{entite}' : pas de section [{nom}] dans config.ini")
+    fusion = ConfigParser()
+    commune = dict(config.items('database', raw=True)) if config.has_section('database') else {}
+    fusion.read_dict({'database': {**commune, **dict(config.items(nom, raw=True))}})
+    return fusion['database']
+
+
+def chemin_entite(chemin, entite=None):
+    """
+    Fichier ou répertoire local propre à une entité, dans un sous-répertoire à son nom :
+    output/registre_anomalies.sqlite -> output/<entité>/registre_anomalies.sqlite.
+    """
+    if not entite or not chemin:
+        return chemin
+    chemin = os.path.normpath(chemin)
+    return os.path.join(os.path.dirname(chemin), entite, os.path.basename(chemin))
+
+
+def _lire_config(config_file):
+    chemin = os.path.abspath(config_file)
     try:
-        config = load_config()
-        DB_CONFIG = {
-            'host': config['database']['host'],
-            'database': config['database']['database'],
-            'user': config['database']['user'],
-            'password': config['database']['password']
-        }
-        connection = mysql.connector.connect(**DB_CONFIG)
+        modification = os.stat(chemin).st_mtime_ns
+    except OSError:
+        modification = None
+    with _verrou_config:
+        lu = _configs.get(chemin)
+        if lu is None or lu[0] != modification:
+            config = ConfigParser()
+            config.read(chemin)
+            parametres = Parametres.depuis_config(config) if config.has_section('database') else None
+            lu = _configs[chemin] = (modification, config, parametres)
+        return lu
+
+
+def get_db_connection(entite=None):
+    parametres = load_parametres(entite=entite)
+    if parametres.moteur != 'mysql':
+        return PoolEmbarque(parametres.moteur, parametres.chemin_base).get_connection()
+    try:
+        connection = mysql.connector.connect(**parametres.db)
         logging.info("Connexion à MySQL réussie.")
         return connection
     except Error as e:
@@ -36,9 +176,83 @@ def get_db_connection():
         raise
 
 
-def run_query(connection, query, params=None):
+def get_db_pool(pool_size=None, entite=None):
+    """
+    Crée un pool de connexions partagé par les tâches parallèles, sur le moteur de [database] moteur.
+
+    Args:
+        pool_size (int): taille du pool (par défaut : [database] pool_size, sinon 5)
+        entite (str): entité dont la base est décrite par [database.<entité>] (par défaut : [database])
+
+    Returns:
+        MySQLConnectionPool (ou moteurs.PoolEmbarque pour sqlite / duckdb) : pool dont
+        `get_connection()` prête une connexion, rendue au pool par `close()`
+    """
+    parametres = load_parametres(entite=entite)
+    if pool_size is None:
+        pool_size = parametres.pool_size
+    if parametres.moteur != 'mysql':
+        pool = PoolEmbarque(parametres.moteur, parametres.chemin_base, pool_size)
+        logging.info(f"Base {parametres.moteur} locale ouverte : {parametres.chemin_base}.")
+        return pool
+    try:
+        # Les instructions préparées (catalogue.py) vivent dans la session : on ne la
+        # réinitialise pas au retour d'une connexion dans le pool pour les conserver
+        pool = pooling.MySQLConnectionPool(pool_name=f"pgop_jde_{entite}" if entite else "pgop_jde",
+                                           pool_size=pool_size,
+                                           pool_reset_session=not parametres.instructions_preparees,
+                                           **parametres.db)
+        logging.info(f"Pool de {pool_size} connexions MySQL créé.")
+        return pool
+    except Error as e:
+        logging.error(f"Erreur de création du pool MySQL: {e}")
+        raise
+
+
+# Lignes lues à la fois sur un curseur non bufferisé (mode par lots)
+TAILLE_LOT_REQUETE = 50000
+# Lots bruts lus d'avance pendant la conversion du lot courant en DataFrame
+LOTS_ANTICIPES = 2
+
+
+def run_query_pool(pool, query, params=None, taille_lot=None, schema=None, delais=None, nom="requête"):
+    """
+    Exécute une requête sur une connexion empruntée au pool.
+
+    Args:
+        pool: pool de connexions (get_db_pool)
+        query (str): requête SQL avec marqueurs %s
+        params (list): paramètres de la requête
+        taille_lot (int): si fourni, le résultat est lu par lots sur un curseur
+            non bufferisé (voir run_query_par_lots) puis assemblé
+        schema (str): table de schemas.SCHEMAS dont les types compacts sont appliqués à la lecture
+        delais (Delais): délai de la requête et nouvelles tentatives sur erreur transitoire
+            (voir delais.py ; par défaut : sans délai, une seule tentative)
+        nom (str): requête, pour le journal des délais et tentatives
+
+    Returns:
+        DataFrame: résultat, vide (sans colonnes) en cas d'erreur ou de délai dépassé
+    """
+    delais = delais or Delais()
+    query = delais.borner(query)
+
+    def lire(connection):
+        if taille_lot:
+            return lire_assemblee(connection, query, params, taille_lot, schema)
+        df = appliquer_schema(pd.read_sql(query, con=connection, params=params), schema)
+        logging.info(f"Requête exécutée. {len(df)} lignes récupérées.")
+        return df
+
     try:
-        df = pd.read_sql(query, con=connection, params=params)
+        return delais.executer(pool, lire, nom)
+    except Exception as e:
+        logging.error(f"Requête '{nom}' abandonnée : {e}")
+        return pd.DataFrame()
+
+
+def run_query(connection, query, params=None, schema=None):
+    try:
+        df = appliquer_schema(pd.read_sql(query, con=connection, params=params), schema)
         logging.info(f"Requête exécutée. {len(df)} lignes récupérées.")
         return df
     except Exception as e:
@@ -46,19 +260,299 @@ def run_query(connection, query, params=None):
         return pd.DataFrame()
 
 
-def save_to_excel(df, sheet_name, file_path):
+def run_query_par_lots(connection, query, params=None, taille_lot=TAILLE_LOT_REQUETE, schema=None):
+    """
+    Exécute une requête et restitue son résultat par lots, sans le mettre en mémoire d'un bloc.
+
+    Le curseur n'est pas bufferisé : le serveur envoie les lignes au fil de
+    la lecture. Un fil lit les lots suivants (au plus LOTS_ANTICIPES d'avance,
+    voir ordonnanceur.anticiper) pendant la conversion du lot courant : l'attente
+    du serveur recouvre le travail pandas. La connexion reste occupée tant que
+    le générateur n'est pas épuisé ou fermé.
+
+    Args:
+        connection: connexion MySQL
+        query (str): requête SQL avec marqueurs %s
+        params (list): paramètres de la requête
+        taille_lot (int): nombre maximal de lignes par lot
+        schema (str): table de schemas.SCHEMAS ; chaque lot est converti aux types compacts dès sa lecture
+
+    Yields:
+        DataFrame: lots successifs ; un seul lot vide (avec colonnes) si aucune ligne
+
+    Raises:
+        Exception: erreur d'exécution ou de lecture (journalisée)
+    """
+    cursor = connection.cursor(buffered=False)
+    epuise = False
     try:
-        mode = 'a' if os.path.exists(file_path) else 'w'
-        with pd.ExcelWriter(file_path, engine='openpyxl', mode=mode) as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-        logging.info(f"Feuille '{sheet_name}' sauvegardée dans {file_path}")
+        cursor.execute(query, tuple(params or ()))
+        colonnes = [d[0] for d in cursor.description]
+        total, lots = 0, 0
+        # closing : le fil de lecture est arrêté avant de vider ou fermer le curseur ci-dessous
+        with closing(anticiper(lots_bruts(cursor, taille_lot), LOTS_ANTICIPES, nom="lecture-lots")) as lectures:
+            for lignes in lectures:
+                total += len(lignes)
+                lots += 1
+                yield appliquer_schema(pd.DataFrame.from_records(lignes, columns=colonnes), schema)
+        epuise = True
+        logging.info(f"Requête exécutée. {total} lignes récupérées en {lots} lot(s).")
     except Exception as e:
-        logging.error(f"Erreur lors de la sauvegarde Excel ({sheet_name}): {e}")
+        logging.error(f"Erreur lors de l'exécution de la requête: {e}")
+        raise
+    finally:
+        if not epuise and hasattr(connection, 'consume_results'):
+            # Lecture abandonnée : le reste du résultat doit être vidé avant de réutiliser la connexion
+            connection.consume_results()
+        cursor.close()
+
+
+def lots_bruts(cursor, taille_lot):
+    """Lots de lignes d'un curseur exécuté (fetchmany) ; un seul lot vide s'il n'y a aucune ligne."""
+    lignes = cursor.fetchmany(taille_lot)
+    yield lignes
+    while lignes:
+        lignes = cursor.fetchmany(taille_lot)
+        if lignes:
+            yield lignes
+
+
+def lire_assemblee(connection, query, params=None, taille_lot=TAILLE_LOT_REQUETE, schema=None):
+    """
+    Lit une requête par lots (run_query_par_lots) et assemble un DataFrame unique.
+
+    Contrairement à pd.read_sql, les lignes brutes (tuples Python, bien plus
+    coûteux qu'un DataFrame) ne sont jamais toutes présentes côté client :
+    seul le lot en cours de lecture l'est. Avec un schéma, les lots déjà lus
+    sont conservés aux types compacts (voir schemas.py).
+
+    Returns:
+        DataFrame: résultat
+
+    Raises:
+        Exception: erreur d'exécution ou de lecture (journalisée, voir run_query_pool)
+    """
+    return concat_lots(list(run_query_par_lots(connection, query, params, taille_lot, schema)), schema)
+
+
+def concat_periodes(frames, toujours=False, colonne='PERIODE'):
+    """
+    Regroupe les résultats de plusieurs périodes en un seul DataFrame.
+
+    Args:
+        frames (dict): {code période AAAAMM: DataFrame}
+        toujours (bool): ajouter la colonne PERIODE même pour une seule période
+        colonne (str): colonne portant la clé de `frames` (ENTITE pour les entités d'un groupe)
+
+    Returns:
+        DataFrame: lignes de toutes les périodes, précédées d'une colonne PERIODE
+        (inchangé s'il n'y a qu'une période et que `toujours` est faux)
+    """
+    if len(frames) == 1 and not toujours:
+        return next(iter(frames.values()))
+    morceaux = [df.assign(**{colonne: code})[[colonne, *df.columns]]
+                for code, df in frames.items() if df is not None and not df.empty]
+    if not morceaux:
+        return pd.DataFrame()
+    return pd.concat(morceaux, ignore_index=True)
+
+
+# -----------------------
+# ANTI-JOINTURES / SEMI-JOINTURES
+# -----------------------
+# Stratégies disponibles :
+# - côté serveur : 'not_exists' (sonde indexée par ligne de gauche), 'left_join' (jointure puis IS NULL)
+# - côté client  : 'hachage' (table de hachage des clés de droite), 'tri' (recherche dichotomique
+#                  dans les clés de droite triées, sans table de hachage)
+# Toutes appliquent la sémantique NOT EXISTS : une clé de gauche NULL n'a jamais de correspondance.
+STRATEGIES_SERVEUR = ('not_exists', 'left_join')
+STRATEGIES_CLIENT = ('hachage', 'tri')
+# Au-delà de ce nombre de clés de droite, la recherche dichotomique évite une table de hachage géante
+SEUIL_TRI = 1_000_000
+
+
+def choisir_strategie(n_gauche, n_droite, droite_locale=True):
+    """
+    Choisit la stratégie d'anti-jointure la moins coûteuse à partir des volumes estimés.
+
+    Args:
+        n_gauche (int): nombre (estimé) de lignes à tester
+        n_droite (int): nombre (estimé) de clés de référence
+        droite_locale (bool): les clés de référence sont déjà en mémoire
+
+    Returns:
+        str: une stratégie de STRATEGIES_CLIENT ou STRATEGIES_SERVEUR
+    """
+    if droite_locale:
+        return 'tri' if n_droite >= SEUIL_TRI else 'hachage'
+    # Peu de lignes à tester : une sonde d'index par ligne ; sinon une jointure globale
+    return 'not_exists' if n_gauche <= n_droite else 'left_join'
+
+
+def estimer_lignes(connection, table):
+    """
+    Nombre de lignes estimé d'une table (statistiques MySQL, sans parcours).
+
+    Returns:
+        int: estimation, ou None si indisponible
+    """
+    df = run_query(connection, """
+    SELECT TABLE_ROWS FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, params=[table])
+    if df.empty or pd.isna(df.iloc[0, 0]):
+        return None
+    return int(df.iloc[0, 0])
+
+
+def _cles_comparables(gauche, droite):
+    """Aligne les types des clés (ex: PGASID texte contre IDFACTURA entier)."""
+    numerique_g = pd.api.types.is_numeric_dtype(gauche)
+    numerique_d = pd.api.types.is_numeric_dtype(droite)
+    if numerique_g and not numerique_d:
+        droite = pd.to_numeric(droite, errors='coerce')
+    elif numerique_d and not numerique_g:
+        gauche = pd.to_numeric(gauche, errors='coerce')
+    return gauche, droite
+
+
+def _masque_correspondance(gauche, droite, strategie):
+    """Masque booléen : la clé de gauche existe dans les clés de droite (jamais pour NULL)."""
+    gauche, droite = _cles_comparables(gauche, droite)
+    droite = droite.dropna()
+    if strategie == 'tri' and pd.api.types.is_numeric_dtype(gauche) and pd.api.types.is_numeric_dtype(droite):
+        cles = np.unique(droite.to_numpy(dtype='float64'))
+        valeurs = gauche.to_numpy(dtype='float64', na_value=np.nan)
+        positions = np.searchsorted(cles, valeurs).clip(max=max(len(cles) - 1, 0))
+        trouve = (cles[positions] == valeurs) if len(cles) else np.zeros(len(valeurs), dtype=bool)
+        return pd.Series(trouve, index=gauche.index)
+    return gauche.isin(droite) & gauche.notna()
+
+
+def anti_jointure(gauche, cle_gauche, droite, cle_droite, strategie='auto'):
+    """
+    Lignes de `gauche` dont la clé est absente de `droite` (côté client).
+
+    Args:
+        gauche (DataFrame): lignes à tester
+        cle_gauche (str): colonne clé de gauche
+        droite (DataFrame ou Series): référence (DataFrame avec `cle_droite`, ou série de clés)
+        cle_droite (str): colonne clé de droite (ignorée si `droite` est une série)
+        strategie (str): 'hachage', 'tri' ou 'auto' (choix selon les volumes)
+
+    Returns:
+        DataFrame: lignes de gauche sans correspondance (clés NULL incluses)
+    """
+    if gauche.empty:
+        return gauche
+    cles_droite = _cles_de(droite, cle_droite)
+    if strategie == 'auto':
+        strategie = choisir_strategie(len(gauche), len(cles_droite))
+    if strategie not in STRATEGIES_CLIENT:
+        raise ValueError(f"Stratégie client inconnue : {strategie}")
+    with mesurer('transformation', f"anti_jointure {cle_gauche}/{cle_droite}") as mesure:
+        resultat = gauche[~_masque_correspondance(gauche[cle_gauche], cles_droite, strategie)]
+        mesure.lignes = len(resultat)
+    return resultat
+
+
+def semi_jointure(gauche, cle_gauche, droite, cle_droite, strategie='auto'):
+    """Lignes de `gauche` dont la clé existe dans `droite` (côté client, voir anti_jointure)."""
+    if gauche.empty:
+        return gauche
+    cles_droite = _cles_de(droite, cle_droite)
+    if strategie == 'auto':
+        strategie = choisir_strategie(len(gauche), len(cles_droite))
+    if strategie not in STRATEGIES_CLIENT:
+        raise ValueError(f"Stratégie client inconnue : {strategie}")
+    return gauche[_masque_correspondance(gauche[cle_gauche], cles_droite, strategie)]
+
+
+def _cles_de(droite, cle_droite):
+    if isinstance(droite, pd.Series):
+        return droite
+    if droite is None or droite.empty:
+        return pd.Series([], dtype='float64')
+    return droite[cle_droite]
+
+
+def corps_anti_jointure(table_gauche, cle_gauche, table_droite, cle_droite,
+                        filtre=None, strategie='not_exists'):
+    """
+    Clauses FROM / WHERE d'une anti-jointure exécutée côté serveur (sans NOT IN).
+
+    La table de gauche porte l'alias `g`, celle de droite l'alias `d`.
+
+    Args:
+        table_gauche (str): table des lignes à tester
+        cle_gauche (str): clé de gauche
+        table_droite (str): table de référence
+        cle_droite (str): clé de droite
+        filtre (str): prédicat supplémentaire sur `g` (peut contenir des marqueurs %s)
+        strategie (str): 'not_exists' ou 'left_join'
+
+    Returns:
+        str: corps de requête, à préfixer par `SELECT <colonnes de g>`
+    """
+    condition = f"AND {filtre}" if filtre else ""
+    if strategie == 'not_exists':
+        return f"""
+        FROM {table_gauche} g
+        WHERE NOT EXISTS (SELECT 1 FROM {table_droite} d WHERE d.{cle_droite} = g.{cle_gauche})
+        {condition}
+        """
+    if strategie == 'left_join':
+        return f"""
+        FROM {table_gauche} g
+        LEFT JOIN {table_droite} d ON d.{cle_droite} = g.{cle_gauche}
+        WHERE d.{cle_droite} IS NULL
+        {condition}
+        """
+    raise ValueError(f"Stratégie serveur inconnue : {strategie}")
 
 
 # -----------------------
 # ENVOI EMAIL
 # -----------------------
+def construire_message(sender_email, subject, body_html, attachment_path=None, recipients=None):
+    """
+    Construit un email HTML avec ses pièces jointes.
+
+    Args:
+        sender_email (str): expéditeur
+        subject (str): objet
+        body_html (str): corps HTML
+        attachment_path (str | list): fichier(s) à joindre (ignorés s'ils n'existent pas)
+        recipients (list): destinataires
+
+    Returns:
+        MIMEMultipart: message prêt à l'envoi
+    """
+    # Pile email importée au premier message seulement
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.application import MIMEApplication
+
+    msg = MIMEMultipart('alternative')
+    msg['From'] = sender_email
+    msg['To'] = ", ".join(recipients)
+    msg['Subject'] = subject
+
+    # Corps du message HTML
+    msg.attach(MIMEText(body_html, 'html'))
+
+    # Pièce(s) jointe(s)
+    attachment_paths = attachment_path if isinstance(attachment_path, (list, tuple)) else [attachment_path]
+    for path in attachment_paths:
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                part = MIMEApplication(f.read(), Name=os.path.basename(path))
+            part['Content-Disposition'] = f'attachment; filename="{os.path.basename(path)}"'
+            msg.attach(part)
+            logging.info(f"Fichier joint: {path}")
+    return msg
+
+
 def send_email(subject, body_html, attachment_path=None, recipients=None):
     config = load_config()
     SMTP_SERVER = config['email']['smtp_server']
@@ -70,22 +564,9 @@ def send_email(subject, body_html, attachment_path=None, recipients=None):
         logging.error("Aucun destinataire fourni.")
         return
 
-    msg = MIMEMultipart('alternative')
-    msg['From'] = SENDER_EMAIL
-    msg['To'] = ", ".join(recipients)
-    msg['Subject'] = subject
-
-    # Corps du message HTML
-    msg.attach(MIMEText(body_html, 'html'))
-
-    # Pièce jointe
-    if attachment_path and os.path.exists(attachment_path):
-        with open(attachment_path, "rb") as f:
-            part = MIMEApplication(f.read(), Name=os.path.basename(attachment_path))
-        part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment_path)}"'
-        msg.attach(part)
-        logging.info(f"Fichier joint: {attachment_path}")
+    msg = construire_message(SENDER_EMAIL, subject, body_html, attachment_path, recipients)
 
+    import smtplib
     try:
         with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
             server.starttls()
@@ -97,9 +97,10 @@ def run_query(connection, query, params=None):
         logger.error(f"Erreur générale (pandas?) lors de l'exécution de la requête: {e}")
         return pd.DataFrame()
 
-def generate_html_table(df, title="", etat=None):
+def generate_html_table(df, title="", etat=None, max_lignes=500):
     """
     Génère un tableau HTML compatible avec les clients email.
+    Au-delà de max_lignes, seules les premières lignes sont affichées (détail en pièce jointe).
     """
     if df.empty:
         return f"<h3 style='color: #2c3e50;'>{title}</h3><p>Aucune facture {etat if etat else ''} en attente</p>"
@@ -111,6 +112,8 @@ def generate_html_table(df, title="", etat=None):
         'ESTADO': 'ETAT',
         'FECFACTURA': 'DATE'
     })
+    if max_lignes is not None and len(df_display) > max_lignes:
+        df_display = df_display.head(max_lignes)
     
     # HTML optimisé pour les emails - EN-TÊTES EN GRIS
     html_table = f"""
@@ -125,22 +128,24 @@ def generate_html_table(df, title="", etat=None):
             </tr>
     """
     
-    # Alternance de couleurs pour les lignes
-    for i, (_, row) in enumerate(df_display.iterrows()):
-        bg_color = "#f2f2f2" if i % 2 == 0 else "#ffffff"
-        html_table += f"""
-            <tr style="background-color: {bg_color};">
-                <td style="border: 1px solid #ddd; padding: 10px;">{row['IDFACTURE']}</td>
-                <td style="border: 1px solid #ddd; padding: 10px;">{row['NUMFACTURE']}</td>
-                <td style="border: 1px solid #ddd; padding: 10px;"><strong>{row['ETAT']}</strong></td>
-                <td style="border: 1px solid #ddd; padding: 10px;">{row['DATE']}</td>
-            </tr>
-        """
+    # Alternance de couleurs pour les lignes (construction colonne par colonne, sans iterrows)
+    bg_colors = pd.Series(["#f2f2f2", "#ffffff"] * (len(df_display) // 2 + 1))[:len(df_display)].values
+    td = '<td style="border: 1px solid #ddd; padding: 10px;">'
+    lignes = (
+        '<tr style="background-color: ' + pd.Series(bg_colors, index=df_display.index) + ';">'
+        + td + df_display['IDFACTURE'].astype(str) + '</td>'
+        + td + df_display['NUMFACTURE'].astype(str) + '</td>'
+        + td + '<strong>' + df_display['ETAT'].astype(str) + '</strong></td>'
+        + td + df_display['DATE'].astype(str) + '</td>'
+        + '</tr>'
+    )
+    html_table += "\n".join(lignes)
     
     html_table += f"""
         </table>
         <p style="margin: 10px 0 0 0; color: #666; font-style: italic; font-family: Arial, sans-serif;">
             Total: <strong>{len(df)}</strong> facture(s)
+            {f"({len(df_display)} affichées, liste complète dans le fichier Excel joint)" if len(df_display) < len(df) else ""}
         </p>
     </div>
     """